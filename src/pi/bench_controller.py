@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the controller's hot paths: checksums, frame encoding and decoding, move parsing,
+game state checks, legal move validation, a full HUMAN_MOVE -> ROBOT_MOVE cycle against a
+fixed-nodes engine, and the robot's first move of a game with the engine cleared between games
+(first_move_async) or right before the first search (first_move_sync). Each benchmark runs for a
+fixed time budget, so the whole suite finishes in well under a minute on the Raspberry Pi.
+
+Results are stored as JSON, and two result files (e.g. from two commits) can be compared to
+flag regressions.
+
+Usage:
+    python bench_controller.py run [--output FILE] [--engine PATH] [--nodes N] [--budget SECONDS]
+    python bench_controller.py compare BASELINE.json CANDIDATE.json [--threshold PERCENT]
+"""
+
+import argparse
+import contextlib
+import datetime
+import functools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import chess
+import chess.engine
+import chess_robot_v7 as robot
+
+# A middlegame position with castling, en passant, captures and a promotion available to white
+BENCH_FEN = "r3k2r/1P3ppp/8/3pP3/8/8/5PPP/R3K2R w KQkq d6 0 1"
+BENCH_MOVES = ["e1g1", "e5d6", "a1a8", "b7b8q", "f2f4"]
+
+# Number of timing repeats per benchmark; the median of these is reported
+REPEATS = 5
+
+
+class MemorySerial:
+    """
+    An in-memory serial port. Bytes queued with feed() are returned by read(); writes are counted
+    and discarded.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.bytes_written = 0
+
+    def feed(self, data) -> None:
+        self._buffer += bytes(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def write(self, data) -> int:
+        self.bytes_written += len(data)
+        return len(data)
+
+    def reset_input_buffer(self) -> None:
+        pass
+
+    def reset_output_buffer(self) -> None:
+        pass
+
+
+def time_function(function, budget: float) -> dict:
+    """
+    Times a function, picking the number of loops per repeat so all repeats fit in the budget.
+
+    :param function: A function taking no arguments
+    :param budget: The approximate total time to spend, in seconds
+
+    :returns: A dictionary with the median, minimum and standard deviation of the time per call in
+              nanoseconds, plus the repeat and loop counts
+    """
+    # Calibrate with a single call, then size the loops to the per-repeat budget
+    start = time.perf_counter_ns()
+    function()
+    single = max(time.perf_counter_ns() - start, 1)
+    loops = max(1, int(budget * 1e9 / REPEATS / single))
+
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            function()
+        samples.append((time.perf_counter_ns() - start) / loops)
+
+    return {
+        "median_ns": statistics.median(samples),
+        "min_ns": min(samples),
+        "stdev_ns": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "repeats": REPEATS,
+        "loops": loops,
+    }
+
+
+def protocol_benchmarks() -> dict:
+    """
+    :returns: A dictionary mapping benchmark names to functions taking no arguments
+    """
+    board = chess.Board(BENCH_FEN)
+    robot_move = [robot.START_BYTE, robot.ROBOT_MOVE_INSTR_AND_LEN] + [ord(c) for c in "e5d6"] + [ord("E"), 0x11]
+    human_move_frame = robot.encode_frame(robot.HUMAN_MOVE_INSTR, [ord(c) for c in "e2e4_"])
+    decode_serial = MemorySerial()
+    moves = [chess.Move.from_uci(m) for m in BENCH_MOVES]
+
+    def decode_frame():
+        decode_serial.feed(human_move_frame)
+        robot.read_frame(decode_serial)
+
+    def validate_moves():
+        for move in moves:
+            move in board.legal_moves
+
+    return {
+        "fletcher16_check_bytes": lambda: robot.fl16_get_check_bytes(robot.fletcher16_nums(robot_move)),
+        "validate_transmission": lambda: robot.validate_transmission(human_move_frame),
+        "encode_frame": lambda: robot.encode_frame(robot.ROBOT_MOVE_INSTR, robot_move[2:]),
+        "decode_frame": decode_frame,
+        "parse_move": lambda: (robot.parse_move("e2e4_"), robot.parse_move("b7b8q")),
+        "get_fifth_byte": lambda: [robot.get_fifth_byte(board, m) for m in BENCH_MOVES],
+        "check_game_state": lambda: robot.check_game_state(board),
+        "legal_move_validation": validate_moves,
+    }
+
+
+def cycle_benchmark(engine: chess.engine.SimpleEngine, nodes: int):
+    """
+    Builds a full HUMAN_MOVE -> ROBOT_MOVE cycle through ChessRobot.step(): decode and ACK the
+    human's move, push it, search with a fixed node budget, push the robot's move, send it, and
+    wait for the ACK. Both moves are popped afterwards so every call starts from the same position.
+
+    :param engine: The running engine
+    :param nodes: The node budget of each search
+
+    :returns: A function taking no arguments
+    """
+    ser = MemorySerial()
+    controller = robot.ChessRobot(ser, engine)
+    controller.limit = chess.engine.Limit(nodes=nodes)
+    human_move_frame = robot.encode_frame(robot.HUMAN_MOVE_INSTR, [ord(c) for c in "e2e4_"])
+
+    def cycle():
+        ser.feed(human_move_frame)
+        ser.feed([robot.ACK_BYTE])
+        controller.step()
+        controller.board.pop()
+        controller.board.pop()
+        controller.record.moves.clear()
+
+    return cycle
+
+
+def time_first_moves(engine: chess.engine.SimpleEngine, nodes: int, sync_newgame: bool, budget: float) -> dict:
+    """
+    Times the robot's first move of a game: START_B is decoded and ACKed, the engine searches with
+    a fixed node budget, and ROBOT_MOVE is sent. Between games the controller gets an idle gap
+    (untimed) as it would while the pieces are reset, so with sync_newgame=False the engine is
+    cleared there; with sync_newgame=True the clear is part of the first move.
+
+    :param engine: The running engine
+    :param nodes: The node budget of each search
+    :param sync_newgame: Passed to ChessRobot (see game_lifecycle.py)
+    :param budget: The approximate total time to spend, in seconds
+
+    :returns: A dictionary in the same format as time_function(), with one loop per repeat
+    """
+    ser = MemorySerial()
+    controller = robot.ChessRobot(ser, engine, sync_newgame=sync_newgame)
+    controller.limit = chess.engine.Limit(nodes=nodes)
+    start_b_frame = robot.encode_frame(robot.START_B_INSTR)
+
+    samples = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < REPEATS or (time.perf_counter() < deadline and len(samples) < 50):
+        # The idle gap after the previous game
+        controller.lifecycle.prepare()
+        controller.lifecycle.wait()
+
+        ser.feed(start_b_frame)
+        ser.feed([robot.ACK_BYTE])
+        start = time.perf_counter_ns()
+        controller.step()
+        samples.append(time.perf_counter_ns() - start)
+
+    return {
+        "median_ns": statistics.median(samples),
+        "min_ns": min(samples),
+        "stdev_ns": statistics.stdev(samples),
+        "repeats": len(samples),
+        "loops": 1,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> int:
+    benchmarks = protocol_benchmarks()
+
+    engine = None
+    if args.nodes > 0:
+        try:
+            engine = chess.engine.SimpleEngine.popen_uci(args.engine)
+            engine.configure({"Hash": 64})
+            benchmarks["human_robot_cycle"] = cycle_benchmark(engine, args.nodes)
+            benchmarks["first_move_async"] = functools.partial(time_first_moves, engine, args.nodes, False)
+            benchmarks["first_move_sync"] = functools.partial(time_first_moves, engine, args.nodes, True)
+        except (OSError, chess.engine.EngineError) as e:
+            print(f"Skipping the engine benchmarks; could not start {args.engine}: {e}", flush=True)
+
+    results = {}
+    try:
+        for name, function in benchmarks.items():
+            if args.filter and args.filter not in name:
+                continue
+            # The controller logs to stdout; discard it so only the work itself is timed
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                if name.startswith("first_move"):
+                    # These time one game start per sample themselves
+                    results[name] = function(args.budget * 4)
+                else:
+                    budget = args.budget * (4 if name == "human_robot_cycle" else 1)
+                    results[name] = time_function(function, budget)
+            print(f"{name:26s} {results[name]['median_ns'] / 1000:12.2f} us  (+/- {results[name]['stdev_ns'] / 1000:.2f} us)", flush=True)
+    finally:
+        if engine is not None:
+            engine.quit()
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "chess": chess.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "nodes": args.nodes if "human_robot_cycle" in results else None,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Saved results to {args.output}", flush=True)
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"Baseline:  {baseline['meta'].get('commit')} ({baseline['meta'].get('date')}, {baseline['meta'].get('machine')})")
+    print(f"Candidate: {candidate['meta'].get('commit')} ({candidate['meta'].get('date')}, {candidate['meta'].get('machine')})")
+
+    regressions = []
+    for name, new in candidate["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:26s} {'(new)':>12s}")
+            continue
+        change = (new["median_ns"] - old["median_ns"]) / old["median_ns"] * 100
+        # Only flag a change bigger than both the threshold and the noise of the two runs
+        noise = (old["stdev_ns"] + new["stdev_ns"]) / old["median_ns"] * 100
+        flag = ""
+        if change > max(args.threshold, noise):
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -max(args.threshold, noise):
+            flag = "  improved"
+        print(f"{name:26s} {old['median_ns'] / 1000:10.2f} us -> {new['median_ns'] / 1000:10.2f} us  {change:+7.1f}%{flag}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold}%: {', '.join(regressions)}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the controller's hot paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and save the results")
+    run_parser.add_argument("--output", default="bench_results.json", help="The JSON file to write results to")
+    run_parser.add_argument("--engine", default=robot.STOCKFISH_PATH, help="The Stockfish binary for the engine benchmarks")
+    run_parser.add_argument("--nodes", type=int, default=20000, help="Node budget per search in the engine benchmarks (0 to skip them)")
+    run_parser.add_argument("--budget", type=float, default=1.0, help="Seconds spent on each benchmark")
+    run_parser.add_argument("--filter", default=None, help="Only run benchmarks whose name contains this string")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files and flag regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="Slowdown, in percent, that counts as a regression")
+
+    args = parser.parse_args()
+    return run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
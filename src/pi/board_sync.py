@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Compact binary positions for BOARD_SYNC, which lets the Pi and the MSP check that they agree on
+the board and restore it without a RESET.
+
+A position is encoded in at most 27 bytes (a FEN would take up to ~90):
+- 8 bytes: the occupancy bitboard, big-endian (bit 0 is a1, bit 63 is h8)
+- one nibble per occupied square, from a1 to h8, high nibble first (padded to a whole byte):
+    0-5    white pawn, knight, bishop, rook, queen, king
+    6-11   black pawn, knight, bishop, rook, queen, king
+    12     a pawn that can be captured en passant (its color follows from its rank)
+    13, 14 a white or black rook that can still castle
+    15     the black king, when black is to move
+- 1 byte: the halfmove clock (capped at 255)
+- 2 bytes: the fullmove number, big-endian
+
+The position's hash is the CRC-32 of its encoding, so both sides can compute it from their own
+board without Zobrist tables (the MSP432 has a CRC-32 module). A full BOARD_SYNC carries the
+encoding followed by the hash; the periodic check carries just the 4-byte hash.
+"""
+
+import zlib
+
+import chess
+
+# Bytes in a hash-only BOARD_SYNC
+HASH_LEN = 4
+
+# Nibble codes beyond the 12 plain pieces
+EN_PASSANT_PAWN = 12
+WHITE_CASTLING_ROOK = 13
+BLACK_CASTLING_ROOK = 14
+BLACK_KING_TO_MOVE = 15
+
+
+def encode_position(board: chess.Board) -> bytes:
+    """
+    :param board: A standard chess position
+
+    :returns: Its compact encoding
+    """
+    ep_pawn = None
+    if board.has_legal_en_passant():
+        ep_pawn = board.ep_square + (8 if board.turn == chess.BLACK else -8)
+    castling = board.clean_castling_rights()
+    nibbles = []
+    for square in chess.scan_forward(board.occupied):
+        piece = board.piece_at(square)
+        if square == ep_pawn:
+            code = EN_PASSANT_PAWN
+        elif piece.piece_type == chess.ROOK and castling & chess.BB_SQUARES[square]:
+            code = WHITE_CASTLING_ROOK if piece.color == chess.WHITE else BLACK_CASTLING_ROOK
+        elif piece.piece_type == chess.KING and piece.color == chess.BLACK and board.turn == chess.BLACK:
+            code = BLACK_KING_TO_MOVE
+        else:
+            code = piece.piece_type - 1 + (0 if piece.color == chess.WHITE else 6)
+        nibbles.append(code)
+    if len(nibbles) % 2:
+        nibbles.append(0)
+    pieces = bytes((nibbles[i] << 4) | nibbles[i + 1] for i in range(0, len(nibbles), 2))
+    return (board.occupied.to_bytes(8, "big") + pieces + bytes([min(board.halfmove_clock, 255)])
+            + min(board.fullmove_number, 0xFFFF).to_bytes(2, "big"))
+
+
+def decode_position(data: bytes) -> chess.Board:
+    """
+    :param data: A compact encoding (see encode_position)
+
+    :returns: The position
+
+    :raises ValueError: If the encoding is malformed
+    """
+    occupied = int.from_bytes(data[0:8], "big")
+    squares = list(chess.scan_forward(occupied))
+    pieces_len = (len(squares) + 1) // 2
+    if len(data) != 8 + pieces_len + 3:
+        raise ValueError(f"expected {8 + pieces_len + 3} bytes for {len(squares)} pieces, got {len(data)}")
+    nibbles = [nibble for byte in data[8:8 + pieces_len] for nibble in (byte >> 4, byte & 0x0F)]
+
+    board = chess.Board(None)
+    castling = chess.BB_EMPTY
+    for square, code in zip(squares, nibbles):
+        if code == EN_PASSANT_PAWN:
+            color = chess.WHITE if chess.square_rank(square) == 3 else chess.BLACK
+            board.set_piece_at(square, chess.Piece(chess.PAWN, color))
+            # The pawn's side has just moved
+            board.turn = not color
+            board.ep_square = square - 8 if color == chess.WHITE else square + 8
+        elif code in (WHITE_CASTLING_ROOK, BLACK_CASTLING_ROOK):
+            board.set_piece_at(square, chess.Piece(chess.ROOK, code == WHITE_CASTLING_ROOK))
+            castling |= chess.BB_SQUARES[square]
+        elif code == BLACK_KING_TO_MOVE:
+            board.set_piece_at(square, chess.Piece(chess.KING, chess.BLACK))
+            board.turn = chess.BLACK
+        else:
+            board.set_piece_at(square, chess.Piece(code % 6 + 1, code < 6))
+    board.castling_rights = castling
+    board.halfmove_clock = data[8 + pieces_len]
+    board.fullmove_number = int.from_bytes(data[9 + pieces_len:11 + pieces_len], "big")
+    return board
+
+
+def position_hash(data: bytes) -> bytes:
+    """
+    :param data: A compact encoding
+
+    :returns: Its HASH_LEN-byte hash, big-endian
+    """
+    return zlib.crc32(data).to_bytes(HASH_LEN, "big")
+
+
+def sync_operand(board: chess.Board) -> bytes:
+    """
+    :returns: The operand of a full BOARD_SYNC for board: its encoding followed by its hash
+    """
+    data = encode_position(board)
+    return data + position_hash(data)
+
+
+def check_operand(board: chess.Board) -> bytes:
+    """
+    :returns: The operand of a hash-only BOARD_SYNC for board
+    """
+    return position_hash(encode_position(board))
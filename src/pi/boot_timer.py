@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Time-to-ready measurement for the Raspberry Pi controller. Milestones are measured from the start
+of the controller's process (including interpreter start-up, read from /proc where available), so
+the figure logged at each boot is the time the robot was actually unresponsive.
+"""
+
+import datetime
+import json
+import os
+import time
+
+
+def process_age() -> float:
+    """
+    :returns: The number of seconds since the current process was started, or 0.0 if this cannot
+              be determined (non-Linux hosts)
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # The process name may contain spaces, so split after its closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        start_ticks = int(fields[19])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class BootTimer:
+    """
+    Records named milestones during start-up, in milliseconds since the process started.
+    """
+
+    def __init__(self):
+        self._origin = time.monotonic() - process_age()
+        self.milestones = {}
+
+    def mark(self, name: str) -> float:
+        """
+        Records a milestone at the current time. Safe to call from any thread.
+
+        :param name: The milestone name
+
+        :returns: The milestone time in milliseconds since the process started
+        """
+        elapsed = (time.monotonic() - self._origin) * 1000
+        self.milestones[name] = round(elapsed, 1)
+        return elapsed
+
+    def report(self, mode: str, log_path: str = None) -> None:
+        """
+        Prints the milestones and, if a log path is given, appends them to it as one JSON line so
+        boots can be compared over time.
+
+        :param mode: A label for how the controller was started (e.g. "fast" or "sequential")
+        :param log_path: A file to append the boot record to, or None
+        """
+        ordered = sorted(self.milestones.items(), key=lambda item: item[1])
+        print(f"Time to ready ({mode} start): " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in ordered), flush=True)
+        if log_path is None:
+            return
+        with open(log_path, "a") as f:
+            f.write(json.dumps({"date": datetime.datetime.now().isoformat(timespec="seconds"), "mode": mode,
+                                "milestones": self.milestones}) + "\n")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Builds every Stockfish variant the host's CPU supports, benchmarks them, and installs the fastest.
+
+Each candidate ARCH (picked from the CPU's features, see CANDIDATE_ARCHS) is compiled from
+stockfish/src both as a standard build and as a profile-build (PGO), in a scratch copy of the
+source so the tree stays clean. Every binary then runs Stockfish's built-in "bench" (fixed
+positions, depth 13, 1 thread, 16 MB hash), and:
+- builds whose node count differs from the others are rejected, since the search must be
+  identical and only the speed may differ
+- the build with the highest median nodes per second is copied to the install directory, with a
+  manifest.json describing it and every other result
+
+The controller reads the manifest at start-up (see installed_engine) and falls back to the
+default binary if there is none, or if it was built for a different machine.
+
+Usage:
+    python build_matrix.py [--source DIR] [--install DIR] [--arch ARCH ...] [--no-pgo] [--runs N] [--jobs N]
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# DEFAULT PATHS (relative to the repository)
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+DEFAULT_SOURCE = os.path.join(REPO_ROOT, "stockfish", "src")
+DEFAULT_INSTALL = os.path.join(REPO_ROOT, "stockfish", "bin")
+MANIFEST_NAME = "manifest.json"
+
+# Candidate ARCH targets per machine, fastest first, each with the /proc/cpuinfo flags it needs
+CANDIDATE_ARCHS = {
+    "x86_64": [
+        ("x86-64-vnni512", {"avx512_vnni", "avx512bw", "avx512f", "bmi2"}),
+        ("x86-64-avx512", {"avx512bw", "avx512f", "bmi2"}),
+        ("x86-64-avxvnni", {"avx_vnni", "avx2", "bmi2"}),
+        ("x86-64-bmi2", {"avx2", "bmi2", "popcnt"}),
+        ("x86-64-avx2", {"avx2", "popcnt"}),
+        ("x86-64-sse41-popcnt", {"sse4_1", "popcnt"}),
+        ("x86-64-ssse3", {"ssse3"}),
+        ("x86-64", set()),
+    ],
+    "aarch64": [
+        ("armv8", {"asimd"}),
+        ("general-64", set()),
+    ],
+    "armv7l": [
+        ("armv7-neon", {"neon"}),
+        ("armv7", set()),
+        ("general-32", set()),
+    ],
+}
+
+# Number of bench runs per build; the median nodes per second is used
+BENCH_RUNS = 3
+
+
+def cpu_flags() -> set:
+    """
+    :returns: The CPU feature flags from /proc/cpuinfo ("flags" on x86, "Features" on ARM)
+    """
+    flags = set()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() in ("flags", "Features"):
+                    flags.update(value.split())
+    except OSError:
+        pass
+    return flags
+
+
+def candidate_archs() -> list:
+    """
+    :returns: The ARCH targets this CPU supports, fastest first
+    """
+    flags = cpu_flags()
+    return [arch for arch, needed in CANDIDATE_ARCHS.get(platform.machine(), []) if needed <= flags]
+
+
+def build(workdir: str, arch: str, pgo: bool, jobs: int, log_path: str) -> bool:
+    """
+    Compiles one variant in the working copy; the binary is left at workdir/stockfish.
+
+    :param workdir: A scratch copy of stockfish/src
+    :param arch: The Makefile ARCH
+    :param pgo: True for a profile-build, False for a standard build
+    :param jobs: The number of parallel compile jobs
+    :param log_path: The file the compiler output is written to
+
+    :returns: True if the build succeeded
+    """
+    target = "profile-build" if pgo else "build"
+    with open(log_path, "w") as log:
+        subprocess.run(["make", "clean"], cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        result = subprocess.run(["make", f"-j{jobs}", target, f"ARCH={arch}"], cwd=workdir,
+                                stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode == 0 and os.path.exists(os.path.join(workdir, "stockfish"))
+
+
+def bench(binary: str, runs: int = BENCH_RUNS) -> dict:
+    """
+    Runs Stockfish's built-in benchmark.
+
+    :param binary: The Stockfish binary
+    :param runs: The number of times to run it
+
+    :returns: A dictionary with the node count ("nodes", from the last run) and the nodes per
+              second of every run ("nps"), or None if the output could not be parsed
+    """
+    nodes, nps = None, []
+    for _ in range(runs):
+        output = subprocess.run([binary, "bench"], capture_output=True, text=True).stderr
+        nodes_match = re.search(r"Nodes searched\s*:\s*(\d+)", output)
+        nps_match = re.search(r"Nodes/second\s*:\s*(\d+)", output)
+        if nodes_match is None or nps_match is None:
+            return None
+        nodes = int(nodes_match.group(1))
+        nps.append(int(nps_match.group(1)))
+    return {"nodes": nodes, "nps": nps}
+
+
+def compiler_version() -> str:
+    try:
+        return subprocess.run(["g++", "--version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def installed_engine(manifest_path: str, default: str) -> str:
+    """
+    Looks up the binary installed by this tool.
+
+    :param manifest_path: The manifest written by this tool
+    :param default: The binary to use if there is no usable manifest
+
+    :returns: The path of the Stockfish binary to run
+    """
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return default
+    if manifest.get("machine") != platform.machine() or not os.path.exists(manifest.get("binary", "")):
+        print(f"Ignoring {manifest_path}; it does not match this machine", flush=True)
+        return default
+    print(f"Using Stockfish build {manifest['variant']} ({manifest['nps']} nps in bench)", flush=True)
+    return manifest["binary"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, benchmark and install the fastest Stockfish for this host")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="The Stockfish source directory")
+    parser.add_argument("--install", default=DEFAULT_INSTALL, help="The directory to install the fastest binary and manifest to")
+    parser.add_argument("--arch", nargs="+", default=None, help="ARCH targets to try (default: all the CPU supports)")
+    parser.add_argument("--no-pgo", action="store_true", help="Skip the profile-build variants")
+    parser.add_argument("--runs", type=int, default=BENCH_RUNS, help="bench runs per build")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Parallel compile jobs")
+    args = parser.parse_args()
+
+    archs = args.arch if args.arch is not None else candidate_archs()
+    if not archs:
+        print(f"No candidate ARCH targets for {platform.machine()}; pass --arch", flush=True)
+        return 1
+    variants = [(arch, pgo) for arch in archs for pgo in ([False] if args.no_pgo else [False, True])]
+    print(f"Building {len(variants)} variants: {', '.join(archs)}", flush=True)
+
+    os.makedirs(args.install, exist_ok=True)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="stockfish-build-") as scratch:
+        workdir = os.path.join(scratch, "src")
+        # The NNUE net is copied along, so it is only downloaded once (if at all)
+        shutil.copytree(args.source, workdir, ignore=shutil.ignore_patterns("*.o", "stockfish", "*.gcda", "profdir"))
+        for arch, pgo in variants:
+            name = f"{arch}-{'pgo' if pgo else 'std'}"
+            log_path = os.path.join(scratch, f"{name}.log")
+            print(f"{name}: building...", flush=True)
+            if not build(workdir, arch, pgo, args.jobs, log_path):
+                with open(log_path) as f:
+                    tail = f.read().splitlines()[-3:]
+                print(f"{name}: build failed\n  " + "\n  ".join(tail), flush=True)
+                results.append({"variant": name, "arch": arch, "pgo": pgo, "status": "build failed"})
+                continue
+            binary = os.path.join(scratch, f"stockfish-{name}")
+            shutil.copy2(os.path.join(workdir, "stockfish"), binary)
+            measured = bench(binary, args.runs)
+            if measured is None:
+                print(f"{name}: bench failed", flush=True)
+                results.append({"variant": name, "arch": arch, "pgo": pgo, "status": "bench failed"})
+                continue
+            nps = int(statistics.median(measured["nps"]))
+            print(f"{name}: {measured['nodes']} nodes, {nps} nps", flush=True)
+            results.append({"variant": name, "arch": arch, "pgo": pgo, "status": "ok", "binary": binary,
+                            "nodes": measured["nodes"], "nps": nps, "nps_runs": measured["nps"]})
+
+        # Every correct build searches exactly the same tree; reject the ones that disagree
+        benched = [result for result in results if result["status"] == "ok"]
+        if not benched:
+            print("No build succeeded; nothing installed", flush=True)
+            return 1
+        reference_nodes = collections.Counter(result["nodes"] for result in benched).most_common(1)[0][0]
+        for result in benched:
+            if result["nodes"] != reference_nodes:
+                result["status"] = "node mismatch"
+                print(f"{result['variant']}: rejected; {result['nodes']} nodes instead of {reference_nodes}", flush=True)
+        best = max((result for result in benched if result["status"] == "ok"), key=lambda result: result["nps"])
+
+        installed = os.path.join(args.install, "stockfish")
+        shutil.copy2(best["binary"], installed)
+    for result in results:
+        result.pop("binary", None)
+
+    manifest = {
+        "binary": installed,
+        "variant": best["variant"],
+        "arch": best["arch"],
+        "pgo": best["pgo"],
+        "nodes": best["nodes"],
+        "nps": best["nps"],
+        "machine": platform.machine(),
+        "compiler": compiler_version(),
+        "built": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+    with open(os.path.join(args.install, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Installed {best['variant']} ({best['nps']} nps) to {installed}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
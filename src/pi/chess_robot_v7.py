@@ -6,11 +6,45 @@ board state, and generate new moves to send to the MSP for the robot to make. Ad
 uses python-serial to enable straightforward UART communication with the MSP.
 """
 
-import chess
-import chess.engine
+from __future__ import annotations
+
 import serial
 import sys
+import argparse
 import datetime
+import os
+import threading
+import time
+import boot_timer
+import build_matrix
+import game_journal
+import host_profile
+import robot_trace
+import uart_capture
+
+# python-chess (and asyncio, which chess.engine pulls in) accounts for most of the import time on
+# the Pi. With --fast-start these are imported on a background thread while the UART is already
+# being served (see import_heavy_modules)
+FAST_START = __name__ == "__main__" and "--fast-start" in sys.argv[1:]
+if not FAST_START:
+    import chess
+    import chess.engine
+    import chess.polyglot
+    import board_sync
+    import difficulty
+    import early_stop
+    import engine_daemon
+    import engine_scheduler
+    import engine_watchdog
+    import game_analysis
+    import game_archive
+    import game_clock
+    import game_lifecycle
+    import gantry_planner
+    import move_cache
+    import node_calibration
+    import occupancy
+    import search_stats
 
 __author__ = "Keenan Alchaar"
 __copyright__ = "Copyright 2022"
@@ -29,6 +63,16 @@ START_B_INSTR        =   0x02
 HUMAN_MOVE_INSTR     =   0x03
 ROBOT_MOVE_INSTR     =   0x04
 ILLEGAL_MOVE_INSTR   =   0x05
+BUSY_INSTR           =   0x06
+DIFFICULTY_INSTR     =   0x07
+CLOCK_INSTR          =   0x08
+BOARD_INSTR          =   0x09
+GANTRY_READY_INSTR   =   0x0A
+RESUMED_INSTR        =   0x0B
+BOARD_STATE_INSTR    =   0x0C
+AMBIGUOUS_MOVE_INSTR =   0x0D
+BOARD_SYNC_INSTR     =   0x0E
+ROBOT_PLAN_INSTR     =   0x0F
 
 # GAME STATUS CODES
 GAME_ONGOING      =   0x01
@@ -42,6 +86,17 @@ START_B_INSTR_AND_LEN       =     0x20
 HUMAN_MOVE_INSTR_AND_LEN    =     0x35
 ROBOT_MOVE_INSTR_AND_LEN    =     0x46
 ILLEGAL_MOVE_INSTR_AND_LEN  =     0x50
+BUSY_INSTR_AND_LEN          =     0x60
+DIFFICULTY_INSTR_AND_LEN    =     0x72
+CLOCK_INSTR_AND_LEN         =     0x8A
+BOARD_INSTR_AND_LEN         =     0x91
+GANTRY_READY_INSTR_AND_LEN  =     0xA0
+RESUMED_INSTR_AND_LEN       =     0xB2
+BOARD_STATE_INSTR_AND_LEN   =     0xC8
+AMBIGUOUS_MOVE_INSTR_AND_LEN =    0xD8
+BOARD_SYNC_INSTR_AND_LEN    =     0xEF             # Extended length; the full position's length byte follows
+BOARD_SYNC_CHECK_INSTR_AND_LEN =  0xE4
+ROBOT_PLAN_INSTR_AND_LEN    =     0xF6             # 2 bytes per transfer; 0xF2, 0xF4 or 0xF6
 
 # FULL INSTRUCTIONS
 RESET            =       0x0A00           # Reset a terminated game
@@ -50,42 +105,299 @@ START_B          =       0x0A20           # Start signal if human plays black (g
 HUMAN_MOVE       =       0x0A350000000000 # 5 operand bytes for UCI representation of move (fill in trailing zeroes with move)
 ROBOT_MOVE       =       0x0A460000000000 # 5 operand bytes for UCI representation of move (fill in trailing zeroes with move)
 ILLEGAL_MOVE     =       0x0A50           # Declare the human has made an illegal move
+BUSY             =       0x0A60           # The Pi is still starting up; resend the last instruction later
+DIFFICULTY       =       0x0A720000       # 2 operand bytes for the target Elo, big-endian (0 for full strength)
+CLOCK            =       0x0A8A00000000000000000000 # 10 operand bytes, big-endian: white and black time left (ms, 3 bytes each), white and black increment (ms, 2 bytes each)
+BOARD            =       0x0A9100         # Simul mode: 1 operand byte, the board the next instruction is for (either direction)
+GANTRY_READY     =       0x0AA0           # Simul mode: the gantry has finished the last robot move
+RESUMED          =       0x0AB20000       # The Pi resumed a game from its journal; 2 operand bytes: the human's color (START_W_INSTR or START_B_INSTR) and the number of plies played (mod 256)
+BOARD_STATE      =       0x0AC80000000000000000 # 8 operand bytes: the reed switches' occupancy bitboard, big-endian (bit 0 is a1, bit 63 is h8); the Pi infers the human's move from it
+AMBIGUOUS_MOVE   =       0x0AD80000000000000000 # 8 operand bytes: the BOARD_STATE fits several moves; bitboard of the squares involved (resolve with HUMAN_MOVE)
+BOARD_SYNC       =       0x0AEF00         # Either direction: a length byte, then the compact position and its 4-byte hash (see board_sync.py); restores the receiver's board
+BOARD_SYNC_CHECK =       0x0AE400000000   # MSP to Pi: 4 operand bytes, the hash of the MSP's position; answered with a BOARD_SYNC if the Pi's differs
+ROBOT_PLAN       =       0x0AF6000000000000 # Pi to MSP, right before ROBOT_MOVE (--plan): the gantry's transfers for the move, 2 operand bytes each (pick and place location, see gantry_planner.py)
+
+# VALIDATION OF RECEIVED INSTRUCTIONS
+# An operand length of uart_capture.EXTENDED_OP_LEN means a byte with the real length follows (see uart_capture.frame_length)
+VALID_OP_LENS    =       [0, 1, 2, 4, 5, 8, 10, uart_capture.EXTENDED_OP_LEN] # Operand lengths present in this instruction set
+MAX_INSTR        =       ROBOT_PLAN_INSTR # Highest instruction ID in this instruction set
 
 # MOVE TIME (seconds)
 MOVE_TIME = 2
 
+# MOVE OVERHEAD (ms) Stockfish keeps in reserve per move when searching on the game clock, for the
+# UART round trip and the gantry starting to move before the MSP stops the robot's clock
+MOVE_OVERHEAD_MS = 1000
+MAX_MOVE_OVERHEAD_MS = 5000
+
+# STOCKFISH BINARY
+STOCKFISH_PATH = "/home/thegreatgambit/Documents/Capstone-PyChess/stockfish/src/stockfish"
+# Written by build_matrix.py; names the fastest build for this host, used instead of STOCKFISH_PATH
+STOCKFISH_MANIFEST = "/home/thegreatgambit/Documents/Capstone-PyChess/stockfish/bin/manifest.json"
+# Node budgets of the deterministic mode, per host and engine (see node_calibration.py)
+NODE_CALIBRATION = "/home/thegreatgambit/Documents/Capstone-PyChess/node_calibration.json"
+
+# LONGEST PONDER SEARCH (seconds) while the human thinks
+PONDER_TIME = 60
+
+# UART CONNECTED TO THE MSP
+SERIAL_PORT = "/dev/serial0"
+
+# UART READ TIMEOUT (seconds) while the engine is starting in --fast-start mode
+STARTUP_READ_TIMEOUT = 0.1
+
 def bytes_to_int(byte_stream):
     return int(byte_stream.hex(), 16)
 
+def parse_args(argv: list) -> argparse.Namespace:
+    """
+    Parses the command line arguments for the controller.
+
+    :param argv: The command line arguments, excluding the script name
+
+    :returns: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Raspberry Pi controller for The Great Gambit")
+    parser.add_argument("fen", nargs="?", default=None, help="Starting FEN (defaults to the standard position)")
+    parser.add_argument("--port", default=SERIAL_PORT, help=f"The serial port connected to the MSP (default {SERIAL_PORT})")
+    parser.add_argument("--trace", metavar="FILE", default=None, help="Write a Chrome Trace Event JSON timeline to FILE")
+    parser.add_argument("--records", metavar="DIR", default=None, help="Save a per-game record with search statistics to DIR")
+    parser.add_argument("--capture", metavar="FILE", default=None, help="Write a binary capture of all UART traffic to FILE")
+    parser.add_argument("--engine-socket", metavar="PATH", default=None,
+                        help="Attach to the engine daemon listening on PATH (see engine_daemon.py) instead of spawning Stockfish")
+    parser.add_argument("--fast-start", action="store_true",
+                        help="Serve the UART immediately (answering BUSY) while python-chess and the engine load in the background")
+    parser.add_argument("--boot-log", metavar="FILE", default=None, help="Append each boot's time-to-ready milestones to FILE")
+    parser.add_argument("--sync-newgame", action="store_true",
+                        help="Clear the engine right before each game's first search instead of between games (for comparing first-move latency)")
+    parser.add_argument("--deterministic", action="store_true",
+                        help="Search a fixed number of nodes per move (calibrated for this host to fit MOVE_TIME) with one thread and a fixed hash, so moves are reproducible")
+    parser.add_argument("--nodes", type=int, default=None, help="Node budget per move with --deterministic, instead of the calibrated one")
+    parser.add_argument("--nodestime", action="store_true",
+                        help="With --deterministic, also set Stockfish's nodestime so clock-based searches count nodes instead of milliseconds")
+    parser.add_argument("--early-stop", action="store_true",
+                        help="Stop a search once its best move is stable or a mate is found, instead of always using the full move time")
+    parser.add_argument("--early-stop-min", metavar="SECONDS", type=float, default=None,
+                        help="With --early-stop, never stop a search before this many seconds (default 0.3)")
+    parser.add_argument("--early-stop-max", metavar="SECONDS", type=float, default=None,
+                        help="With --early-stop, the time limit of every search (default MOVE_TIME)")
+    parser.add_argument("--ponder", action="store_true",
+                        help="Search the position after the human's expected reply while they think; preempted as soon as their move arrives")
+    parser.add_argument("--clock", metavar="MINUTES+INC", default=None,
+                        help="Track a game clock with this time control (e.g. 15+10) and search on it instead of MOVE_TIME; CLOCK instructions from the MSP override it")
+    parser.add_argument("--move-overhead", metavar="MS", type=int, default=MOVE_OVERHEAD_MS,
+                        help=f"Time Stockfish keeps in reserve per move when searching on the game clock (default {MOVE_OVERHEAD_MS})")
+    parser.add_argument("--archive", metavar="FILE", default=None,
+                        help="Add every finished game to the indexed game archive in FILE (see game_archive.py)")
+    parser.add_argument("--book", metavar="FILE", default=None,
+                        help="Play moves from the Polyglot opening book in FILE (see opening_book.py) instead of searching, at full strength")
+    parser.add_argument("--move-cache", metavar="FILE", default=None,
+                        help="Answer positions searched before (with the same limit) from the persistent move cache in FILE (see move_cache.py)")
+    parser.add_argument("--warmup", metavar="SOURCE", default=None,
+                        help="With --move-cache, search the most frequent positions of a game archive or a .pgn file until the first game starts")
+    parser.add_argument("--plan", action="store_true",
+                        help="Plan the gantry's pick-and-place order for each robot move and send it in ROBOT_PLAN (see gantry_planner.py)")
+    parser.add_argument("--journal", metavar="FILE", default=None,
+                        help="Journal the game in progress to FILE and resume it from there after a crash or power loss (see game_journal.py)")
+    parser.add_argument("--analyse", metavar="WORKERS", type=int, default=0,
+                        help="With --records, analyse every saved game on this many niced engines, paused while the robot searches (see game_analysis.py)")
+    return parser.parse_args(argv)
+
 def main():
+    boot = boot_timer.BootTimer()
+    args = parse_args(sys.argv[1:])
+    if args.early_stop and args.deterministic:
+        sys.exit("--early-stop depends on timing, so it cannot be combined with --deterministic; exiting...")
+    if args.ponder and args.deterministic:
+        sys.exit("--ponder changes the hash between moves, so it cannot be combined with --deterministic; exiting...")
+    if args.move_cache is not None and args.deterministic:
+        sys.exit("--move-cache answers without searching, so it cannot be combined with --deterministic; exiting...")
+    if args.warmup is not None and args.move_cache is None:
+        sys.exit("--warmup fills the move cache, so it needs --move-cache; exiting...")
+    if args.analyse and args.records is None:
+        sys.exit("--analyse writes next to the game records, so it needs --records; exiting...")
+    if not 0 <= args.move_overhead <= MAX_MOVE_OVERHEAD_MS:
+        sys.exit(f"--move-overhead must be between 0 and {MAX_MOVE_OVERHEAD_MS} ms; exiting...")
+
+    # Tracing is a no-op unless --trace is given
+    tracer = robot_trace.open_tracer(args.trace)
+    if tracer.enabled:
+        print(f"Writing trace to {args.trace}", flush=True)
+
     # Datetime header
     print("----------------------------------------------------", flush=True)
     print(f"chess_robot_v7.py run at: {datetime.datetime.now()}", flush=True)
     print("----------------------------------------------------", flush=True)
 
-    # Initialize the chess engine, give it a hash size of 64 MB, and create a new board
-    engine = chess.engine.SimpleEngine.popen_uci("/home/thegreatgambit/Documents/Capstone-PyChess/stockfish/src/stockfish")
-    engine.configure({"Hash": 64})
-    
+    # The deterministic mode uses the same engine options on every host; otherwise they are sized
+    # for this host. Evaluated lazily, since --fast-start imports node_calibration in the background.
+    # The engine daemon sizes its own Hash; resizing it from here would clear the hash it keeps warm
+    fixed_options = {"Move Overhead": args.move_overhead}
+    if args.deterministic:
+        engine_options = lambda current_hash_mb=0: {**node_calibration.DETERMINISTIC_OPTIONS, **fixed_options}
+    elif args.engine_socket is not None:
+        engine_options = lambda current_hash_mb=0: {**{name: value for name, value in host_profile.engine_options().items()
+                                                       if name != "Hash"}, **fixed_options}
+    else:
+        engine_options = lambda current_hash_mb=0: {**host_profile.engine_options(current_hash_mb), **fixed_options}
+
+    if args.fast_start:
+        # Open and drain the serial port first, then load python-chess and the engine in parallel
+        # with serving the UART, so the MSP gets answers (BUSY) from the first moment
+        ser = open_serial(args.capture, args.port)
+        boot.mark("serial ready")
+        startup = EngineStartup(args.engine_socket, boot, engine_options)
+        startup.start()
+        serve_until_ready(ser, startup.ready, tracer)
+        engine = startup.result()
+    else:
+        # Initialize the chess engine (or attach to the engine daemon)
+        engine = start_engine(args.engine_socket, engine_options)
+        boot.mark("engine ready")
+        ser = open_serial(args.capture, args.port)
+        boot.mark("serial ready")
+
+    # Search a fixed number of nodes per move, measured once per host to fit MOVE_TIME
+    if args.deterministic:
+        nodes = args.nodes
+        if nodes is None or args.nodestime:
+            calibration = node_calibration.calibrate(engine, MOVE_TIME * 1000, NODE_CALIBRATION,
+                                                     build_matrix.installed_engine(STOCKFISH_MANIFEST, STOCKFISH_PATH))
+            boot.mark("calibrated")
+            print(f"Node calibration: {calibration['nodes']} nodes fit {MOVE_TIME} s at {calibration['nps']} nps", flush=True)
+            if nodes is None:
+                nodes = calibration["nodes"]
+            if args.nodestime:
+                fixed_options["nodestime"] = max(1, calibration["nps"] // 1000)
+                engine.configure(engine_options(host_profile.configured_hash_mb(engine)))
+        print(f"Deterministic mode: {nodes} nodes per move", flush=True)
+
     # Accepts one command line argument for the starting FEN
-    if len(sys.argv) > 1:
+    if args.fen is not None:
         try:
-            board = chess.Board(fen=sys.argv[1])
-            print(f"Loaded board with FEN: {sys.argv[1]}", flush=True)
+            board = chess.Board(fen=args.fen)
+            print(f"Loaded board with FEN: {args.fen}", flush=True)
             print(board)
         except ValueError:
-            sys.exit("Received an invalid FEN string; exiting...", flush=True)
-    elif len(sys.argv) > 2:
-        sys.exit("Too many arguments provided; exiting...", flush=True)
+            sys.exit("Received an invalid FEN string; exiting...")
     else:
         board = chess.Board()
         print("Using default FEN", flush=True)
         print(board, flush=True)
 
+    boot.mark("ready")
+    boot.report("fast" if args.fast_start else "sequential", args.boot_log)
+
+    # The main program loop
+    robot = ChessRobot(ser, engine, board, tracer=tracer, records_dir=args.records, sync_newgame=args.sync_newgame,
+                       restart_engine=lambda: start_engine(args.engine_socket, engine_options), engine_options=engine_options)
+    if args.deterministic:
+        robot.limit = chess.engine.Limit(nodes=nodes)
+        robot.lifecycle.always_clear = True
+    if args.early_stop:
+        max_time = args.early_stop_max if args.early_stop_max is not None else MOVE_TIME
+        min_time = args.early_stop_min if args.early_stop_min is not None else early_stop.MIN_TIME
+        robot.limit = chess.engine.Limit(time=max_time)
+        robot.early_stop = early_stop.EarlyStop(max_time, min_time)
+        print(f"Early stop: searches take {min_time} to {max_time} s", flush=True)
+    if args.clock is not None:
+        try:
+            robot.clock = game_clock.GameClock(*game_clock.parse_time_control(args.clock))
+        except ValueError:
+            sys.exit("Received an invalid time control; exiting...")
+        print(f"Game clock: {args.clock}", flush=True)
+    robot.ponder = args.ponder
+    # Node-limited deterministic searches stay node-limited; with nodestime the clock counts nodes
+    robot.search_on_clock = not args.deterministic or args.nodestime
+    robot.book_path = args.book
+    if args.plan:
+        robot.planner = gantry_planner.GantryPlanner()
+        print("Planning gantry moves", flush=True)
+    if args.move_cache is not None:
+        robot.move_cache = move_cache.MoveCache(args.move_cache)
+        print(f"Move cache: {len(robot.move_cache)} entries", flush=True)
+    if args.archive is not None:
+        robot.archive = game_archive.GameArchive(args.archive)
+        print(f"Archiving games to {args.archive}", flush=True)
+    if args.analyse:
+        on_analysed = game_archive.analysis_archiver(args.archive) if args.archive is not None else None
+        robot.analysis = game_analysis.AnalysisPipeline(build_matrix.installed_engine(STOCKFISH_MANIFEST, STOCKFISH_PATH),
+                                                        args.analyse, live=robot.scheduler.live, on_analysed=on_analysed)
+        print(f"Post-game analysis: {args.analyse} engines, {robot.analysis.nodes} nodes per position", flush=True)
+    if args.journal is not None:
+        robot.journal = game_journal.open_journal(args.journal)
+        # A FEN on the command line starts from that position instead
+        if robot.journal.resumable is not None and args.fen is None:
+            robot.resume(robot.journal.resumable)
+    # The engine is idle until the first game starts; clear it for that game now
+    robot.lifecycle.prepare()
+    if args.warmup is not None:
+        load = move_cache.pgn_positions if args.warmup.endswith(".pgn") else move_cache.archive_positions
+        robot.warmup = move_cache.Warmup(robot.move_cache, robot.scheduler, robot.limit, robot.lifecycle,
+                                         lambda: load(args.warmup))
+        robot.warmup.start()
+    robot.run()
+
+    return 0
+
+
+def import_heavy_modules() -> None:
+    """
+    Imports python-chess and the modules depending on it into this module's globals. Only needed
+    with --fast-start; otherwise they are imported at the top of the file.
+    """
+    global chess, board_sync, difficulty, early_stop, engine_daemon, engine_scheduler, engine_watchdog, game_analysis, game_archive, game_clock, game_lifecycle, gantry_planner, move_cache, node_calibration, occupancy, search_stats
+    import chess
+    import chess.engine
+    import chess.polyglot
+    import board_sync
+    import difficulty
+    import early_stop
+    import engine_daemon
+    import engine_scheduler
+    import engine_watchdog
+    import game_analysis
+    import game_archive
+    import game_clock
+    import game_lifecycle
+    import gantry_planner
+    import move_cache
+    import node_calibration
+    import occupancy
+    import search_stats
+
+
+def start_engine(engine_socket: str, engine_options=host_profile.engine_options) -> chess.engine.SimpleEngine:
+    """
+    Starts the engine (or attaches to the engine daemon), configures it, and waits until it is
+    ready to search.
+
+    :param engine_socket: The engine daemon's socket, or None to spawn Stockfish
+    :param engine_options: A function taking the engine's current Hash (MB) that returns the UCI
+                           options to set (defaults to Threads and Hash sized for this host, see
+                           host_profile.py)
+
+    :returns: The running engine
+    """
+    engine = engine_daemon.open_engine(build_matrix.installed_engine(STOCKFISH_MANIFEST, STOCKFISH_PATH), engine_socket)
+    engine.configure(engine_options(host_profile.configured_hash_mb(engine)))
+    # Stockfish loads its NNUE network before answering, so this waits for the whole start-up
+    engine.ping()
+    return engine
+
+
+def open_serial(capture_path: str = None, port: str = SERIAL_PORT):
+    """
+    Opens and flushes the UART to the MSP.
+
+    :param capture_path: If given, all UART traffic is recorded to this file (see uart_capture.py)
+    :param port: The serial port connected to the MSP
+
+    :returns: The serial port
+    """
     # Initialize UART with a baud rate of 9600, no parity bit, one stop bit, eight data bits, and a 5s timeout
-    global ser
     ser = serial.Serial(
-        port="/dev/serial0", 
+        port=port, 
         baudrate = 9600, 
         parity=serial.PARITY_NONE, 
         stopbits=serial.STOPBITS_ONE, 
@@ -96,231 +408,695 @@ def main():
     # If the serial port is currently closed, open it
     if not ser.is_open:
         ser.open()
-        print("/dev/serial0 was just opened", flush=True)
+        print(f"{port} was just opened", flush=True)
     else:
-        print("/dev/serial0 is already open", flush=True)
-    
+        print(f"{port} is already open", flush=True)
+
     # Flush both UART buffers
     ser.reset_input_buffer()
     ser.reset_output_buffer()
 
-    # The main program loop
-    while True:
-        # Read the first byte
-        byte = ser.read(1)
+    # Record all UART traffic in both directions if --capture is given
+    if capture_path is not None:
+        ser = uart_capture.CaptureSerial(ser, uart_capture.CaptureWriter(capture_path, baudrate=ser.baudrate))
+        print(f"Capturing UART traffic to {capture_path}", flush=True)
 
-        if len(byte) == 0:
-            print("Waiting for a start byte...", flush=True)
-            ser.reset_input_buffer()
+    return ser
+
+
+class EngineStartup(threading.Thread):
+    """
+    Imports python-chess and starts the engine on a background thread (--fast-start mode).
+    """
+
+    def __init__(self, engine_socket: str, boot: boot_timer.BootTimer, engine_options=host_profile.engine_options):
+        """
+        :param engine_socket: The engine daemon's socket, or None to spawn Stockfish
+        :param boot: The boot timer to record the "imports done" and "engine ready" milestones to
+        :param engine_options: Passed to start_engine()
+        """
+        super().__init__(name="engine-startup", daemon=True)
+        self.engine_socket = engine_socket
+        self.boot = boot
+        self.engine_options = engine_options
+        self.ready = threading.Event()
+        self._engine = None
+        self._error = None
+
+    def run(self) -> None:
+        try:
+            import_heavy_modules()
+            self.boot.mark("imports done")
+            self._engine = start_engine(self.engine_socket, self.engine_options)
+            self.boot.mark("engine ready")
+        except Exception as e:
+            self._error = e
+        finally:
+            self.ready.set()
+
+    def result(self) -> chess.engine.SimpleEngine:
+        """
+        :returns: The running engine, once ready is set
+
+        :raises Exception: Whatever stopped the engine from starting
+        """
+        self.ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self._engine
+
+
+def serve_until_ready(ser, ready: threading.Event, tracer: robot_trace.NullTracer) -> None:
+    """
+    Serves the UART until the engine is ready. Valid instructions are ACKed; RESET needs no
+    action, and every other instruction is answered with BUSY so the MSP resends it later.
+
+    :param ser: The open serial port
+    :param ready: Set once the engine is ready
+    :param tracer: The tracer to record spans to
+    """
+    ser.timeout = STARTUP_READ_TIMEOUT
+    while not ready.is_set():
+        frame = read_frame(ser, tracer, quiet_timeout=True)
+        if frame is None:
             continue
+        _, instr, _ = frame
+        ser.write(bytearray([ACK_BYTE]))
+        if instr != RESET_INSTR:
+            busy_instr_bytes = encode_frame(BUSY_INSTR)
+            ser.write(bytearray(busy_instr_bytes)) # BUSY
+            print("Still starting up; sent BUSY", flush=True)
+            ser.timeout = 5
+            await_ack(ser, busy_instr_bytes, "BUSY", tracer)
+            ser.timeout = STARTUP_READ_TIMEOUT
+    ser.timeout = 5
+
+
+class ChessRobot:
+    """
+    The controller's game state machine. Reads instructions from the MSP over UART, keeps the
+    board in sync with the physical game, and answers human moves with Stockfish's moves.
+    """
+
+    def __init__(self, ser, engine: chess.engine.SimpleEngine, board: chess.Board = None,
+                 tracer: robot_trace.NullTracer = None, records_dir: str = None, sync_newgame: bool = False,
+                 restart_engine=None, engine_options=None, watchdog=None):
+        """
+        :param ser: The serial port connected to the MSP (or any object with the same read/write interface)
+        :param engine: The running chess engine
+        :param board: The board to start from (defaults to the standard starting position)
+        :param tracer: The tracer to record spans to (defaults to no tracing)
+        :param records_dir: The directory game records are saved to, or None to not save them
+        :param sync_newgame: Clear the engine right before each game's first search instead of
+                             between games (see game_lifecycle.py)
+        :param restart_engine: A function taking no arguments that starts a new engine, used by the
+                               engine watchdog after a hang or crash (None to never restart)
+        :param engine_options: A function taking the engine's current Hash (MB) that returns the
+                               UCI options to re-apply between games (see host_profile.engine_options), or None
+        :param watchdog: What searches run through instead of a watchdog over engine, e.g. a
+                         multi_board.PoolSearcher sharing engines between boards (engine is then None)
+        """
+        self.ser = ser
+        self.engine = engine
+        self.board = board if board is not None else chess.Board()
+        self.tracer = tracer if tracer is not None else robot_trace.NullTracer()
+        self.records_dir = records_dir
+        self.player_color = None
+        # When the instruction being handled was received (time.perf_counter())
+        self.instruction_start = None
+
+        # Clears the engine's hash between games, off the critical path of the first move
+        # Engine options are re-checked in the same gap
+        self.lifecycle = game_lifecycle.GameLifecycle(engine, sync_newgame, engine_options)
+
+        # Enforces a deadline on every search and replaces the engine if it hangs or dies
+        if watchdog is None:
+            watchdog = engine_watchdog.EngineWatchdog(engine, restart_engine, on_restart=self.engine_restarted)
+        self.watchdog = watchdog
+        # Runs every search by priority, so background searches never delay a reply (see engine_scheduler.py)
+        self.scheduler = engine_scheduler.EngineScheduler(watchdog)
+        # Search the human's expected reply while they think
+        self.ponder = False
+        # Analyses every saved game record (see game_analysis.py), or None
+        self.analysis = None
+        # The indexed archive every finished game is added to (see game_archive.py), or None
+        self.archive = None
+        # The Polyglot opening book robot moves are played from when it has one (see opening_book.py), or None
+        self.book_path = None
+        # The legal moves by the occupancy after them, for BOARD_STATE (see move_table)
+        self._move_table = None
+        self._move_table_key = None
+        # Searched moves by position (see move_cache.py), or None; filled after boot by the warm-up
+        self.move_cache = None
+        self.warmup = None
+        # Plans the gantry's transfers for every robot move, sent in ROBOT_PLAN (see gantry_planner.py), or None
+        self.planner = None
+        # Journals the game in progress so it can be resumed after a crash (see game_journal.py)
+        self.journal = game_journal.NullJournal()
+
+        # The limit every robot search runs with
+        self.limit = chess.engine.Limit(time=MOVE_TIME)
+        # Stops searches once their result is settled (see early_stop.py), or None to use the full limit
+        self.early_stop = None
+
+        # The game clock, from CLOCK instructions or tracked locally (see game_clock.py); when it is
+        # known, searches run on it and Stockfish's time management replaces the fixed move time
+        self.clock = game_clock.GameClock()
+        self.search_on_clock = True
+
+        # The playing strength set by the MSP; limited strengths also cap the search (see difficulty.py)
+        self.difficulty = difficulty.Difficulty(difficulty.FULL_STRENGTH)
+
+        # Every move (and the engine's search statistics for robot moves) is kept in a per-game record
+        self.record = search_stats.GameRecord(fen=self.board.fen())
+
+        # Start at full strength, even on an engine an earlier session left limited
+        self.apply_difficulty()
+
+    def run(self) -> None:
+        """
+        The main program loop; handles instructions from the MSP forever.
+        """
+        while True:
+            self.step()
+
+    def step(self) -> bool:
+        """
+        Reads one instruction from the MSP, ACKs it, and takes action based on it.
+
+        :returns: True if a valid instruction was handled, False otherwise
+        """
+        frame = read_frame(self.ser, self.tracer)
+        if frame is None:
+            return False
+        receive_start, instr, operand = frame
+        self.instruction_start = time.perf_counter()
+
+        self.ser.write(bytearray([ACK_BYTE]))
+        self.tracer.instant("ACK sent", robot_trace.TRACK_UART)
+
+        self.handle_instruction(instr, operand)
+        self.tracer.complete("handle instruction", robot_trace.TRACK_UART, receive_start, instr=instr)
+        print("----------------------------------------------", flush=True)
+        return True
+
+    def handle_instruction(self, instr: int, operand: bytes) -> None:
+        """
+        Takes action based on the instruction ID.
+
+        :param instr: The instruction ID of a validated instruction
+        :param operand: The instruction's operand bytes (empty if it has none)
+        """
+        # A game needs the engine; the warm-up after boot is over
+        if self.warmup is not None and instr in (RESET_INSTR, START_W_INSTR, START_B_INSTR, HUMAN_MOVE_INSTR, BOARD_STATE_INSTR):
+            self.warmup.stop()
+        if instr == RESET_INSTR:
+            # Reset the board
+            self.new_game(None)
+            print("Resetting system", flush=True)
+            self.lifecycle.prepare()
+        elif instr == START_W_INSTR:
+            # Create a new board; human starts (wait for them to send a move)
+            self.new_game("W")
+            print("Human playing white; human to start", flush=True)
+            self.clock.start_turn(chess.WHITE, self.instruction_start)
+            self.move_table()
+            # Clear the engine while the human thinks, if that didn't happen after the last game
+            self.lifecycle.prepare()
+        elif instr == START_B_INSTR:
+            # Create a new board; robot starts
+            self.new_game("B")
+            print("Human playing black; robot to start", flush=True)
+            self.clock.start_turn(chess.WHITE, self.instruction_start)
+
+            # The player didn't move before, so their status is forced to GAME_ONGOING
+            self.ser.reset_input_buffer()
+            self.robot_move(GAME_ONGOING)
+        elif instr == HUMAN_MOVE_INSTR:
+            self.human_move(operand)
+        elif instr == BOARD_STATE_INSTR and len(operand) == 8:
+            self.board_state(operand)
+        elif instr == BOARD_SYNC_INSTR and len(operand) == board_sync.HASH_LEN:
+            self.check_sync(operand)
+        elif instr == BOARD_SYNC_INSTR and len(operand) > board_sync.HASH_LEN:
+            self.board_sync(operand)
+        elif instr == DIFFICULTY_INSTR and len(operand) == 2:
+            self.set_difficulty(int.from_bytes(operand, "big"))
+        elif instr == CLOCK_INSTR and len(operand) == 10:
+            self.set_clock(operand)
         else:
-            byte = bytes_to_int(byte)
-
-        raw_operand = b""
-        int_operand = -1
-        dec_operand = ""
-        received_msg = []
-
-        # Check for the start byte (0x0A)
-        if byte == START_BYTE:
-            instr_and_op_len = ser.read(1)
-
-            if len(instr_and_op_len) == 0:
-                print("Didn't receive an instruction + operand length byte", flush=True)
-                ser.reset_input_buffer()
-                continue
-
-            # Convert bytes to ints, then use bit operations to extract the
-            # individual instruction and operand length
-            instr_and_op_len = bytes_to_int(instr_and_op_len)
-            instr = instr_and_op_len >> 4
-            op_len = instr_and_op_len & (~0xF0)
-            received_msg = [byte, instr_and_op_len]
-
-            if (op_len > 0):
-                # Read the number of bytes given by op_len
-                raw_operand = ser.read(op_len)
-
-                # Check for shorter operand than expected
-                if len(raw_operand) < op_len:
-                    print(f"Received shorter operand than expected: received {received_msg} with op_len {op_len}, but received len was {len(raw_operand)}: {raw_operand}", flush=True)
-                    ser.reset_input_buffer()
-                    continue
-
-                int_operand = bytes_to_int(raw_operand)
-                dec_operand = raw_operand.decode('ascii')
-                print(f"Dec operand: {dec_operand}", flush=True)
-
-            # Read the check bytes
-            check_bytes = ser.read(2)
-
-            # Check that two check bytes were received
-            if len(check_bytes) < 2:
-                print("Didn't receive two check bytes", flush=True)
-                ser.reset_input_buffer()
-                continue
-
-            # Convert the check bytes to integers
-            c0 = bytes_to_int(check_bytes[0:1])
-            c1 = bytes_to_int(check_bytes[1:2])
-
-            # The only operand lengths present in this instruction set are 0, 1, and 5
-            if (op_len not in [0, 1, 5]):
-                print("Invalid operand length received; got {op_len}", flush=True)
-                ser.reset_input_buffer()
-                continue
-            if (instr > 6):
-                print("Invalid instruction ID received; got {instr}", flush=True)
-                ser.reset_input_buffer()
-                continue
-            
-            # Only append operand bytes to received_msg if there are any
-            if (op_len > 0):
-                received_msg = [byte, instr_and_op_len] + [ord(c) for c in dec_operand] + [c0, c1]
-            else:
-                received_msg = [byte, instr_and_op_len] + [c0, c1]
-
-            # Validate the check bytes and skip action if invalid
-            if not validate_transmission(received_msg):
-                print(f"Invalid transmission received: \nDec: {received_msg} | Hex: {[hex(c) for c in received_msg]}", flush=True)
-                ser.reset_input_buffer()
-                continue
-            else:
-                print(f"Valid transmission received, ACK sent!: \nDec: {received_msg} | Hex: {[hex(c) for c in received_msg]}", flush=True)
-                ser.write(bytearray([ACK_BYTE]))
-
-            # Take action based on the instruction ID
-            if instr == RESET_INSTR:
-                # Reset the board
-                board = chess.Board()
-                print("Resetting system", flush=True)
-            elif instr == START_W_INSTR:
-                # Create a new board; human starts (wait for them to send a move)
-                board = chess.Board()
-                print("Human playing white; human to start", flush=True)
-                player_color = "W"
-            elif instr == START_B_INSTR:
-                # Create a new board; robot starts
-                board = chess.Board()
-                print("Human playing black; robot to start", flush=True)
-                player_color = "B"
-
-                # Get Stockfish's move in 1 second
-                stockfish_next_move = engine.play(board, chess.engine.Limit(time=MOVE_TIME)).move.uci()
-                # Get the fifth operand byte to be sent
-                fifth_byte = get_fifth_byte(board, stockfish_next_move)
-                # Update the board with the robot's move
-                board.push(chess.Move.from_uci(stockfish_next_move))
-                # Print the new board
-                print(board, flush=True)
-                # Check the game state after the robot has decided its move
-                status_after_robot = check_game_state(board)
-                # Form the game status byte with robot's move (player didn't move before, so its 4 bits are forced to GAME_ONGOING)
-                game_status_byte = (GAME_ONGOING << 4) + status_after_robot
-                # Package the bytes (ord(c) converts characters to ASCII encodings)
-                robot_move_instr_bytes = [START_BYTE, ROBOT_MOVE_INSTR_AND_LEN] + [ord(c) for c in stockfish_next_move[0:4]] + [ord(fifth_byte), game_status_byte]
-                # Append the checksum to the bytes preceding it
-                robot_move_instr_bytes += fl16_get_check_bytes(fletcher16_nums(robot_move_instr_bytes))
-                # Send the ROBOT_MOVE_INSTR to the MSP
-                ser.reset_input_buffer()
-                ser.write(bytearray(robot_move_instr_bytes))
-                print(f"Sent move {stockfish_next_move}", flush=True)
-                # Check for ACK feedback
-                while not check_for_ack(robot_move_instr_bytes):
-                    pass
-
-            elif instr == HUMAN_MOVE_INSTR:
-                # Remove the '_' from the move, or leave any promotions
-                # If the input string throws an error upon conversion, send back ILLEGAL_MOVE
-                try:
-                    print(f"Human makes move: {parse_move(dec_operand)}", flush=True)
-                    player_next_move = chess.Move.from_uci(parse_move(dec_operand))
-                except (ValueError, TypeError) as e:
-                    illegal_move_instr_bytes = [START_BYTE, ILLEGAL_MOVE_INSTR_AND_LEN]
-                    illegal_move_instr_bytes += fl16_get_check_bytes(fletcher16_nums(illegal_move_instr_bytes))
-                    ser.write(bytearray(illegal_move_instr_bytes)) # ILLEGAL_MOVE
-                    print("Illegal move made", flush=True)
-                    # Check for ACK feedback
-                    while not check_for_ack(illegal_move_instr_bytes):
-                        pass
-
-                    continue
-
-                # If the move the player made was not legal, do not push it; alert the MSP
-                if player_next_move not in board.legal_moves:
-                    print(f"Human makes move: {parse_move(dec_operand)}", flush=True)
-                    illegal_move_instr_bytes = [START_BYTE, ILLEGAL_MOVE_INSTR_AND_LEN]
-                    illegal_move_instr_bytes += fl16_get_check_bytes(fletcher16_nums(illegal_move_instr_bytes))
-                    ser.write(bytearray(illegal_move_instr_bytes)) # ILLEGAL_MOVE
-                    print("Illegal move made", flush=True)
-                    # Check for ACK feedback
-                    while not check_for_ack(illegal_move_instr_bytes):
-                        pass
-
-                    continue
-                else:
-                    # Update the board with the player's move
-                    board.push(player_next_move)
-                    # Print the new board
-                    print(board, flush=True)
-                    # Check the game state after the player's move has been recognized
-                    status_after_player = check_game_state(board)
-
-                    # If the player's last move ended the game
-                    if status_after_player != GAME_ONGOING:
-                        # The game status byte will include the status the player caused, and a "filler" GAME_ONGOING for the robot
-                        game_status_byte = (status_after_player << 4) + GAME_ONGOING
-                        # Package the bytes, fill the move bytes with filler values (they don't matter since the game is over)
-                        robot_move_instr_bytes = [START_BYTE, ROBOT_MOVE_INSTR_AND_LEN] + [ord('_')]*5 + [game_status_byte]
-                        # Append the check bytes to the bytes preceding them
-                        robot_move_instr_bytes += fl16_get_check_bytes(fletcher16_nums(robot_move_instr_bytes))
-                        # Send ROBOT_MOVE_INSTR to the MSP; the player has ended the game at this point
-                        ser.write(bytearray(robot_move_instr_bytes)) # ROBOT_MOVE
-                        print("Game over!", flush=True)
-                        # Check for ACK feedback
-                        while not check_for_ack(robot_move_instr_bytes):
-                            pass
-                    else:
-                        # Get Stockfish's move in 1 second
-                        stockfish_next_move = engine.play(board, chess.engine.Limit(time=MOVE_TIME)).move.uci()
-                        # If it's a promotion, it will be overriden to a queen automatically
-                        if len(stockfish_next_move) == 5:
-                            stockfish_next_move_ls = list(stockfish_next_move)
-                            stockfish_next_move_ls[4] = 'q'
-                            stockfish_next_move = ''.join(stockfish_next_move_ls)
-                        
-                        # Get the fifth operand byte to be sent
-                        fifth_byte = get_fifth_byte(board, stockfish_next_move)
-                        # Update the board with the robot's move
-                        board.push(chess.Move.from_uci(stockfish_next_move))
-                        # Print the new board
-                        print(board, flush=True)
-                        # Check the game state after the robot has decided its move
-                        status_after_robot = check_game_state(board)
-                        # Form the game status byte with the statuses after human and robot moves
-                        game_status_byte = (status_after_player << 4) + status_after_robot
-                        # Package the bytes (ord(c) converts characters to ASCII encodings)
-                        robot_move_instr_bytes = [START_BYTE, ROBOT_MOVE_INSTR_AND_LEN] + [ord(c) for c in stockfish_next_move[0:4]] + [ord(fifth_byte), game_status_byte]
-                        # Append the check bytes to the bytes preceding them
-                        robot_move_instr_bytes += fl16_get_check_bytes(fletcher16_nums(robot_move_instr_bytes))
-                        # Send the ROBOT_MOVE_INSTR to the MSP
-                        ser.write(bytearray(robot_move_instr_bytes)) # ROBOT_MOVE
-                        print(f"Sent move {stockfish_next_move}; \n{robot_move_instr_bytes}", flush=True)
-                        # If the robot's last move ended the game
-                        if status_after_robot != GAME_ONGOING:
-                            print("Game over!", flush=True)
-                        # Check for ACK feedback
-                        while not check_for_ack(robot_move_instr_bytes):
-                            pass
-
-            else:
-                print("Did not get a valid instruction", flush=True)
-            print("----------------------------------------------", flush=True)
+            print("Did not get a valid instruction", flush=True)
+
+    def new_game(self, player_color: str) -> None:
+        """
+        Saves the record of the previous game and starts a new game from the standard position.
+
+        :param player_color: "W" or "B" for the human's color, or None after a RESET
+        """
+        self.save_record()
+        self.board = chess.Board()
+        self.player_color = player_color
+        self.record = search_stats.GameRecord(player_color=player_color)
+        self.record.elo = self.difficulty.elo
+        self.clock.reset()
+        self.scheduler.cancel(engine_scheduler.PONDER, only=True)
+        self.lifecycle.new_game()
+        self.journal.start_game(player_color, self.board.fen(), self.difficulty.elo)
+        if self.planner is not None:
+            self.planner.new_game()
+
+    def set_difficulty(self, elo: int) -> None:
+        """
+        Sets the playing strength for the robot's following moves.
+
+        :param elo: The target Elo, or 0 for full strength
+        """
+        self.difficulty = difficulty.Difficulty(elo)
+        self.record.elo = elo
+        self.journal.difficulty(elo)
+        print(f"Difficulty set to {self.difficulty.describe()}", flush=True)
+        self.apply_difficulty()
+
+    def set_clock(self, operand: bytes) -> None:
+        """
+        Sets the game clock to the times reported by the MSP.
+
+        :param operand: The CLOCK operand; white's and black's time left in ms (3 bytes each), then
+                        white's and black's increment in ms (2 bytes each), all big-endian
+        """
+        white, black = int.from_bytes(operand[0:3], "big"), int.from_bytes(operand[3:6], "big")
+        white_inc, black_inc = int.from_bytes(operand[6:8], "big"), int.from_bytes(operand[8:10], "big")
+        self.clock.set(white / 1000, black / 1000, white_inc / 1000, black_inc / 1000, self.instruction_start)
+        print(f"Clock set: white {white / 1000:.1f}+{white_inc / 1000:g} s, black {black / 1000:.1f}+{black_inc / 1000:g} s", flush=True)
+
+    def apply_difficulty(self) -> None:
+        """
+        Sets the current difficulty's UCI options on the engine.
+        """
+        if self.engine is None:
+            return
+        # Don't interrupt a clear or a ponder search running in the background
+        self.lifecycle.wait()
+        self.scheduler.cancel(engine_scheduler.PONDER, only=True)
+        try:
+            self.engine.configure(self.difficulty.options)
+        except engine_watchdog.ENGINE_ERRORS as e:
+            # The watchdog replaces a dead engine at the next search, which re-applies the options
+            print(f"Could not set the difficulty: {e}", flush=True)
+
+    def human_move(self, operand: bytes) -> None:
+        """
+        Validates the human's move and, if it is legal, pushes it and answers with the robot's move.
+
+        :param operand: The HUMAN_MOVE operand; 5 ASCII characters of UCI (with a trailing '_' if not a promotion)
+        """
+        # Remove the '_' from the move, or leave any promotions
+        # If the input string throws an error upon conversion, send back ILLEGAL_MOVE
+        try:
+            dec_operand = operand.decode('ascii')
+            print(f"Human makes move: {parse_move(dec_operand)}", flush=True)
+            player_next_move = chess.Move.from_uci(parse_move(dec_operand))
+        except (ValueError, TypeError) as e:
+            self.illegal_move()
+            return
+
+        # If the move the player made was not legal, do not push it; alert the MSP
+        if player_next_move not in self.board.legal_moves:
+            self.illegal_move()
+            return
+
+        self.play_human_move(player_next_move)
+
+    def board_state(self, operand: bytes) -> None:
+        """
+        Infers the human's move from the board's occupancy and, if exactly one legal move fits,
+        plays it like a HUMAN_MOVE. Otherwise the MSP gets ILLEGAL_MOVE, or AMBIGUOUS_MOVE with the
+        squares involved.
+
+        :param operand: The BOARD_STATE operand; the occupancy bitboard, big-endian
+        """
+        status, result = occupancy.infer_move(self.move_table(), int.from_bytes(operand, "big"))
+        if status == occupancy.MOVE_ILLEGAL:
+            print("No legal move fits the board state", flush=True)
+            self.illegal_move()
+        elif status == occupancy.MOVE_AMBIGUOUS:
+            print(f"The board state fits several moves: {', '.join(move.uci() for move in result)}", flush=True)
+            ambiguous_move_instr_bytes = encode_frame(AMBIGUOUS_MOVE_INSTR, list(occupancy.squares_mask(result).to_bytes(8, "big")))
+            self.ser.write(bytearray(ambiguous_move_instr_bytes)) # AMBIGUOUS_MOVE
+            self.await_ack(ambiguous_move_instr_bytes, "AMBIGUOUS_MOVE")
         else:
-            print("Not a start byte")
-            continue
+            print(f"Human makes move (from the board state): {result.uci()}", flush=True)
+            self.play_human_move(result)
+
+    def check_sync(self, operand: bytes) -> None:
+        """
+        Compares the MSP's position hash with the Pi's, and sends the Pi's position if they differ.
+
+        :param operand: The hash-only BOARD_SYNC operand
+        """
+        if operand == board_sync.check_operand(self.board):
+            print("Board sync check: the MSP agrees", flush=True)
+            return
+        print(f"Board sync check: the MSP's position differs (hash {operand.hex()}); sending ours", flush=True)
+        board_sync_instr_bytes = encode_frame(BOARD_SYNC_INSTR, list(board_sync.sync_operand(self.board)))
+        self.ser.write(bytearray(board_sync_instr_bytes)) # BOARD_SYNC
+        self.await_ack(board_sync_instr_bytes, "BOARD_SYNC")
+
+    def board_sync(self, operand: bytes) -> None:
+        """
+        Restores the board to the MSP's position and, if that makes it the robot's turn, answers
+        with the robot's move. Invalid positions are answered with ILLEGAL_MOVE.
+
+        :param operand: The full BOARD_SYNC operand; the compact position followed by its hash
+        """
+        data, received_hash = operand[:-board_sync.HASH_LEN], operand[-board_sync.HASH_LEN:]
+        try:
+            if board_sync.position_hash(data) != received_hash:
+                raise ValueError("hash mismatch")
+            board = board_sync.decode_position(data)
+        except ValueError as e:
+            print(f"Invalid BOARD_SYNC position: {e}", flush=True)
+            self.illegal_move()
+            return
+        if not board.is_valid():
+            print(f"BOARD_SYNC position is not a legal position: {board.fen()}", flush=True)
+            self.illegal_move()
+            return
+        if board.fen() == self.board.fen():
+            print("Board sync: already in this position", flush=True)
+            return
+
+        # The move history is lost; the game carries on from the MSP's position in a new record
+        print(f"Board sync: restoring {board.fen()}", flush=True)
+        self.save_record()
+        self.scheduler.cancel(engine_scheduler.PONDER, only=True)
+        self.board = board
+        self.record = search_stats.GameRecord(fen=board.fen(), player_color=self.player_color)
+        self.record.elo = self.difficulty.elo
+        self.journal.start_game(self.player_color, board.fen(), self.difficulty.elo)
+        if self.planner is not None:
+            # Which graveyard slots are taken is lost with the history; assume they were cleared
+            self.planner.new_game()
+        print(self.board, flush=True)
+        status = check_game_state(self.board)
+        robot_color = {"W": chess.BLACK, "B": chess.WHITE}.get(self.player_color)
+        if self.board.turn == robot_color and status == GAME_ONGOING:
+            self.clock.start_turn(self.board.turn, self.instruction_start)
+            self.robot_move(status)
+
+    def move_table(self) -> dict:
+        """
+        :returns: The current position's legal moves by the occupancy after them (see
+                  occupancy.move_table), computed once per position
+        """
+        key = self.board.fen()
+        if self._move_table_key != key:
+            self._move_table = occupancy.move_table(self.board)
+            self._move_table_key = key
+        return self._move_table
+
+    def play_human_move(self, player_next_move: chess.Move) -> None:
+        """
+        Pushes the human's legal move and answers with the robot's move.
+
+        :param player_next_move: The human's move
+        """
+        # Update the board with the player's move
+        push_start = self.tracer.now()
+        self.board.push(player_next_move)
+        self.tracer.complete("push human move", robot_trace.TRACK_BOARD, push_start, move=player_next_move.uci())
+        self.record.add_move(search_stats.HUMAN, player_next_move.uci())
+        self.journal.move(search_stats.HUMAN, player_next_move.uci())
+        # The human's clock stops when their move arrives, and the robot's starts
+        self.clock.start_turn(self.board.turn, self.instruction_start)
+        # Print the new board
+        print(self.board, flush=True)
+        # Check the game state after the player's move has been recognized
+        status_after_player = check_game_state(self.board)
+
+        # If the player's last move ended the game
+        if status_after_player != GAME_ONGOING:
+            # The game status byte will include the status the player caused, and a "filler" GAME_ONGOING for the robot
+            game_status_byte = (status_after_player << 4) + GAME_ONGOING
+            # Package the bytes, fill the move bytes with filler values (they don't matter since the game is over)
+            robot_move_instr_bytes = encode_frame(ROBOT_MOVE_INSTR, [ord('_')]*5 + [game_status_byte])
+            # Send ROBOT_MOVE_INSTR to the MSP; the player has ended the game at this point
+            self.ser.write(bytearray(robot_move_instr_bytes)) # ROBOT_MOVE
+            print("Game over!", flush=True)
+            self.clock.end_turn(self.instruction_start)
+            self.scheduler.cancel(engine_scheduler.PONDER, only=True)
+            self.save_record()
+            self.journal.end()
+            # The engine is idle until the next game; clear it now
+            self.lifecycle.prepare()
+            # Check for ACK feedback
+            self.await_ack(robot_move_instr_bytes, "ROBOT_MOVE")
+        else:
+            self.robot_move(status_after_player)
+
+    def robot_move(self, status_after_player: int, move_uci: str = None) -> None:
+        """
+        Gets Stockfish's move, pushes it, and sends it to the MSP in a ROBOT_MOVE instruction.
+
+        :param status_after_player: The game status code after the human's last move
+        :param move_uci: The move to send instead of searching, e.g. one the MSP never ACKed before a crash
+        """
+        stockfish_next_move, search_info = self.think() if move_uci is None else (move_uci, {})
+        # If it's a promotion, it will be overriden to a queen automatically
+        if len(stockfish_next_move) == 5:
+            stockfish_next_move_ls = list(stockfish_next_move)
+            stockfish_next_move_ls[4] = 'q'
+            stockfish_next_move = ''.join(stockfish_next_move_ls)
+
+        # Get the fifth operand byte to be sent
+        fifth_byte = get_fifth_byte(self.board, stockfish_next_move)
+        plan = None
+        if self.planner is not None:
+            plan = self.planner.plan(self.board, chess.Move.from_uci(stockfish_next_move))
+        # Update the board with the robot's move
+        push_start = self.tracer.now()
+        self.board.push(chess.Move.from_uci(stockfish_next_move))
+        self.tracer.complete("push robot move", robot_trace.TRACK_BOARD, push_start, move=stockfish_next_move)
+        self.record.add_move(search_stats.ROBOT, stockfish_next_move, search_info)
+        self.journal.move(search_stats.ROBOT, stockfish_next_move)
+        # Print the new board
+        print(self.board, flush=True)
+        # Check the game state after the robot has decided its move
+        status_after_robot = check_game_state(self.board)
+        # Form the game status byte with the statuses after human and robot moves
+        game_status_byte = (status_after_player << 4) + status_after_robot
+        # Package the bytes (ord(c) converts characters to ASCII encodings)
+        robot_move_instr_bytes = encode_frame(ROBOT_MOVE_INSTR, [ord(c) for c in stockfish_next_move[0:4]] + [ord(fifth_byte), game_status_byte])
+        # The move must be durable before the gantry can play it, or a resumed game could search
+        # the position again and send another one; one fsync after a search of seconds
+        self.journal.sync()
+        if plan is not None:
+            # The MSP carries out the plan when the ROBOT_MOVE arrives, instead of working the move out itself
+            robot_plan_instr_bytes = encode_frame(ROBOT_PLAN_INSTR, plan.operand())
+            self.ser.write(bytearray(robot_plan_instr_bytes)) # ROBOT_PLAN
+            print(f"Sent plan {plan.describe()} ({plan.seconds:.1f} s); \n{robot_plan_instr_bytes}", flush=True)
+            self.await_ack(robot_plan_instr_bytes, "ROBOT_PLAN")
+        # Send the ROBOT_MOVE_INSTR to the MSP
+        self.ser.write(bytearray(robot_move_instr_bytes)) # ROBOT_MOVE
+        print(f"Sent move {stockfish_next_move}; \n{robot_move_instr_bytes}", flush=True)
+        if self.record.first_move_ms is None and self.instruction_start is not None:
+            self.record.first_move_ms = round((time.perf_counter() - self.instruction_start) * 1000, 1)
+            print(f"First robot move latency: {self.record.first_move_ms:.0f} ms", flush=True)
+        # If the robot's last move ended the game
+        if status_after_robot != GAME_ONGOING:
+            print("Game over!", flush=True)
+            self.save_record()
+            # The engine is idle until the next game; clear it now
+            self.lifecycle.prepare()
+        # Check for ACK feedback
+        self.await_ack(robot_move_instr_bytes, "ROBOT_MOVE")
+        self.journal.acked()
+        if status_after_robot != GAME_ONGOING:
+            # Only once the MSP has the final move, which a resume would resend otherwise
+            self.journal.end()
+        # The robot's clock stops once the MSP has its move, and the human's starts
+        if status_after_robot == GAME_ONGOING:
+            self.clock.start_turn(self.board.turn, time.perf_counter())
+            self.move_table()
+            if self.ponder and not self.difficulty.limited:
+                self.start_ponder(search_info.get("ponder"))
+        else:
+            self.clock.end_turn(time.perf_counter())
+
+    def think(self) -> tuple:
+        """
+        Searches the current position with Stockfish.
+
+        :returns: A tuple of the best move in UCI notation and its search statistics (see search_stats.search)
+        """
+        entry = self.book_move()
+        if entry is not None:
+            self.tracer.instant("book move", robot_trace.TRACK_ENGINE, move=entry.move.uci(), weight=entry.weight)
+            print(f"Book move: {entry.move.uci()} (weight {entry.weight})", flush=True)
+            return entry.move.uci(), {"book": entry.weight}
+        search_start = self.tracer.now()
+        game = self.lifecycle.game_for_search()
+        search_clock = time.perf_counter()
+        # On the game clock, Stockfish's time management decides how long to think
+        on_clock = self.search_on_clock and self.clock.known()
+        limit = self.clock.limit(self.limit, search_clock) if on_clock else self.limit
+        # Clock limits change every move, and limited strengths must keep their randomness
+        cached = self.move_cache is not None and not on_clock and not self.difficulty.limited
+        if cached:
+            entry = self.move_cache.get(self.board, limit)
+            if entry is not None:
+                print(f"Move cache hit ({entry['source']}): {entry['move']}; {self.move_cache.report()}", flush=True)
+                self.tracer.instant("move cache hit", robot_trace.TRACK_ENGINE, move=entry["move"], source=entry["source"])
+                return entry["move"], dict(entry["stats"], cached=entry["source"])
+        # Limited strengths pick their move at a fixed depth, so stopping early would change their
+        # play; clock searches already stop when Stockfish's time management says so
+        stop = self.early_stop if not self.difficulty.limited and not on_clock else None
+        move, search_info = self.scheduler.search(engine_scheduler.CRITICAL, self.board, self.difficulty.limit(limit), game, stop)
+        if cached:
+            self.move_cache.put(self.board, limit, move, search_info, move_cache.SOURCE_LIVE)
+        if on_clock:
+            search_info["clock_ms"] = int(self.clock.time_left(self.board.turn, search_clock) * 1000)
+        if stop is not None:
+            saved = stop.finish(time.perf_counter() - search_clock)
+            search_info["saved_ms"] = int(saved * 1000)
+            print(f"Early stop: {search_info.get('stopped', 'not stopped')}, saved {saved * 1000:.0f} ms; "
+                  f"average {stop.average_saved() * 1000:.0f} ms saved over {stop.searches} moves", flush=True)
+        self.tracer.complete("go -> bestmove", robot_trace.TRACK_ENGINE, search_start, move=move.uci(),
+                             depth=search_info.get("depth"), nodes=search_info.get("nodes"))
+        print(f"Search: {search_stats.format_stats(search_info)}", flush=True)
+        return move.uci(), search_info
+
+    def book_move(self) -> chess.polyglot.Entry:
+        """
+        :returns: The opening book's highest-weighted legal move in the current position, or None
+                  if it has none, there is no book, or the strength is limited
+        """
+        if self.book_path is None or self.difficulty.limited:
+            return None
+        # Opened for every lookup, so a book rebuilt overnight is picked up without a restart
+        try:
+            with chess.polyglot.open_reader(self.book_path) as reader:
+                return reader.get(self.board)
+        except OSError as e:
+            print(f"Could not read the opening book: {e}", flush=True)
+            return None
+
+    def start_ponder(self, expected: str) -> None:
+        """
+        Searches the position after the human's expected reply in the background, so the hash is
+        warm when their move arrives. The search is preempted by the reply's search.
+
+        :param expected: The human's expected reply in UCI (from the last search's principal variation), or None
+        """
+        if expected is None or chess.Move.from_uci(expected) not in self.board.legal_moves:
+            return
+        board = self.board.copy()
+        board.push_uci(expected)
+        self.scheduler.submit(engine_scheduler.EngineTask(engine_scheduler.PONDER, board,
+                                                          chess.engine.Limit(time=PONDER_TIME), self.lifecycle.token))
+        print(f"Pondering on {expected} while the human thinks", flush=True)
+
+    def resume(self, state: game_journal.ResumeState) -> None:
+        """
+        Resumes a game from the journal: rebuilds the board, tells the MSP with RESUMED and, if it
+        is the robot's turn, answers with its move (resending the last one if the MSP never ACKed it).
+
+        :param state: The game in progress when the journal was last written
+        """
+        start = time.perf_counter()
+        self.board = chess.Board(state.fen)
+        self.player_color = state.player_color
+        self.record = search_stats.GameRecord(fen=state.fen, player_color=state.player_color)
+        for side, move_uci in state.moves:
+            self.board.push_uci(move_uci)
+            self.record.add_move(side, move_uci)
+        unacked = None
+        if not state.acked:
+            unacked = self.board.pop().uci()
+            self.record.moves.pop()
+        rebuild_ms = (time.perf_counter() - start) * 1000
+        print(f"Resumed a game with {len(self.board.move_stack)} plies from the journal in "
+              f"{self.journal.replay_ms + rebuild_ms:.1f} ms", flush=True)
+        print(self.board, flush=True)
+        self.journal.start_game(state.player_color, state.fen, state.elo)
+        for side, move_uci in state.moves[:len(self.board.move_stack)]:
+            self.journal.move(side, move_uci)
+        if state.elo != self.difficulty.elo:
+            self.set_difficulty(state.elo)
+        self.record.elo = state.elo
+        self.lifecycle.new_game()
+        if self.planner is not None:
+            self.planner.replay(self.board, chess.BLACK if state.player_color == "W" else chess.WHITE)
+
+        color = START_W_INSTR if state.player_color == "W" else START_B_INSTR
+        resumed_instr_bytes = encode_frame(RESUMED_INSTR, [color, len(self.board.move_stack) & 0xFF])
+        self.ser.write(bytearray(resumed_instr_bytes)) # RESUMED
+        self.await_ack(resumed_instr_bytes, "RESUMED")
+
+        status = check_game_state(self.board)
+        robot_turn = self.board.turn == (chess.BLACK if state.player_color == "W" else chess.WHITE)
+        if robot_turn and status == GAME_ONGOING:
+            self.instruction_start = time.perf_counter()
+            self.clock.start_turn(self.board.turn, self.instruction_start)
+            self.robot_move(status, unacked)
+        elif status == GAME_ONGOING:
+            self.clock.start_turn(self.board.turn, time.perf_counter())
+
+    def engine_restarted(self, engine: chess.engine.SimpleEngine) -> None:
+        """
+        Switches to the engine the watchdog started in place of a hung or crashed one.
+
+        :param engine: The new engine
+        """
+        self.engine = engine
+        self.lifecycle.engine = engine
+        self.lifecycle.dirty = True
+        if self.difficulty.limited:
+            self.apply_difficulty()
+
+    def illegal_move(self) -> None:
+        """
+        Tells the MSP the human's last move was illegal.
+        """
+        illegal_move_instr_bytes = encode_frame(ILLEGAL_MOVE_INSTR)
+        self.ser.write(bytearray(illegal_move_instr_bytes)) # ILLEGAL_MOVE
+        print("Illegal move made", flush=True)
+        # Check for ACK feedback
+        self.await_ack(illegal_move_instr_bytes, "ILLEGAL_MOVE")
+
+    def save_record(self) -> None:
+        """
+        Finishes the current game record with the result on the board and saves it to the records
+        directory and the game archive. Records without any moves, records which were already
+        saved, and all records when neither was given, are skipped.
+        """
+        if (self.records_dir is None and self.archive is None) or not self.record.moves or self.record.saved:
+            return
+        self.record.finish(self.board)
+        self.record.watchdog = dict(self.watchdog.metrics)
+        self.record.scheduler = self.scheduler.metrics()
+        source = None
+        if self.records_dir is not None:
+            path = self.record.save(self.records_dir)
+            source = os.path.basename(path)
+            print(f"Saved game record to {path}", flush=True)
+        if self.archive is not None:
+            game = self.archive.add(self.record.to_dict(), source)
+            self.record.saved = True
+            print(f"Archived game {game}", flush=True)
+        # Once analysed, the analysis is added to the archive too
+        if self.analysis is not None and self.records_dir is not None:
+            self.analysis.submit(path)
+
+    def await_ack(self, sent_message: list, name: str) -> None:
+        """
+        Blocks until the MSP432 ACKs the given message, resending it as needed (see await_ack).
+
+        :param sent_message: The message that was just sent to the MSP432
+        :param name: The instruction name used to label the span
+        """
+        await_ack(self.ser, sent_message, name, self.tracer)
 
-    return 0
 
 def parse_move(move: str) -> str:
     """
@@ -447,13 +1223,153 @@ def validate_transmission(message: list) -> bool:
 
     return fl16_get_check_bytes(fletcher16_nums(instruction_bytes)) == checksum_bytes
 
+def encode_frame(instr: int, operand: list = []) -> list:
+    """
+    Packages an instruction into a complete UART message: the start byte, the instruction ID and
+    operand length byte, the operand, and the Fletcher-16 check bytes.
+
+    :param instr: The instruction ID (one of the *_INSTR defines)
+    :param operand: A list of the operand bytes (empty for instructions without an operand); at
+                    least uart_capture.EXTENDED_OP_LEN bytes are sent with an extended length
+
+    :returns: The full message as a list of bytes
+    """
+    if len(operand) >= uart_capture.EXTENDED_OP_LEN:
+        # Too long for the operand length nibble; the length byte follows
+        message = [START_BYTE, (instr << 4) | uart_capture.EXTENDED_OP_LEN, len(operand)] + list(operand)
+    else:
+        message = [START_BYTE, (instr << 4) | len(operand)] + list(operand)
+    return message + fl16_get_check_bytes(fletcher16_nums(message))
+
+
+def read_frame(ser, tracer: robot_trace.NullTracer = robot_trace.NullTracer(), quiet_timeout: bool = False) -> tuple:
+    """
+    Reads and validates one instruction from the serial port. The input buffer is flushed after
+    any malformed or corrupted message, so the next call starts from a clean stream.
+
+    :param ser: The serial port to read from
+    :param tracer: The tracer to record the receive and validate spans to
+    :param quiet_timeout: If True, don't log when no start byte arrives before the read timeout
+
+    :returns: A tuple of the receive start timestamp (see robot_trace), the instruction ID and the
+              operand bytes if a valid instruction was read, None otherwise
+    """
+    # Read the first byte
+    byte = ser.read(1)
+
+    if len(byte) == 0:
+        if not quiet_timeout:
+            print("Waiting for a start byte...", flush=True)
+        ser.reset_input_buffer()
+        return None
+    else:
+        byte = bytes_to_int(byte)
+
+    # Check for the start byte (0x0A)
+    if byte != START_BYTE:
+        print("Not a start byte")
+        return None
+
+    receive_start = tracer.now()
+    instr_and_op_len = ser.read(1)
+
+    if len(instr_and_op_len) == 0:
+        print("Didn't receive an instruction + operand length byte", flush=True)
+        ser.reset_input_buffer()
+        return None
+
+    # Convert bytes to ints, then use bit operations to extract the
+    # individual instruction and operand length
+    instr_and_op_len = bytes_to_int(instr_and_op_len)
+    instr = instr_and_op_len >> 4
+    op_len = instr_and_op_len & (~0xF0)
+    received_msg = [byte, instr_and_op_len]
+    # Longer operands give their length in the next byte
+    length_byte = []
+    if op_len == uart_capture.EXTENDED_OP_LEN:
+        extended_len = ser.read(1)
+        if len(extended_len) == 0:
+            print("Didn't receive an extended operand length byte", flush=True)
+            ser.reset_input_buffer()
+            return None
+        length_byte = [bytes_to_int(extended_len)]
+
+    raw_operand = b""
+    operand_len = length_byte[0] if length_byte else op_len
+    if (operand_len > 0):
+        # Read the number of bytes given by op_len (or the extended length)
+        raw_operand = ser.read(operand_len)
+
+        # Check for shorter operand than expected
+        if len(raw_operand) < operand_len:
+            print(f"Received shorter operand than expected: received {received_msg} with op_len {operand_len}, but received len was {len(raw_operand)}: {raw_operand}", flush=True)
+            ser.reset_input_buffer()
+            return None
+
+        print(f"Dec operand: {raw_operand.decode('ascii', errors='replace')}", flush=True)
+
+    # Read the check bytes
+    check_bytes = ser.read(2)
+
+    # Check that two check bytes were received
+    if len(check_bytes) < 2:
+        print("Didn't receive two check bytes", flush=True)
+        ser.reset_input_buffer()
+        return None
+
+    # Convert the check bytes to integers
+    c0 = bytes_to_int(check_bytes[0:1])
+    c1 = bytes_to_int(check_bytes[1:2])
+
+    # Only the operand lengths present in this instruction set are valid
+    if (op_len not in VALID_OP_LENS):
+        print(f"Invalid operand length received; got {op_len}", flush=True)
+        ser.reset_input_buffer()
+        return None
+    if (instr > MAX_INSTR):
+        print(f"Invalid instruction ID received; got {instr}", flush=True)
+        ser.reset_input_buffer()
+        return None
+
+    received_msg = [byte, instr_and_op_len] + length_byte + list(raw_operand) + [c0, c1]
+    tracer.complete("receive frame", robot_trace.TRACK_UART, receive_start, instr=instr, op_len=op_len)
+
+    # Validate the check bytes and skip action if invalid
+    validate_start = tracer.now()
+    if not validate_transmission(received_msg):
+        tracer.complete("validate", robot_trace.TRACK_UART, validate_start, valid=False)
+        print(f"Invalid transmission received: \nDec: {received_msg} | Hex: {[hex(c) for c in received_msg]}", flush=True)
+        ser.reset_input_buffer()
+        return None
+
+    tracer.complete("validate", robot_trace.TRACK_UART, validate_start, valid=True)
+    print(f"Valid transmission received, ACK sent!: \nDec: {received_msg} | Hex: {[hex(c) for c in received_msg]}", flush=True)
+    return receive_start, instr, raw_operand
+
+
+def await_ack(ser, sent_message: list, name: str, tracer: robot_trace.NullTracer = robot_trace.NullTracer()) -> None:
+    """
+    Blocks until the MSP432 ACKs the given message, resending it as needed (see check_for_ack).
+    The whole wait is recorded as a span on the UART track when tracing is enabled.
+
+    :param ser: The serial port the message was sent on
+    :param sent_message: The message that was just sent to the MSP432
+    :param name: The instruction name used to label the span
+    :param tracer: The tracer to record the span to
+    """
+    ack_start = tracer.now()
+    while not check_for_ack(ser, sent_message):
+        pass
+    tracer.complete(f"await ACK ({name})", robot_trace.TRACK_UART, ack_start)
+
 
-def check_for_ack(sent_message: list) -> bool:
+def check_for_ack(ser, sent_message: list) -> bool:
     """
     Checks for an ACK from the MSP432 by reading for an ACK. If an ACK is not received 
     in 5 seconds or the ACK is not the correct value (0x0F), the message is resent every 5 
     seconds until a proper ACK is received. 
 
+    :param ser: The serial port the message was sent on
     :param list: The message to resend if an ACK is not received
 
     :returns: True if an ACK is received, False otherwise
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Maps a target Elo to the cheapest search that plays at that strength. Stockfish weakens its play
+with UCI_LimitStrength/UCI_Elo by converting the Elo to a fractional skill level, searching with
+MultiPV 4, and picking a sub-optimal move once the iteration at depth 1 + int(level) completes
+(search.cpp, Skill). Every iteration after that is wasted: the move is already chosen. So a
+limited-strength search is capped at that depth and at a node budget which grows with the level,
+and an easy game uses a small fraction of the CPU time of a full-strength one.
+
+Usage:
+    python difficulty.py ELO [ELO ...]
+"""
+
+import dataclasses
+import math
+import sys
+
+import chess.engine
+
+# Stockfish's UCI_Elo range (ucioption.cpp); Elo 0 means full strength
+ENGINE_MIN_ELO = 1350
+ENGINE_MAX_ELO = 2850
+FULL_STRENGTH = 0
+
+# Node budget per move at skill level 0; it grows by NODES_GROWTH per level
+BASE_NODES = 1000
+NODES_GROWTH = 1.5
+
+
+def skill_level(elo: int) -> float:
+    """
+    :param elo: The target Elo
+
+    :returns: The fractional skill level Stockfish uses for that UCI_Elo (0 to 20)
+    """
+    elo = min(max(elo, ENGINE_MIN_ELO), ENGINE_MAX_ELO)
+    return min(max(math.pow((elo - 1346.6) / 143.4, 1 / 0.806), 0.0), 20.0)
+
+
+class Difficulty:
+    """
+    The engine options and search limit of one target Elo.
+    """
+
+    def __init__(self, elo: int):
+        """
+        :param elo: The target Elo, or FULL_STRENGTH
+        """
+        self.elo = elo
+        self.level = 20.0 if elo == FULL_STRENGTH else skill_level(elo)
+        self.limited = self.level < 20.0
+        if self.limited:
+            self.options = {"UCI_LimitStrength": True, "UCI_Elo": min(max(elo, ENGINE_MIN_ELO), ENGINE_MAX_ELO)}
+            self.depth = 1 + int(self.level)
+            self.nodes = int(BASE_NODES * NODES_GROWTH ** self.level)
+        else:
+            self.options = {"UCI_LimitStrength": False}
+            self.depth = None
+            self.nodes = None
+
+    def limit(self, base: chess.engine.Limit) -> chess.engine.Limit:
+        """
+        :param base: The limit of a full-strength search (e.g. the move time or the game clock)
+
+        :returns: The base limit, additionally capped at the depth where Stockfish picks its move and
+                  at the node budget when the strength is limited
+        """
+        if not self.limited:
+            return base
+        nodes = self.nodes if base.nodes is None else min(self.nodes, base.nodes)
+        return dataclasses.replace(base, depth=self.depth, nodes=nodes)
+
+    def describe(self) -> str:
+        """
+        :returns: A one-line summary for the controller log
+        """
+        if not self.limited:
+            return "full strength"
+        return f"Elo {self.elo}: skill level {self.level:.1f}, depth {self.depth}, at most {self.nodes} nodes per move"
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        print(Difficulty(int(arg)).describe())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Stops a timed search early once its result is settled. In many positions Stockfish finds its best
+move within a few hundred milliseconds and only confirms it for the rest of the move time, so the
+search is stopped when either:
+- the best move has stayed the same for STABLE_ITERATIONS completed iterations, with the score
+  moving by at most SCORE_MARGIN centipawns over them, or
+- the engine has found a forced mate
+but never before the minimum time. The maximum time is the search's own time limit.
+"""
+
+import chess
+import chess.engine
+
+# Default bounds (seconds)
+MIN_TIME = 0.3
+
+# Number of consecutive iterations the best move must survive
+STABLE_ITERATIONS = 4
+
+# Largest score change (centipawns) over those iterations
+SCORE_MARGIN = 20
+
+
+class EarlyStop:
+    """
+    Decides when to stop a search, and keeps the time saved by stopping early.
+    """
+
+    def __init__(self, max_time: float, min_time: float = MIN_TIME, stable_iterations: int = STABLE_ITERATIONS,
+                 score_margin: int = SCORE_MARGIN):
+        """
+        :param max_time: The search's time limit in seconds; time saved is measured against it
+        :param min_time: The search is never stopped before this many seconds
+        :param stable_iterations: The number of consecutive iterations the best move must survive
+        :param score_margin: The largest score change, in centipawns, over those iterations
+        """
+        self.max_time = max_time
+        self.min_time = min_time
+        self.stable_iterations = stable_iterations
+        self.score_margin = score_margin
+        self.searches = 0
+        self.saved = 0.0
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets the previous search; called at the start of every search.
+        """
+        self.best = None
+        # Centipawn scores of the iterations since the best move last changed (None for mates)
+        self.scores = []
+        self.reason = None
+
+    def should_stop(self, info: dict, elapsed: float, turn: chess.Color) -> bool:
+        """
+        :param info: The info of a completed iteration (with "score" and "depth")
+        :param elapsed: The seconds since the search started
+        :param turn: The side the engine is searching for
+
+        :returns: True if the search should be stopped now (the reason is kept in self.reason)
+        """
+        # Aspiration window re-searches report bounds, not the iteration's result
+        if not info.get("pv") or info.get("lowerbound") or info.get("upperbound"):
+            return False
+        score = info["score"].pov(turn)
+        if info["pv"][0] != self.best:
+            self.best = info["pv"][0]
+            self.scores = []
+        self.scores.append(score.score())
+
+        if elapsed < self.min_time:
+            return False
+        if score.is_mate() and score.mate() > 0:
+            self.reason = "mate"
+            return True
+        recent = self.scores[-self.stable_iterations:]
+        if (len(recent) == self.stable_iterations and None not in recent
+                and max(recent) - min(recent) <= self.score_margin):
+            self.reason = "stable"
+            return True
+        return False
+
+    def finish(self, elapsed: float) -> float:
+        """
+        Records the end of a search.
+
+        :param elapsed: The seconds the search took
+
+        :returns: The seconds saved by stopping early (0.0 if it ran to its limit)
+        """
+        saved = max(0.0, self.max_time - elapsed) if self.reason is not None else 0.0
+        self.searches += 1
+        self.saved += saved
+        return saved
+
+    def average_saved(self) -> float:
+        """
+        :returns: The average seconds saved per search so far
+        """
+        return self.saved / self.searches if self.searches else 0.0
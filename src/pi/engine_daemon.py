@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""
+A long-lived Stockfish daemon for the Raspberry Pi controller. The daemon starts Stockfish once
+(paying for process start-up, the NNUE network load and the hash allocation a single time) and
+serves it over a Unix domain socket speaking plain UCI. The controller attaches to the socket
+instead of spawning its own engine, so restarting the controller (e.g. to load a new FEN) takes
+milliseconds and the engine stays warm between sessions.
+
+The daemon serves one controller at a time and keeps the engine consistent between sessions:
+- "uci" is answered from the engine's cached id and option lines
+- "setoption" is only forwarded if it changes the option, so re-sending the same Hash size does
+  not reallocate (and clear) the transposition table (buttons such as "Clear Hash" are always
+  forwarded)
+- options a session changed (e.g. an Elo limit, nodestime, or the deterministic mode's Hash and
+  Threads) are put back to their start-up values when it ends, so every session starts from the
+  same engine
+- the "ucinewgame" python-chess sends before a session's first search is dropped, keeping the
+  hash warm across controller restarts
+- "quit" ends the session instead of stopping the engine, and a session that disconnects
+  mid-search has its search stopped before the next controller attaches; if the engine does not
+  answer within READY_TIMEOUT, the daemon exits so its supervisor can restart it with a new engine
+
+Usage:
+    python engine_daemon.py [--socket PATH] [--engine PATH] [--hash MB] [--threads N]
+
+Hash and Threads default to the sizes host_profile.py picks for the host.
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import build_matrix
+import chess.engine
+import host_profile
+
+# DEFAULT DAEMON SETTINGS
+DEFAULT_SOCKET = "/tmp/chess_robot_engine.sock"
+DEFAULT_ENGINE = "/home/thegreatgambit/Documents/Capstone-PyChess/stockfish/src/stockfish"
+DEFAULT_MANIFEST = "/home/thegreatgambit/Documents/Capstone-PyChess/stockfish/bin/manifest.json"
+
+# Seconds the engine may take to answer "isready" between sessions before it counts as hung
+READY_TIMEOUT = 10.0
+
+
+def parse_option_line(line: str) -> tuple:
+    """
+    :param line: An "option" line from the engine's "uci" answer
+
+    :returns: A tuple of the option's name, type and default value ("" if it has none)
+    """
+    name, _, rest = line[len("option name "):].partition(" type ")
+    option_type, _, rest = rest.partition(" ")
+    default = ""
+    if rest.startswith("default"):
+        default = rest[len("default"):].strip()
+        for keyword in (" min ", " max ", " var "):
+            default = default.split(keyword, 1)[0]
+    if default == "<empty>":
+        default = ""
+    return name, option_type, default
+
+
+class EngineDaemon:
+    """
+    Owns the Stockfish process and relays UCI between it and one attached client at a time.
+    """
+
+    def __init__(self, engine_path: str, options: dict = {}):
+        """
+        :param engine_path: The Stockfish binary
+        :param options: UCI options to set once at start-up, e.g. {"Hash": 64}
+        """
+        self.process = subprocess.Popen([engine_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        text=True, bufsize=1)
+        self.options = {}
+        self.client = None
+        self.searching = False
+        self._client_lock = threading.Lock()
+        self._readyok = threading.Event()
+        # One entry per outstanding "isready", True if the daemon (not the client) sent it
+        self._ready_owners = collections.deque()
+
+        # Cache the engine's identification so every client's "uci" is answered immediately
+        self.uci_lines = []
+        # The value of every option after start-up, by lowercase name: a tuple of its name and value
+        self.startup_options = {}
+        # Lowercase names of the button options, which have no value to de-duplicate
+        self.buttons = set()
+        self._send("uci")
+        for line in self.process.stdout:
+            line = line.rstrip("\n")
+            if line.startswith("id ") or line.startswith("option "):
+                self.uci_lines.append(line)
+            if line.startswith("option name "):
+                name, option_type, default = parse_option_line(line)
+                if option_type == "button":
+                    self.buttons.add(name.lower())
+                else:
+                    self.startup_options[name.lower()] = (name, default)
+            if line == "uciok":
+                break
+        for name, value in options.items():
+            self._setoption(name, str(value))
+            self.startup_options[name.lower()] = (name, str(value))
+        self._send("isready")
+        for line in self.process.stdout:
+            if line.strip() == "readyok":
+                break
+
+        self._reader = threading.Thread(target=self._read_engine, name="engine-reader", daemon=True)
+        self._reader.start()
+
+    def _send(self, line: str) -> None:
+        self.process.stdin.write(line + "\n")
+        self.process.stdin.flush()
+
+    def _setoption(self, name: str, value: str) -> None:
+        """
+        Forwards a setoption command unless the option already has that value (buttons are
+        always forwarded).
+        """
+        key = name.lower()
+        if key not in self.buttons:
+            if self.options.get(key, self.startup_options.get(key, (None, None))[1]) == value:
+                return
+            self.options[key] = value
+        if value == "":
+            self._send(f"setoption name {name}")
+        else:
+            self._send(f"setoption name {name} value {value}")
+
+    def _read_engine(self) -> None:
+        """
+        Forwards every engine line to the attached client, and tracks whether a search is running.
+        """
+        for line in self.process.stdout:
+            if line.startswith("bestmove"):
+                self.searching = False
+            elif line.strip() == "readyok" and self._ready_owners and self._ready_owners.popleft():
+                self._readyok.set()
+                continue
+            with self._client_lock:
+                if self.client is not None:
+                    try:
+                        self.client.sendall(line.encode("utf-8"))
+                    except OSError:
+                        self.client = None
+        print("Engine process exited; stopping daemon", flush=True)
+        os._exit(1)
+
+    def serve(self, socket_path: str) -> None:
+        """
+        Accepts clients on the Unix socket forever, serving one at a time.
+
+        :param socket_path: The path of the Unix domain socket to listen on
+        """
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(1)
+        print(f"Engine daemon listening on {socket_path}", flush=True)
+
+        try:
+            while True:
+                client, _ = server.accept()
+                print("Controller attached", flush=True)
+                self.session(client)
+                print("Controller detached", flush=True)
+        finally:
+            server.close()
+            os.unlink(socket_path)
+
+    def session(self, client: socket.socket) -> None:
+        """
+        Relays one client's commands to the engine until it sends "quit" or disconnects.
+
+        :param client: The connected client socket
+        """
+        with self._client_lock:
+            self.client = client
+        first_search = True
+        try:
+            for line in client.makefile("r", encoding="utf-8"):
+                line = line.strip()
+                command = line.split(" ", 1)[0]
+                if command == "quit":
+                    break
+                elif command == "uci":
+                    client.sendall(("\n".join(self.uci_lines) + "\nuciok\n").encode("utf-8"))
+                elif command == "setoption":
+                    name, _, value = line[len("setoption name "):].partition(" value ")
+                    self._setoption(name, value)
+                elif command == "ucinewgame" and first_search:
+                    continue
+                else:
+                    if command == "go":
+                        first_search = False
+                        self.searching = True
+                    elif command == "isready":
+                        self._ready_owners.append(False)
+                    self._send(line)
+        except OSError:
+            pass
+        finally:
+            with self._client_lock:
+                self.client = None
+            client.close()
+            # Leave the engine idle, in sync and with its start-up options for the next session
+            if self.searching:
+                self._send("stop")
+            self._wait_ready()
+            changed = [(name, value) for key, (name, value) in self.startup_options.items()
+                       if key in self.options and self.options[key] != value]
+            if changed:
+                for name, value in changed:
+                    self._setoption(name, value)
+                print(f"Restored options: {', '.join(f'{name}={value}' for name, value in changed)}", flush=True)
+                self._wait_ready()
+
+    def _wait_ready(self) -> None:
+        """
+        Waits for the engine to answer "isready". A hung engine would wedge the daemon for good, so
+        after READY_TIMEOUT it is killed and the daemon exits for its supervisor to restart it.
+        """
+        self._readyok.clear()
+        self._ready_owners.append(True)
+        self._send("isready")
+        if not self._readyok.wait(READY_TIMEOUT):
+            print(f"Engine did not answer isready within {READY_TIMEOUT:g} s; stopping daemon", flush=True)
+            self.process.kill()
+            os._exit(1)
+
+
+class _SocketTransport:
+    """
+    The subset of asyncio.SubprocessTransport that python-chess uses, backed by a Unix socket
+    connected to an EngineDaemon.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self._writer = writer
+        self.returncode = None
+
+    def get_pipe_transport(self, fd: int):
+        return self._writer.transport
+
+    def get_returncode(self):
+        return self.returncode
+
+    def get_pid(self):
+        return None
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def terminate(self) -> None:
+        self._writer.close()
+
+    def kill(self) -> None:
+        self._writer.close()
+
+
+def attach_uci(socket_path: str = DEFAULT_SOCKET, timeout: float = 10.0) -> chess.engine.SimpleEngine:
+    """
+    Attaches to a running EngineDaemon. The result behaves exactly like the SimpleEngine returned
+    by chess.engine.SimpleEngine.popen_uci(), except that quit() only detaches from the daemon.
+
+    :param socket_path: The daemon's Unix domain socket
+    :param timeout: The python-chess command timeout, in seconds
+
+    :returns: A SimpleEngine connected to the daemon
+
+    :raises OSError: If the daemon is not running
+    """
+    async def background(future):
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        transport = _SocketTransport(writer)
+        protocol = chess.engine.UciProtocol()
+        protocol.connection_made(transport)
+        simple_engine = chess.engine.SimpleEngine(transport, protocol, timeout=timeout)
+
+        async def pump():
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                protocol.pipe_data_received(1, data)
+            transport.returncode = 0
+            protocol.connection_lost(None)
+
+        pump_task = asyncio.create_task(pump())
+        try:
+            await asyncio.wait_for(protocol.initialize(), timeout)
+            future.set_result(simple_engine)
+            returncode = await protocol.returncode
+            simple_engine.returncode.set_result(returncode)
+        finally:
+            simple_engine.close()
+            pump_task.cancel()
+        await simple_engine.shutdown_event.wait()
+
+    return chess.engine.run_in_background(background, name=f"SimpleEngine (socket={socket_path!r})")
+
+
+def open_engine(engine_path: str, socket_path: str = None) -> chess.engine.SimpleEngine:
+    """
+    Attaches to the engine daemon if a socket is given and the daemon is running, otherwise
+    spawns a private engine process.
+
+    :param engine_path: The Stockfish binary to spawn if the daemon is unavailable
+    :param socket_path: The daemon's Unix domain socket, or None to always spawn
+
+    :returns: A running SimpleEngine
+    """
+    if socket_path is not None:
+        try:
+            engine = attach_uci(socket_path)
+            print(f"Attached to engine daemon at {socket_path}", flush=True)
+            return engine
+        except OSError as e:
+            print(f"Engine daemon unavailable at {socket_path} ({e}); spawning a private engine", flush=True)
+    return chess.engine.SimpleEngine.popen_uci(engine_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a persistent Stockfish over a Unix domain socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="The Unix domain socket to listen on")
+    parser.add_argument("--engine", default=None, help="The Stockfish binary (default: the build installed by build_matrix.py)")
+    parser.add_argument("--hash", type=int, default=None, help="Hash size in MB (default: sized for the host)")
+    parser.add_argument("--threads", type=int, default=None, help="Number of search threads (default: sized for the host)")
+    args = parser.parse_args()
+
+    options = host_profile.engine_options()
+    if args.threads is not None:
+        options["Threads"] = args.threads
+    if args.hash is not None:
+        options["Hash"] = args.hash
+    engine_path = args.engine if args.engine is not None else build_matrix.installed_engine(DEFAULT_MANIFEST, DEFAULT_ENGINE)
+    daemon = EngineDaemon(engine_path, options)
+    try:
+        daemon.serve(args.socket)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.process.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+Schedules every search on the engine by priority, so background work never delays a move the
+MSP is waiting for. Tasks belong to one of four priority classes:
+- CRITICAL: the reply to a human move (or the robot's first move)
+- PONDER: searching the position after the human's expected reply while they think
+- SPECULATIVE: other searches that may turn out to be useful
+- ANALYSIS: post-game analysis
+Tasks run one at a time on a worker thread, highest priority first. A task that arrives while a
+lower-priority one is searching preempts it: the running search is sent UCI "stop" at once, and
+if the engine has not answered within PREEMPT_DEADLINE the watchdog counts it as hung and
+replaces it, so a critical reply never waits behind background work for longer than that.
+Preempted tasks are either dropped (a ponder search is stale once the human has moved) or put
+back in the queue to run again later.
+
+The time from "stop" to the engine being free is the preemption latency; it is measured for every
+preemption, logged, and exported through metrics() (e.g. into the game records).
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+import chess
+import chess.engine
+
+# Priority classes, most urgent first
+CRITICAL = 0
+PONDER = 1
+SPECULATIVE = 2
+ANALYSIS = 3
+PRIORITY_NAMES = {CRITICAL: "critical", PONDER: "ponder", SPECULATIVE: "speculative", ANALYSIS: "analysis"}
+
+# Seconds a preempted search may take to answer "stop" before the engine counts as hung
+PREEMPT_DEADLINE = 0.25
+
+
+class EngineTask:
+    """
+    One search waiting for or running on the engine.
+    """
+
+    def __init__(self, priority: int, board: chess.Board, limit: chess.engine.Limit, game: object = None,
+                 early_stop=None, requeue: bool = False):
+        """
+        :param priority: The task's priority class (CRITICAL, PONDER, SPECULATIVE or ANALYSIS)
+        :param board: The position to search (copied)
+        :param limit: The search limit
+        :param game: The game the search belongs to (see game_lifecycle.py)
+        :param early_stop: Passed to the search (see early_stop.py)
+        :param requeue: If True, the task runs again after being preempted; otherwise it is dropped
+        """
+        self.priority = priority
+        self.board = board.copy()
+        self.limit = limit
+        self.game = game
+        self.early_stop = early_stop
+        self.requeue = requeue
+        # A tuple of the best move and its statistics, or None if the task was dropped
+        self.result = None
+        self.done = threading.Event()
+        self.preempted_at = None
+        self._analysis = None
+
+    def wait(self) -> tuple:
+        """
+        :returns: The task's result once it is done (None if it was dropped)
+        """
+        self.done.wait()
+        return self.result
+
+
+class EngineScheduler:
+    """
+    Runs searches through an engine watchdog one at a time, by priority, preempting lower-priority
+    searches.
+    """
+
+    def __init__(self, watchdog):
+        """
+        :param watchdog: The engine watchdog (or anything with the same search() interface) the
+                         searches run through
+        """
+        self.watchdog = watchdog
+        self._condition = threading.Condition()
+        # Heap of (priority, sequence number, task) of the waiting tasks
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running = None
+        # Set while a critical task is waiting or running
+        self.live = threading.Event()
+        # Preemption latencies in seconds, and how many exceeded PREEMPT_DEADLINE
+        self.preemptions = []
+        self.overdue = 0
+        self._worker = threading.Thread(target=self._run, name="engine-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, task: EngineTask) -> EngineTask:
+        """
+        Queues a task, preempting the running task if it has a lower priority.
+
+        :param task: The task to run
+
+        :returns: The task
+        """
+        with self._condition:
+            heapq.heappush(self._queue, (task.priority, next(self._sequence), task))
+            if task.priority == CRITICAL:
+                self.live.set()
+            if self._running is not None and self._running.priority > task.priority:
+                self._preempt(self._running)
+            self._condition.notify_all()
+        return task
+
+    def search(self, priority: int, board: chess.Board, limit: chess.engine.Limit, game: object = None,
+               early_stop=None) -> tuple:
+        """
+        Runs a search and waits for its result.
+
+        :returns: A tuple of the best move (chess.Move) and its statistics (see EngineWatchdog.search)
+        """
+        return self.submit(EngineTask(priority, board, limit, game, early_stop)).wait()
+
+    def cancel(self, priority: int, only: bool = False) -> None:
+        """
+        Drops every waiting task of the given priority class or lower, and stops the running one.
+        Returns once the engine is no longer busy with any of them.
+
+        :param priority: The most urgent priority class to cancel
+        :param only: Only cancel tasks of exactly this priority class, e.g. the ponder search but
+                     not the warm-up's speculative searches
+        """
+        def cancelled(task_priority: int) -> bool:
+            return task_priority == priority if only else task_priority >= priority
+
+        with self._condition:
+            for entry in [entry for entry in self._queue if cancelled(entry[0])]:
+                self._queue.remove(entry)
+                entry[2].done.set()
+            heapq.heapify(self._queue)
+            task = self._running
+            if task is not None and cancelled(task.priority):
+                task.requeue = False
+                self._preempt(task)
+                while self._running is task:
+                    self._condition.wait()
+
+    def _preempt(self, task: EngineTask) -> None:
+        # Called with the condition held
+        if task.preempted_at is not None:
+            return
+        task.preempted_at = time.perf_counter()
+        if task._analysis is not None:
+            task._analysis.stop()
+        self.watchdog.cut_deadline(PREEMPT_DEADLINE)
+
+    def _started(self, task: EngineTask, analysis) -> None:
+        with self._condition:
+            task._analysis = analysis
+            # Preempted before the search got going
+            if task.preempted_at is not None:
+                analysis.stop()
+                self.watchdog.cut_deadline(PREEMPT_DEADLINE)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, task = heapq.heappop(self._queue)
+                self._running = task
+
+            result = self.watchdog.search(task.board, task.limit, task.game, task.early_stop,
+                                          on_start=lambda analysis: self._started(task, analysis))
+
+            with self._condition:
+                self._running = None
+                if task.preempted_at is not None:
+                    latency = time.perf_counter() - task.preempted_at
+                    self.preemptions.append(latency)
+                    if latency > PREEMPT_DEADLINE:
+                        self.overdue += 1
+                    print(f"Preempted a {PRIORITY_NAMES[task.priority]} search in {latency * 1000:.1f} ms", flush=True)
+                    task.preempted_at = None
+                    task._analysis = None
+                    if task.requeue:
+                        heapq.heappush(self._queue, (task.priority, next(self._sequence), task))
+                    else:
+                        task.done.set()
+                else:
+                    task.result = result
+                    task.done.set()
+                if not any(entry[0] == CRITICAL for entry in self._queue):
+                    self.live.clear()
+                self._condition.notify_all()
+
+    def metrics(self) -> dict:
+        """
+        :returns: The number of preemptions, their median and maximum latency in milliseconds, and
+                  how many took longer than PREEMPT_DEADLINE
+        """
+        latencies = sorted(self.preemptions)
+        return {
+            "preemptions": len(latencies),
+            "preempt_median_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            "preempt_max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+            "preempt_overdue": self.overdue,
+        }
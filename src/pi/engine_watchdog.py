@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+A supervisor for the engine. Every search runs against a hard deadline; if Stockfish hangs past
+it, or crashes (EngineTerminatedError, a broken pipe, a protocol error), the engine is killed and
+respawned, and the robot's move comes from a shallow fallback search of the same position so the
+MSP still gets an answer within its latency budget. python-chess sends the whole game to the new
+engine ("position ... moves" built from board.move_stack), so no state is lost with the old one.
+
+If even the respawned engine cannot answer, a legal move is chosen without the engine, so the
+controller never blocks forever or dies mid-game.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import chess
+import chess.engine
+import search_stats
+
+# Seconds allowed on top of a timed search's own limit before the engine counts as hung
+DEADLINE_MARGIN = 1.5
+# Deadline (seconds) for searches limited by nodes or depth instead of time
+UNTIMED_DEADLINE = 10.0
+# Seconds between checks of the deadline while a search runs
+DEADLINE_STEP = 0.05
+# Searches on the game clock: the largest fraction of the remaining time Stockfish plans to use
+# for one move (timeman.cpp caps its maximum time below this)
+CLOCK_DEADLINE_FRACTION = 0.8
+# The fallback search after a restart, and its deadline (seconds)
+FALLBACK_DEPTH = 8
+FALLBACK_DEADLINE = 1.0
+
+# What a dead or misbehaving engine raises out of python-chess
+ENGINE_ERRORS = (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError, asyncio.TimeoutError,
+                 concurrent.futures.CancelledError)
+
+
+class SearchTimeout(Exception):
+    """
+    Raised when a search does not finish before its deadline.
+    """
+
+
+class EngineWatchdog:
+    """
+    Runs searches with a hard deadline, restarting the engine and falling back to a shallow search
+    when one times out or the engine dies.
+    """
+
+    def __init__(self, engine: chess.engine.SimpleEngine, restart_engine=None, on_restart=None):
+        """
+        :param engine: The running engine
+        :param restart_engine: A function taking no arguments that starts a new engine and returns
+                               it once ready, or None if the engine cannot be restarted
+        :param on_restart: A function called with the new engine after every restart, or None
+        """
+        self.engine = engine
+        self.restart_engine = restart_engine
+        self.on_restart = on_restart
+        self.metrics = {"timeouts": 0, "crashes": 0, "restarts": 0, "failed_restarts": 0, "fallbacks": 0}
+        # When the running search counts as hung (time.perf_counter())
+        self._deadline_at = None
+        self._deadline_cut = False
+
+    def deadline(self, limit: chess.engine.Limit, turn: chess.Color = chess.WHITE) -> float:
+        """
+        :param limit: The search limit
+        :param turn: The side the engine is searching for
+
+        :returns: The number of seconds the search may take before the engine counts as hung
+        """
+        if limit.time is not None:
+            return limit.time + DEADLINE_MARGIN
+        clock = limit.white_clock if turn == chess.WHITE else limit.black_clock
+        if clock is not None:
+            # Stockfish never plans to use more than CLOCK_DEADLINE_FRACTION of its remaining time
+            return clock * CLOCK_DEADLINE_FRACTION + DEADLINE_MARGIN
+        return UNTIMED_DEADLINE
+
+    def _search(self, board: chess.Board, limit: chess.engine.Limit, game: object, deadline: float,
+                early_stop=None, on_start=None) -> tuple:
+        """
+        Runs search_stats.search() on a worker thread and waits at most deadline seconds for it
+        (or less, see cut_deadline).
+
+        :raises SearchTimeout: If the search did not finish in time
+        :raises Exception: Whatever the search raised
+        """
+        result = {}
+
+        def worker():
+            try:
+                result["value"] = search_stats.search(self.engine, board, limit, game, early_stop, on_start)
+            except Exception as e:
+                result["error"] = e
+
+        search_start = time.perf_counter()
+        self._deadline_at = search_start + deadline
+        self._deadline_cut = False
+        thread = threading.Thread(target=worker, name="search", daemon=True)
+        thread.start()
+        # Waits in short steps, so a deadline cut while waiting takes effect
+        while thread.is_alive() and time.perf_counter() < self._deadline_at:
+            thread.join(min(DEADLINE_STEP, self._deadline_at - time.perf_counter()))
+        if thread.is_alive():
+            raise SearchTimeout(f"no bestmove after {time.perf_counter() - search_start:.1f} s")
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def search(self, board: chess.Board, limit: chess.engine.Limit, game: object = None, early_stop=None,
+               on_start=None) -> tuple:
+        """
+        Searches the position like search_stats.search(), but never blocks past the deadline and
+        never raises because of the engine.
+
+        :param board: The position to search (with its move stack)
+        :param limit: The search limit
+        :param game: The game the search belongs to (see game_lifecycle.py)
+        :param early_stop: Passed to search_stats.search() (not used by the fallback search)
+        :param on_start: Passed to search_stats.search() (not used by the fallback search)
+
+        :returns: A tuple of the best move (chess.Move) and its statistics. Fallback moves have a
+                  "fallback" statistic: "depth" for the shallow search, "legal" if the engine could
+                  not be used at all
+        """
+        # The worker gets its own copy, so a hung search can never see later changes to the board
+        try:
+            return self._search(board.copy(), limit, game, self.deadline(limit, board.turn), early_stop, on_start)
+        except SearchTimeout as e:
+            self.metrics["timeouts"] += 1
+            print(f"Engine watchdog: search timed out ({e}); restarting the engine", flush=True)
+        except ENGINE_ERRORS as e:
+            self.metrics["crashes"] += 1
+            print(f"Engine watchdog: engine failed ({type(e).__name__}: {e}); restarting the engine", flush=True)
+
+        self.metrics["fallbacks"] += 1
+        # Nobody waits for the result of a search that was cut short, so it gets no fallback search
+        if self.restart() and not self._deadline_cut:
+            try:
+                move, stats = self._search(board.copy(), chess.engine.Limit(depth=FALLBACK_DEPTH), None, FALLBACK_DEADLINE)
+                stats["fallback"] = "depth"
+                print(f"Engine watchdog: answered with a depth {FALLBACK_DEPTH} search; {self.format_metrics()}", flush=True)
+                return move, stats
+            except (SearchTimeout,) + ENGINE_ERRORS as e:
+                print(f"Engine watchdog: fallback search failed ({type(e).__name__}: {e})", flush=True)
+
+        move = fallback_move(board)
+        print(f"Engine watchdog: answered without the engine; {self.format_metrics()}", flush=True)
+        return move, {"fallback": "legal"}
+
+    def cut_deadline(self, seconds: float) -> None:
+        """
+        Shortens the running search's deadline, e.g. once it has been told to stop: if the engine
+        has not answered within seconds, it counts as hung.
+
+        :param seconds: The seconds from now the search may still take
+        """
+        if self._deadline_at is not None:
+            self._deadline_at = min(self._deadline_at, time.perf_counter() + seconds)
+            self._deadline_cut = True
+
+    def restart(self) -> bool:
+        """
+        Kills the current engine and starts a new one.
+
+        :returns: True if a new engine is running
+        """
+        try:
+            # Closing the transport kills the process; a hung search thread then fails and exits
+            self.engine.close()
+        except Exception:
+            pass
+        if self.restart_engine is None:
+            self.metrics["failed_restarts"] += 1
+            return False
+
+        restart_start = time.perf_counter()
+        try:
+            self.engine = self.restart_engine()
+        except Exception as e:
+            self.metrics["failed_restarts"] += 1
+            print(f"Engine watchdog: restart failed ({type(e).__name__}: {e})", flush=True)
+            return False
+        self.metrics["restarts"] += 1
+        print(f"Engine watchdog: engine restarted in {(time.perf_counter() - restart_start) * 1000:.0f} ms", flush=True)
+        if self.on_restart is not None:
+            self.on_restart(self.engine)
+        return True
+
+    def format_metrics(self) -> str:
+        """
+        :returns: The watchdog's counters as a one-line summary for the controller log
+        """
+        return ", ".join(f"{name} {count}" for name, count in self.metrics.items())
+
+
+def fallback_move(board: chess.Board) -> chess.Move:
+    """
+    Picks a move without the engine: a mating move if there is one, otherwise the capture of the
+    most valuable piece, otherwise the first legal move.
+
+    :param board: The position to move in (must have a legal move)
+
+    :returns: A legal move
+    """
+    values = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9}
+    best, best_value = None, -1
+    for move in board.legal_moves:
+        board.push(move)
+        mate = board.is_checkmate()
+        board.pop()
+        if mate:
+            return move
+        captured = board.piece_type_at(move.to_square)
+        value = values.get(captured, 0) if captured is not None else (1 if board.is_en_passant(move) else 0)
+        if value > best_value:
+            best, best_value = move, value
+    return best
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""
+Post-game analysis for the visitor's printout: per-move centipawn loss, blunder/mistake/
+inaccuracy flags and accuracy, for both sides.
+
+Finished games are handed over by the controller (or given on the command line) as game record
+files. Their positions are farmed out to a pool of Stockfish processes that never compete with
+the live engine: each runs under nice, with one thread and a small hash, and searches a fixed
+number of nodes per position, so the results do not depend on the load. While the live engine is
+searching (see engine_scheduler.py) the whole pool is paused with SIGSTOP and resumed with
+SIGCONT afterwards, so it takes no CPU time at all from the robot's moves.
+
+Results are streamed next to the game record, into RECORD.analysis.jsonl: one line per move as
+soon as both positions around it are analysed (in move order), then a summary line per side.
+Once a game is analysed, the controller adds the analysis to the game archive (see
+game_archive.analysis_archiver).
+
+Usage:
+    python game_analysis.py RECORD [RECORD ...] [--workers N] [--nodes N] [--engine PATH] [--force]
+"""
+
+import argparse
+import json
+import math
+import os
+import queue
+import signal
+import sys
+import threading
+
+import build_matrix
+import chess
+import chess.engine
+import host_profile
+import search_stats
+
+# Nodes searched per position
+ANALYSIS_NODES = 100000
+
+# The analysis engines' options and niceness
+ANALYSIS_OPTIONS = {"Threads": 1, "Hash": 16}
+ANALYSIS_NICE = 19
+
+# Evaluations are clamped to this many centipawns (mates count as the limit) before computing
+# losses, so a won position thrown into a slightly less won one is not a blunder
+EVAL_CAP = 1000
+
+# Centipawn losses of the flags, from the worst, and their names in the summary
+FLAGS = [(300, "blunder"), (100, "mistake"), (50, "inaccuracy")]
+FLAG_COUNTS = {"blunder": "blunders", "mistake": "mistakes", "inaccuracy": "inaccuracies"}
+
+# Seconds between checks of whether the live engine is searching
+PAUSE_POLL = 0.01
+
+# Suffix of the analysis file written next to each game record
+ANALYSIS_SUFFIX = ".analysis.jsonl"
+
+
+def win_percent(cp: int) -> float:
+    """
+    :param cp: An evaluation in centipawns
+    :returns: The winning chances it gives, 0 to 100 (the logistic curve used by Lichess)
+    """
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * cp)) - 1)
+
+
+def move_accuracy(win_before: float, win_after: float) -> float:
+    """
+    :param win_before: The mover's winning chances before the move
+    :param win_after: The mover's winning chances after the move
+
+    :returns: The move's accuracy, 0 to 100
+    """
+    return min(100.0, max(0.0, 103.1668 * math.exp(-0.04354 * max(0.0, win_before - win_after)) - 3.1669))
+
+
+def evaluate(engine: chess.engine.SimpleEngine, board: chess.Board, nodes: int) -> int:
+    """
+    :param engine: An analysis engine
+    :param board: The position
+    :param nodes: The nodes to search
+
+    :returns: The evaluation for the side to move in centipawns, clamped to EVAL_CAP
+    """
+    if board.is_checkmate():
+        return -EVAL_CAP
+    if board.is_stalemate() or board.is_insufficient_material():
+        return 0
+    info = engine.analyse(board, chess.engine.Limit(nodes=nodes))
+    return max(-EVAL_CAP, min(EVAL_CAP, info["score"].relative.score(mate_score=EVAL_CAP)))
+
+
+def analysis_path(record_path: str) -> str:
+    return record_path + ANALYSIS_SUFFIX
+
+
+def is_analysed(record_path: str) -> bool:
+    """
+    :returns: True if the record's analysis file is complete (ends with its summary)
+    """
+    try:
+        with open(analysis_path(record_path)) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return False
+    return bool(lines) and "summary" in json.loads(lines[-1])
+
+
+def summarize(moves: list) -> dict:
+    """
+    :param moves: The analysed moves of a game
+
+    :returns: Per side (search_stats.HUMAN and search_stats.ROBOT): the number of moves, average
+              centipawn loss ("acpl"), accuracy and the count of each flag
+    """
+    summary = {}
+    for side in (search_stats.HUMAN, search_stats.ROBOT):
+        side_moves = [move for move in moves if move["by"] == side]
+        if not side_moves:
+            continue
+        summary[side] = {
+            "moves": len(side_moves),
+            "acpl": round(sum(move["loss"] for move in side_moves) / len(side_moves)),
+            "accuracy": round(sum(move["accuracy"] for move in side_moves) / len(side_moves), 1),
+        }
+        for _, flag in FLAGS:
+            summary[side][FLAG_COUNTS[flag]] = sum(1 for move in side_moves if move["flag"] == flag)
+    return summary
+
+
+class GameJob:
+    """
+    The analysis of one game record.
+    """
+
+    def __init__(self, record_path: str):
+        self.record_path = record_path
+        with open(record_path) as f:
+            record = json.load(f)
+        self.record = record
+        self.moves = record["moves"]
+        # The position before every move, and the final position
+        board = chess.Board(record.get("fen", chess.STARTING_FEN))
+        self.positions = [board.copy()]
+        for move in self.moves:
+            board.push_uci(move["uci"])
+            self.positions.append(board.copy())
+        self.evals = {}
+        self.analysed = []
+        # Every line written to the analysis file
+        self.lines = []
+
+
+class AnalysisPipeline:
+    """
+    Analyses finished games on a pool of niced, single-thread, fixed-node Stockfish processes.
+    """
+
+    def __init__(self, engine_path: str, workers: int = 1, nodes: int = ANALYSIS_NODES, live: threading.Event = None,
+                 on_analysed=None):
+        """
+        :param engine_path: The Stockfish binary
+        :param workers: The number of analysis engines
+        :param nodes: The nodes searched per position
+        :param live: Set while the live engine is searching; the pool is paused meanwhile (None to never pause)
+        :param on_analysed: A function called with the record file, the record and the analysis'
+                            lines once a game is analysed, always on the same thread (None for nothing)
+        """
+        self.engine_path = engine_path
+        self.nodes = nodes
+        self.live = live
+        self.on_analysed = on_analysed
+        self.engines = []
+        self._games = queue.Queue()
+        self._positions = queue.Queue()
+        self._results = queue.Queue()
+        self._engines_lock = threading.Lock()
+        self.paused = False
+        self.pauses = 0
+        self.idle = threading.Event()
+        self.idle.set()
+        for index in range(workers):
+            threading.Thread(target=self._work, name=f"analysis-{index}", daemon=True).start()
+        threading.Thread(target=self._coordinate, name="analysis", daemon=True).start()
+        if live is not None:
+            threading.Thread(target=self._pause_while_live, name="analysis-pause", daemon=True).start()
+
+    def submit(self, record_path: str) -> None:
+        """
+        Queues a saved game record for analysis.
+        """
+        self.idle.clear()
+        self._games.put(record_path)
+
+    def _start_engine(self) -> chess.engine.SimpleEngine:
+        engine = chess.engine.SimpleEngine.popen_uci(["nice", "-n", str(ANALYSIS_NICE), self.engine_path])
+        engine.configure(ANALYSIS_OPTIONS)
+        with self._engines_lock:
+            self.engines.append(engine)
+            # Started while the live engine is searching
+            if self.paused:
+                os.kill(engine.transport.get_pid(), signal.SIGSTOP)
+        return engine
+
+    def _work(self) -> None:
+        engine = None
+        while True:
+            job, ply = self._positions.get()
+            try:
+                if engine is None:
+                    engine = self._start_engine()
+                self._results.put((job, ply, evaluate(engine, job.positions[ply], self.nodes)))
+            except (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError) as e:
+                print(f"Analysis engine failed ({type(e).__name__}: {e})", flush=True)
+                self._results.put((job, ply, None))
+                if engine is not None:
+                    with self._engines_lock:
+                        self.engines.remove(engine)
+                    engine.close()
+                engine = None
+
+    def _coordinate(self) -> None:
+        while True:
+            record_path = self._games.get()
+            try:
+                self.analyse(GameJob(record_path))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not analyse {record_path}: {e}", flush=True)
+            if self._games.empty():
+                self.idle.set()
+
+    def analyse(self, job: GameJob) -> None:
+        """
+        Farms out a game's positions and streams the results to its analysis file in move order.
+        """
+        for ply in range(len(job.positions)):
+            self._positions.put((job, ply))
+        next_move = 0
+        with open(analysis_path(job.record_path), "w") as out:
+            for _ in range(len(job.positions)):
+                _, ply, score = self._results.get()
+                job.evals[ply] = score
+                # Every move whose positions before and after are both analysed is written out
+                while next_move + 1 in job.evals and next_move in job.evals:
+                    self._write_move(job, next_move, out)
+                    next_move += 1
+            summary = {"summary": summarize(job.analysed), "nodes": self.nodes}
+            job.lines.append(summary)
+            out.write(json.dumps(summary) + "\n")
+        print(f"Analysed {job.record_path}: {json.dumps(summarize(job.analysed))}", flush=True)
+        if self.on_analysed is not None:
+            try:
+                self.on_analysed(job.record_path, job.record, job.lines)
+            except Exception as e:
+                print(f"Could not hand over the analysis of {job.record_path}: {e}", flush=True)
+
+    def _write_move(self, job: GameJob, ply: int, out) -> None:
+        before, after = job.evals[ply], job.evals[ply + 1]
+        move = job.moves[ply]
+        if before is None or after is None:
+            entry = {"ply": ply, "by": move["by"], "uci": move["uci"], "error": True}
+        else:
+            # Both evaluations from the mover's point of view
+            after = -after
+            loss = max(0, before - after)
+            entry = {
+                "ply": ply,
+                "by": move["by"],
+                "uci": move["uci"],
+                "cp_before": before,
+                "cp_after": after,
+                "loss": loss,
+                "flag": next((flag for threshold, flag in FLAGS if loss >= threshold), None),
+                "accuracy": round(move_accuracy(win_percent(before), win_percent(after)), 1),
+            }
+            job.analysed.append(entry)
+        job.lines.append(entry)
+        out.write(json.dumps(entry) + "\n")
+        out.flush()
+
+    def _pause_while_live(self) -> None:
+        while True:
+            live = self.live.wait(PAUSE_POLL) if not self.paused else self.live.is_set()
+            if live != self.paused:
+                with self._engines_lock:
+                    self.paused = live
+                    for engine in self.engines:
+                        try:
+                            os.kill(engine.transport.get_pid(), signal.SIGSTOP if live else signal.SIGCONT)
+                        except (OSError, TypeError):
+                            pass
+                if live:
+                    self.pauses += 1
+            if self.paused:
+                threading.Event().wait(PAUSE_POLL)
+
+    def close(self) -> None:
+        with self._engines_lock:
+            for engine in self.engines:
+                try:
+                    os.kill(engine.transport.get_pid(), signal.SIGCONT)
+                    engine.quit()
+                except Exception:
+                    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse game records: centipawn loss, blunders and accuracy per move")
+    parser.add_argument("records", nargs="+", help="Game record files (see search_stats.py)")
+    parser.add_argument("--workers", type=int, default=host_profile.cpu_count(), help="Analysis engines")
+    parser.add_argument("--nodes", type=int, default=ANALYSIS_NODES, help="Nodes per position")
+    parser.add_argument("--engine", default=None, help="The Stockfish binary")
+    parser.add_argument("--force", action="store_true", help="Analyse records again even if their analysis is complete")
+    args = parser.parse_args()
+
+    engine_path = args.engine
+    if engine_path is None:
+        import chess_robot_v7 as robot
+        engine_path = build_matrix.installed_engine(robot.STOCKFISH_MANIFEST, robot.STOCKFISH_PATH)
+    pipeline = AnalysisPipeline(engine_path, args.workers, args.nodes)
+    for record_path in args.records:
+        if not args.force and is_analysed(record_path):
+            print(f"Skipping {record_path}: already analysed", flush=True)
+            continue
+        pipeline.submit(record_path)
+    pipeline.idle.wait()
+    pipeline.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
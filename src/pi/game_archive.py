@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""
+An indexed archive of every game the robot has played, in one SQLite file.
+
+Each game is stored once, as its zlib-compressed game record (moves with timestamps, the engine's
+search statistics, the result; see search_stats.GameRecord) and, once game_analysis.py has run,
+the per-move analysis. Games are indexed by date, result and opening, where the opening is the
+Polyglot Zobrist key of the position after OPENING_PLY plies, so transpositions count as the same
+opening. Every position of every game is also indexed by its Zobrist key together with the move
+played from it, so "all games reaching this position" and "what was played here" are single
+index lookups; the opening book builder (opening_book.py) and the cache warm-up read these.
+
+The controller adds each game as it is saved (--archive), and its analysis once game_analysis.py
+has finished it (see analysis_archiver). Record files can also be imported afterwards; importing
+is incremental, and picks up analyses finished since the last import. The
+archive uses SQLite's write-ahead log, so it can be read (e.g. for an export) while the
+controller writes to it. PGN export streams one game at a time, so it never loads the archive.
+
+Usage:
+    python game_archive.py ARCHIVE import RECORD [RECORD ...]
+    python game_archive.py ARCHIVE export [--since DATE] [--until DATE] [--result RESULT] [--opening FEN] [-o FILE]
+    python game_archive.py ARCHIVE query FEN
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import zlib
+
+import chess
+import chess.pgn
+import chess.polyglot
+import search_stats
+
+# The opening of a game is the position after this many plies
+OPENING_PLY = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    source TEXT UNIQUE,
+    started TEXT NOT NULL,
+    date TEXT NOT NULL,
+    result TEXT NOT NULL,
+    player_color TEXT,
+    elo INTEGER,
+    plies INTEGER NOT NULL,
+    opening INTEGER,
+    analysed INTEGER NOT NULL DEFAULT 0,
+    record BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_date ON games (date);
+CREATE INDEX IF NOT EXISTS games_result ON games (result);
+CREATE INDEX IF NOT EXISTS games_opening ON games (opening);
+CREATE TABLE IF NOT EXISTS positions (
+    key INTEGER NOT NULL,
+    game INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    move TEXT,
+    PRIMARY KEY (key, game, ply)
+) WITHOUT ROWID;
+"""
+
+
+def position_key(board: chess.Board) -> int:
+    """
+    :param board: A position
+
+    :returns: Its Polyglot Zobrist key as a signed 64-bit integer (SQLite's integer type)
+    """
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def read_analysis(record_path: str) -> list:
+    """
+    :param record_path: A game record file
+
+    :returns: The per-move analysis written by game_analysis.py, or None if it is not complete
+    """
+    try:
+        with open(record_path + ".analysis.jsonl") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return None
+    if not lines or "summary" not in lines[-1]:
+        return None
+    return lines
+
+
+class GameArchive:
+    """
+    The archive file; add games to it, query it, and stream games out of it.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The archive file (created if missing)
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def add(self, record: dict, source: str = None, analysis: list = None) -> int:
+        """
+        Adds a game, or the analysis of a game added before without one.
+
+        :param record: A game record (see search_stats.GameRecord.to_dict)
+        :param source: Names where the record came from (e.g. its file name), so it is only added once
+        :param analysis: The per-move analysis from game_analysis.py, or None
+
+        :returns: The game's ID, or None if it was already in the archive
+        """
+        if source is not None:
+            row = self.db.execute("SELECT id, analysed FROM games WHERE source = ?", (source,)).fetchone()
+            if row is not None:
+                if analysis is not None and not row[1]:
+                    stored = self.record(row[0])
+                    stored["analysis"] = analysis
+                    with self.db:
+                        self.db.execute("UPDATE games SET analysed = 1, record = ? WHERE id = ?",
+                                        (zlib.compress(json.dumps(stored, separators=(",", ":")).encode()), row[0]))
+                return None
+        if analysis is not None:
+            record = dict(record, analysis=analysis)
+
+        board = chess.Board(record["fen"])
+        positions = []
+        opening = None
+        for ply, move in enumerate(record["moves"]):
+            positions.append((position_key(board), ply, move["uci"]))
+            if ply == OPENING_PLY:
+                opening = positions[-1][0]
+            board.push_uci(move["uci"])
+        positions.append((position_key(board), len(record["moves"]), None))
+        if len(record["moves"]) == OPENING_PLY:
+            opening = positions[-1][0]
+
+        started = record["started"]
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO games (source, started, date, result, player_color, elo, plies, opening, analysed, record) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source, started, started[:10], record["result"], record.get("player_color"), record.get("elo"),
+                 len(record["moves"]), opening, analysis is not None,
+                 zlib.compress(json.dumps(record, separators=(",", ":")).encode())))
+            game = cursor.lastrowid
+            self.db.executemany("INSERT OR IGNORE INTO positions (key, game, ply, move) VALUES (?, ?, ?, ?)",
+                                [(key, game, ply, move) for key, ply, move in positions])
+        return game
+
+    def import_records(self, paths: list) -> int:
+        """
+        Adds record files (and their finished analyses) that are not in the archive yet.
+
+        :param paths: Game record files
+
+        :returns: The number of games added
+        """
+        added = 0
+        for path in paths:
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping {path}: {e}", flush=True)
+                continue
+            if record.get("result") is None or not record.get("moves"):
+                continue
+            if self.add(record, os.path.basename(path), read_analysis(path)) is not None:
+                added += 1
+        return added
+
+    def record(self, game: int) -> dict:
+        """
+        :param game: A game's ID
+
+        :returns: The game's record (with an "analysis" entry if it was analysed)
+        """
+        row = self.db.execute("SELECT record FROM games WHERE id = ?", (game,)).fetchone()
+        return json.loads(zlib.decompress(row[0]))
+
+    def games(self, since: str = None, until: str = None, result: str = None, opening: chess.Board = None):
+        """
+        Yields the IDs and records of the matching games, oldest first, one at a time.
+
+        :param since: The earliest date (YYYY-MM-DD), or None
+        :param until: The latest date (YYYY-MM-DD), or None
+        :param result: "1-0", "0-1", "1/2-1/2" or "*", or None
+        :param opening: The position after OPENING_PLY plies, or None
+        """
+        conditions, values = [], []
+        if since is not None:
+            conditions.append("date >= ?")
+            values.append(since)
+        if until is not None:
+            conditions.append("date <= ?")
+            values.append(until)
+        if result is not None:
+            conditions.append("result = ?")
+            values.append(result)
+        if opening is not None:
+            conditions.append("opening = ?")
+            values.append(position_key(opening))
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        for game, blob in self.db.execute(f"SELECT id, record FROM games{where} ORDER BY started, id", values):
+            yield game, json.loads(zlib.decompress(blob))
+
+    def reaching(self, board: chess.Board) -> list:
+        """
+        :param board: A position
+
+        :returns: Tuples of the game ID, the ply the game reached the position at, the move played
+                  from it in UCI (None if the game ended there) and the game's result, for every
+                  game that reached it
+        """
+        return self.db.execute(
+            "SELECT positions.game, positions.ply, positions.move, games.result FROM positions "
+            "JOIN games ON games.id = positions.game WHERE positions.key = ? ORDER BY positions.game",
+            (position_key(board),)).fetchall()
+
+    def export_pgn(self, out, **filters) -> int:
+        """
+        Writes the matching games to out as PGN, one at a time.
+
+        :param out: A text file
+        :param filters: Passed to games()
+
+        :returns: The number of games written
+        """
+        count = 0
+        for game, record in self.games(**filters):
+            print(to_pgn(game, record), file=out, end="\n\n")
+            count += 1
+        return count
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def analysis_archiver(path: str):
+    """
+    :param path: The archive file
+
+    :returns: A function for game_analysis.AnalysisPipeline's on_analysed that adds each finished
+              analysis to the archive, on a connection of its own (SQLite connections belong to
+              the thread that opened them, and the analysis runs on its own thread)
+    """
+    archive = None
+
+    def add(record_path: str, record: dict, analysis: list) -> None:
+        nonlocal archive
+        if archive is None:
+            archive = GameArchive(path)
+        archive.add(record, os.path.basename(record_path), analysis)
+
+    return add
+
+
+def to_pgn(game_id: int, record: dict) -> chess.pgn.Game:
+    """
+    :param game_id: The game's ID in the archive
+    :param record: The game's record
+
+    :returns: The game as PGN, with the engine's evaluation on every robot move
+    """
+    game = chess.pgn.Game()
+    started = datetime.datetime.fromisoformat(record["started"])
+    game.headers["Event"] = "The Great Gambit"
+    game.headers["Site"] = "Raspberry Pi"
+    game.headers["Date"] = started.strftime("%Y.%m.%d")
+    game.headers["Round"] = str(game_id)
+    robot_name = "Stockfish" if not record.get("elo") else f"Stockfish ({record['elo']} Elo)"
+    game.headers["White"] = "Human" if record.get("player_color") == "W" else robot_name
+    game.headers["Black"] = robot_name if record.get("player_color") == "W" else "Human"
+    game.headers["Result"] = record["result"]
+    game.headers["Time"] = started.strftime("%H:%M:%S")
+    if record["fen"] != chess.STARTING_FEN:
+        game.setup(chess.Board(record["fen"]))
+    node = game
+    for move in record["moves"]:
+        node = node.add_variation(chess.Move.from_uci(move["uci"]))
+        stats = move.get("stats") or {}
+        if move["by"] == search_stats.ROBOT and ("cp" in stats or "mate" in stats):
+            # Search statistics are from the robot's point of view; PGN evaluations from white's
+            sign = 1 if node.parent.board().turn == chess.WHITE else -1
+            evaluation = f"#{sign * stats['mate']}" if "mate" in stats else f"{sign * stats['cp'] / 100:.2f}"
+            node.comment = f"[%eval {evaluation}]"
+    return game
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import, query and export the robot's game archive")
+    parser.add_argument("archive", help="The archive file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Add game record files (incremental)")
+    import_parser.add_argument("records", nargs="+", help="Game record files (see search_stats.py)")
+    export_parser = commands.add_parser("export", help="Stream games out as PGN")
+    export_parser.add_argument("--since", default=None, help="Earliest date (YYYY-MM-DD)")
+    export_parser.add_argument("--until", default=None, help="Latest date (YYYY-MM-DD)")
+    export_parser.add_argument("--result", default=None, help="1-0, 0-1, 1/2-1/2 or *")
+    export_parser.add_argument("--opening", metavar="FEN", default=None, help=f"The position after {OPENING_PLY} plies")
+    export_parser.add_argument("-o", "--output", default=None, help="The PGN file (default stdout)")
+    query_parser = commands.add_parser("query", help="List the games reaching a position")
+    query_parser.add_argument("fen", help="The position")
+    args = parser.parse_args()
+
+    archive = GameArchive(args.archive)
+    try:
+        if args.command == "import":
+            added = archive.import_records(args.records)
+            print(f"Added {added} games to {args.archive}", flush=True)
+        elif args.command == "export":
+            opening = chess.Board(args.opening) if args.opening is not None else None
+            out = open(args.output, "w") if args.output is not None else sys.stdout
+            try:
+                count = archive.export_pgn(out, since=args.since, until=args.until, result=args.result, opening=opening)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            print(f"Exported {count} games", file=sys.stderr, flush=True)
+        elif args.command == "query":
+            rows = archive.reaching(chess.Board(args.fen))
+            for game, ply, move, result in rows:
+                print(f"game {game} | ply {ply} | played {move or '-'} | {result}", flush=True)
+            print(f"{len(rows)} games reached the position", flush=True)
+    finally:
+        archive.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
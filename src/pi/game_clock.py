@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+A model of the physical game clock, so the robot searches with the real remaining time (UCI
+wtime/btime/winc/binc) and Stockfish's own time management decides how long each move gets:
+more in critical positions, very little when the robot's time is short.
+
+The clock is fed in two ways:
+- the MSP sends CLOCK instructions with both sides' remaining time and increments, which are
+  authoritative whenever they arrive; one sent between games (before START) sets the next
+  game's clock
+- between CLOCK instructions (or without them, given a time control) the clock is tracked locally
+  from frame timestamps: a side's time runs from the frame that gives it the move until the frame
+  that ends its turn
+"""
+
+import dataclasses
+
+import chess
+import chess.engine
+
+# Remaining times are never reported to the engine as less than this (seconds)
+MIN_CLOCK = 0.05
+
+
+def parse_time_control(text: str) -> tuple:
+    """
+    :param text: A time control as "MINUTES+INCREMENT" (e.g. "15+10") or "MINUTES"
+
+    :returns: A tuple of the initial time and the increment, in seconds
+
+    :raises ValueError: If the text is not a time control
+    """
+    minutes, _, increment = text.partition("+")
+    initial, increment = float(minutes) * 60, float(increment or 0)
+    if initial <= 0 or increment < 0:
+        raise ValueError(f"invalid time control: {text}")
+    return initial, increment
+
+
+class GameClock:
+    """
+    Both sides' remaining time and increment, and which side's time is running.
+    """
+
+    def __init__(self, initial: float = None, increment: float = 0.0):
+        """
+        :param initial: The time each side starts a game with in seconds, or None if the clock is
+                        only known from CLOCK instructions
+        :param increment: The increment per move in seconds
+        """
+        self.initial = initial
+        self.increment = increment
+        # True while the times come from a CLOCK reported between games, for the next game
+        self._reported_for_next_game = False
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Starts a new game; the clock is unknown until a CLOCK instruction unless a time control
+        was given, or a CLOCK instruction was received since the last game's last turn.
+        """
+        if not self._reported_for_next_game:
+            start = self.initial
+            self.remaining = {chess.WHITE: start, chess.BLACK: start}
+            self.increments = {chess.WHITE: self.increment, chess.BLACK: self.increment}
+        self.running = None
+        self._turn_start = None
+
+    def known(self) -> bool:
+        return self.remaining[chess.WHITE] is not None and self.remaining[chess.BLACK] is not None
+
+    def set(self, white: float, black: float, white_inc: float, black_inc: float, at: float) -> None:
+        """
+        Overrides the clock with the times reported by the MSP. The running side's time counts
+        from the moment the report was received.
+
+        :param white: White's remaining time in seconds
+        :param black: Black's remaining time in seconds
+        :param white_inc: White's increment in seconds
+        :param black_inc: Black's increment in seconds
+        :param at: When the report was received (time.perf_counter())
+        """
+        self.remaining = {chess.WHITE: white, chess.BLACK: black}
+        self.increments = {chess.WHITE: white_inc, chess.BLACK: black_inc}
+        if self.running is not None:
+            self._turn_start = at
+        else:
+            # No turn is running, so no game is in progress; keep these times for the next one
+            self._reported_for_next_game = True
+
+    def start_turn(self, color: chess.Color, at: float) -> None:
+        """
+        Starts a side's time, stopping the other side's first.
+
+        :param color: The side to move
+        :param at: When its turn started (time.perf_counter())
+        """
+        if self.running is not None and self.running != color:
+            self.end_turn(at)
+        self._reported_for_next_game = False
+        self.running = color
+        self._turn_start = at
+
+    def end_turn(self, at: float) -> None:
+        """
+        Stops the running side's time and adds its increment.
+
+        :param at: When its turn ended (time.perf_counter())
+        """
+        if self.running is None:
+            return
+        if self.remaining[self.running] is not None:
+            self.remaining[self.running] += self.increments[self.running] - (at - self._turn_start)
+        self.running = None
+        self._turn_start = None
+
+    def time_left(self, color: chess.Color, now: float) -> float:
+        """
+        :param color: The side
+        :param now: The current time (time.perf_counter())
+
+        :returns: The side's remaining time in seconds, including its running turn
+        """
+        remaining = self.remaining[color]
+        if color == self.running:
+            remaining -= now - self._turn_start
+        return max(MIN_CLOCK, remaining)
+
+    def limit(self, base: chess.engine.Limit, now: float) -> chess.engine.Limit:
+        """
+        :param base: The limit without a clock; only its depth and node caps are kept
+        :param now: The current time (time.perf_counter())
+
+        :returns: A limit with both sides' clocks and increments
+        """
+        return dataclasses.replace(base, time=None,
+                                   white_clock=self.time_left(chess.WHITE, now), black_clock=self.time_left(chess.BLACK, now),
+                                   white_inc=self.increments[chess.WHITE], black_inc=self.increments[chess.BLACK])
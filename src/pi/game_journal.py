@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Crash-safe journal of the game in progress, so a game survives a controller crash or a power
+glitch without anyone typing in a FEN.
+
+The journal is an append-only file of JSON lines, one per event: the start of a game (with the
+human's color, the starting FEN and the difficulty), every pushed move, the MSP's ACK of every
+ROBOT_MOVE, every difficulty change and the end of the game. The controller only queues events;
+a writer thread appends them and makes them durable with fsync. Events queued while an fsync is
+in progress are written and synced together by the next one (group commit), so the main loop
+never waits on the SD card and a burst of events costs one fsync. The one exception is the
+robot's move, which the controller waits to be durable before sending it (sync()): once the
+gantry has played it, a resumed game must not search the position again and play another.
+
+Starting a game rewrites the journal with just that game's first event (written to a temporary
+file and renamed over the journal), so it stays a few hundred bytes and is replayed in well under
+a millisecond. A torn last line, from power failing in the middle of a write, is dropped.
+"""
+
+import json
+import os
+import threading
+import time
+
+# EVENT TYPES
+EVENT_START      = "start"       # A game started (or a RESET, with no human color)
+EVENT_MOVE       = "move"        # A move was pushed
+EVENT_ACK        = "ack"         # The MSP ACKed the last ROBOT_MOVE
+EVENT_DIFFICULTY = "difficulty"  # The difficulty changed
+EVENT_END        = "end"         # The game ended; there is nothing to resume
+
+
+class ResumeState:
+    """
+    The game in progress when the journal was last written.
+    """
+
+    def __init__(self, fen: str, player_color: str, elo: int):
+        """
+        :param fen: The FEN the game started from
+        :param player_color: "W" or "B" for the human's color
+        :param elo: The difficulty (see difficulty.py)
+        """
+        self.fen = fen
+        self.player_color = player_color
+        self.elo = elo
+        # Tuples of the side (search_stats.HUMAN or search_stats.ROBOT) and the move in UCI
+        self.moves = []
+        # False if the last move is the robot's and the MSP never ACKed its ROBOT_MOVE
+        self.acked = True
+
+
+def replay(lines: list) -> ResumeState:
+    """
+    :param lines: The journal's events, oldest first
+
+    :returns: The state of the last game, or None if no game was in progress
+    """
+    state = None
+    for event in lines:
+        kind = event["e"]
+        if kind == EVENT_START:
+            state = ResumeState(event["fen"], event["color"], event["elo"]) if event["color"] else None
+        elif state is None:
+            continue
+        elif kind == EVENT_MOVE:
+            state.moves.append((event["by"], event["uci"]))
+            # search_stats.ROBOT
+            state.acked = event["by"] != "R"
+        elif kind == EVENT_ACK:
+            state.acked = True
+        elif kind == EVENT_DIFFICULTY:
+            state.elo = event["elo"]
+        elif kind == EVENT_END:
+            state = None
+    return state
+
+
+def read_journal(path: str) -> tuple:
+    """
+    Reads a journal up to its last complete event.
+
+    :param path: The journal file
+
+    :returns: A tuple of the events and the length in bytes of the complete events
+    """
+    events = []
+    length = 0
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return events, length
+    for line in data.splitlines(keepends=True):
+        # Power failed while this line was written
+        if not line.endswith(b"\n"):
+            break
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            break
+        length += len(line)
+    return events, length
+
+
+class NullJournal:
+    """
+    Journal used when journaling is disabled. Every method is a no-op so the controller can
+    call into the journal unconditionally.
+    """
+    enabled = False
+    resumable = None
+
+    def start_game(self, player_color: str, fen: str, elo: int) -> None:
+        pass
+
+    def move(self, side: str, move_uci: str) -> None:
+        pass
+
+    def acked(self) -> None:
+        pass
+
+    def difficulty(self, elo: int) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class GameJournal(NullJournal):
+    """
+    Appends events to a journal file with group-commit fsync on a writer thread.
+    """
+    enabled = True
+
+    def __init__(self, path: str):
+        """
+        :param path: The journal file; the game in it (if any) becomes resumable
+        """
+        self.path = path
+        start = time.perf_counter()
+        events, length = read_journal(path)
+        # The game to resume, if one was in progress
+        self.resumable = replay(events)
+        self.replay_ms = (time.perf_counter() - start) * 1000
+        self._file = open(path, "ab")
+        # Cut off a torn last event, so the next one starts on a fresh line
+        self._file.truncate(length)
+        self._condition = threading.Condition()
+        # Tuples of the encoded event and whether it starts a new journal
+        self._pending = []
+        self._queued = 0
+        self._durable = 0
+        self._closed = False
+        # Events written and fsyncs done, for the group commit's batching
+        self.events = 0
+        self.commits = 0
+        self._writer = threading.Thread(target=self._run, name="game-journal", daemon=True)
+        self._writer.start()
+
+    def start_game(self, player_color: str, fen: str, elo: int) -> None:
+        """
+        Starts a new journal for a game (or a RESET, when player_color is None).
+        """
+        self._append({"e": EVENT_START, "color": player_color, "fen": fen, "elo": elo}, True)
+
+    def move(self, side: str, move_uci: str) -> None:
+        self._append({"e": EVENT_MOVE, "by": side, "uci": move_uci})
+
+    def acked(self) -> None:
+        self._append({"e": EVENT_ACK})
+
+    def difficulty(self, elo: int) -> None:
+        self._append({"e": EVENT_DIFFICULTY, "elo": elo})
+
+    def end(self) -> None:
+        self._append({"e": EVENT_END})
+
+    def _append(self, event: dict, rotate: bool = False) -> None:
+        line = (json.dumps(event, separators=(",", ":")) + "\n").encode()
+        with self._condition:
+            self._pending.append((line, rotate))
+            self._queued += 1
+            self._condition.notify_all()
+
+    def sync(self) -> None:
+        """
+        Blocks until every event queued so far is durable.
+        """
+        with self._condition:
+            target = self._queued
+            while self._durable < target and self._writer.is_alive():
+                self._condition.wait()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, []
+            starts = [index for index, (_, rotate) in enumerate(batch) if rotate]
+            if starts:
+                # Events before the last game's start are obsolete
+                self._rotate(b"".join(line for line, _ in batch[starts[-1]:]))
+            else:
+                self._file.write(b"".join(line for line, _ in batch))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            with self._condition:
+                self.events += len(batch)
+                self.commits += 1
+                self._durable += len(batch)
+                self._condition.notify_all()
+
+    def _rotate(self, data: bytes) -> None:
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        # Make the rename itself durable
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self._file.close()
+        self._file = open(self.path, "ab")
+
+    def close(self) -> None:
+        """
+        Writes the remaining events and closes the journal.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+        self._file.close()
+
+
+def open_journal(path: str = None) -> NullJournal:
+    """
+    :param path: The journal file, or None to disable journaling
+
+    :returns: A GameJournal writing to path, or a NullJournal if path is None
+    """
+    if path is None:
+        return NullJournal()
+    return GameJournal(path)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Explicit game lifecycle management for the engine. Stockfish clears its hash and search history on
+"ucinewgame" (Search::clear(), which "may take some while"), and python-chess sends it before the
+first search of every new game, i.e. on the critical path of the robot's first move. Instead, the
+controller asks for a new game during the idle gap after a game ends (or while the human thinks
+about their first move), and the clear runs on a background thread. The idle gap is also when
+engine options (e.g. Threads and Hash from host_profile.py) are re-checked, since changing Hash
+clears the hash too.
+
+python-chess decides when to send "ucinewgame" by comparing the game object passed to each search
+with the previous one, so the lifecycle hands out one token per cleared game and every search
+passes it along.
+"""
+
+import threading
+import time
+
+import chess
+import chess.engine
+import host_profile
+
+
+class GameLifecycle:
+    """
+    Tracks which game the engine's state belongs to and clears it between games off the critical
+    path.
+    """
+
+    def __init__(self, engine: chess.engine.SimpleEngine, sync_newgame: bool = False, engine_options=None):
+        """
+        :param engine: The running engine (None disables clearing, e.g. for replays)
+        :param sync_newgame: If True, every new game gets a fresh token and python-chess sends
+                             "ucinewgame" right before its first search (the old behaviour, kept
+                             for comparison)
+        :param engine_options: A function taking the engine's current Hash (MB) that returns the
+                               UCI options the engine should have for the next game, or None to
+                               leave them alone (see host_profile.engine_options)
+        """
+        self.engine = engine
+        self.sync_newgame = sync_newgame
+        self.engine_options = engine_options
+        # If True, a game never starts on an engine which wasn't cleared, even if that means
+        # waiting for the clear (needed for reproducible searches)
+        self.always_clear = False
+        self.token = object()
+        # True while the engine holds state from searches since the last clear
+        self.dirty = True
+        self.clear_ms = None
+        self._thread = None
+
+    def prepare(self) -> None:
+        """
+        Starts clearing the engine for the next game on a background thread, unless it is already
+        clear or being cleared. Call this whenever the engine is about to be idle.
+        """
+        if self.engine is None or self.sync_newgame or not self.dirty or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._clear, name="ucinewgame", daemon=True)
+        self._thread.start()
+
+    def _clear(self) -> None:
+        token = object()
+        clear_start = time.perf_counter()
+        try:
+            # python-chess only sends the options which changed
+            if self.engine_options is not None:
+                self.engine.configure(self.engine_options(host_profile.configured_hash_mb(self.engine)))
+            # A new game token makes python-chess send "ucinewgame" and wait for "readyok", which
+            # Stockfish only sends once Search::clear() has finished; the depth 1 search is negligible
+            self.engine.analyse(chess.Board(), chess.engine.Limit(depth=1), game=token)
+        except Exception as e:
+            print(f"Clearing the engine for a new game failed: {e}", flush=True)
+            return
+        self.clear_ms = (time.perf_counter() - clear_start) * 1000
+        self.token = token
+        self.dirty = False
+        print(f"Engine cleared for the next game in {self.clear_ms:.0f} ms", flush=True)
+
+    def new_game(self) -> None:
+        """
+        Marks the start of a new game. With sync_newgame the engine is cleared before the next
+        search; with always_clear a clear is started now unless prepare() already did one;
+        otherwise whatever prepare() achieved is used as-is.
+        """
+        if self.sync_newgame:
+            self.token = object()
+        elif self.always_clear:
+            self.prepare()
+
+    def wait(self) -> None:
+        """
+        Blocks until an in-flight clear has finished.
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+            self._thread = None
+
+    def game_for_search(self) -> object:
+        """
+        Waits for an in-flight clear to finish (so it never races with a real search) and returns
+        the token to pass as the game of the next search.
+
+        :returns: The current game token
+        """
+        self.wait()
+        self.dirty = True
+        return self.token
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+"""
+Plans the gantry's pick-and-place sequence for each robot move on the Pi (--plan), so the MSP
+executes a ROBOT_PLAN instead of working out the physical steps from the ROBOT_MOVE fifth byte.
+
+A plan is a list of transfers, each picking a piece up at one location and placing it at another.
+Locations are the 64 squares, the graveyard slots beside the board the robot's captures go to,
+and the spare queens the robot promotes with. The time for every transfer is the gantry's travel
+to the pick location, the pick, the travel to the place location and the place. The travel time
+between every pair of locations is precomputed from the horizontal axes' speeds and
+accelerations; both axes move at once, so a travel takes as long as the slower axis. The
+vertical axis only lowers and raises the magnet, which takes the same time at every location.
+
+For every robot move, the planner tries each order of its transfers that never places a piece on
+a square before its occupant has been picked up, with each free graveyard slot and spare queen,
+starting from where the gantry stopped after the last move. It keeps the plan with the lowest
+time plus the expected travel from where the plan ends to the next move's first pick (taking
+every square as equally likely), so a plan is not made faster by leaving the gantry somewhere
+that slows down the next move.
+
+The naive ordering, which the benchmark compares against, is the one the fifth byte describes,
+with every captured piece and promoted pawn taken to the nearest free graveyard slot: the
+captured piece first, then the move itself, then the castling rook, or the promoted pawn to the
+graveyard and the first spare queen in its place.
+
+Usage:
+    python gantry_planner.py GAMES [--games N] [--robot white|black]
+"""
+
+import argparse
+import collections
+import itertools
+import math
+import sys
+
+import chess
+import chess.pgn
+
+# Board squares are SQUARE_MM apart; positions are in squares, with a1 at (0, 0)
+SQUARE_MM = 50.8
+
+# Horizontal axes: top speed (mm/s) and acceleration (mm/s^2) of the belt-driven steppers
+X_SPEED = 250.0
+X_ACCEL = 500.0
+Y_SPEED = 200.0
+Y_ACCEL = 400.0
+
+# Vertical axis: seconds to lower the magnet, grab or release the piece and raise it again
+PICK_TIME = 1.2
+PLACE_TIME = 1.0
+
+# Where the gantry waits at power-up
+HOME = (-1.0, -1.0)
+
+# Graveyard slots beside the h-file, filled column by column; enough for every piece the robot
+# can capture plus every pawn it can promote
+GRAVEYARD = [(x, float(y)) for x in (9.0, 10.0, 11.0) for y in range(8)]
+
+# Spare queens for promotions, beside the a-file, by color
+SPARE_QUEENS = {chess.WHITE: [(-2.0, 0.0), (-2.0, 1.0)], chess.BLACK: [(-2.0, 7.0), (-2.0, 6.0)]}
+
+# Location bytes in ROBOT_PLAN: squares are 0-63 (a1 is 0, h8 is 63), then the graveyard slots
+# and the spare queens (white first)
+GRAVEYARD_BASE = 64
+SPARE_QUEEN_BASE = 96
+HOME_LOCATION = 0xFF
+
+
+def location_position(location: int) -> tuple:
+    """
+    :param location: A location byte
+
+    :returns: The location's position in squares
+    """
+    if location == HOME_LOCATION:
+        return HOME
+    if location < GRAVEYARD_BASE:
+        return float(chess.square_file(location)), float(chess.square_rank(location))
+    if location < SPARE_QUEEN_BASE:
+        return GRAVEYARD[location - GRAVEYARD_BASE]
+    index = location - SPARE_QUEEN_BASE
+    white = SPARE_QUEENS[chess.WHITE]
+    return white[index] if index < len(white) else SPARE_QUEENS[chess.BLACK][index - len(white)]
+
+
+def spare_queen_locations(color: chess.Color) -> list:
+    """
+    :returns: The location bytes of color's spare queens
+    """
+    offset = 0 if color == chess.WHITE else len(SPARE_QUEENS[chess.WHITE])
+    return [SPARE_QUEEN_BASE + offset + i for i in range(len(SPARE_QUEENS[color]))]
+
+
+LOCATIONS = (list(range(64)) + [GRAVEYARD_BASE + i for i in range(len(GRAVEYARD))]
+             + spare_queen_locations(chess.WHITE) + spare_queen_locations(chess.BLACK) + [HOME_LOCATION])
+
+
+def axis_time(distance: float, speed: float, accel: float) -> float:
+    """
+    :param distance: The distance to travel (mm)
+    :param speed: The axis' top speed (mm/s)
+    :param accel: The axis' acceleration and deceleration (mm/s^2)
+
+    :returns: The seconds the axis takes with a trapezoidal speed profile (triangular for short moves)
+    """
+    if distance <= speed * speed / accel:
+        return 2 * math.sqrt(distance / accel)
+    return distance / speed + speed / accel
+
+
+def travel_table() -> dict:
+    """
+    :returns: The travel time in seconds between every pair of locations, by location byte pair
+    """
+    table = {}
+    for a in LOCATIONS:
+        ax, ay = location_position(a)
+        for b in LOCATIONS:
+            bx, by = location_position(b)
+            table[a, b] = max(axis_time(abs(ax - bx) * SQUARE_MM, X_SPEED, X_ACCEL),
+                              axis_time(abs(ay - by) * SQUARE_MM, Y_SPEED, Y_ACCEL))
+    return table
+
+
+TRAVEL = travel_table()
+
+# The expected travel from each location to the next move's first pick, taking every square as
+# equally likely
+NEXT_PICK = {location: sum(TRAVEL[location, square] for square in range(64)) / 64 for location in LOCATIONS}
+
+
+def plan_time(start: int, transfers: list) -> float:
+    """
+    :param start: The location the gantry starts at
+    :param transfers: Tuples of the pick and place locations, in order
+
+    :returns: The seconds the gantry takes to carry out the transfers
+    """
+    seconds = 0.0
+    position = start
+    for pick, place in transfers:
+        seconds += TRAVEL[position, pick] + PICK_TIME + TRAVEL[pick, place] + PLACE_TIME
+        position = place
+    return seconds
+
+
+def in_order(transfers: tuple) -> bool:
+    """
+    :returns: Whether no transfer places a piece on a location a later transfer picks up from
+    """
+    return not any(transfers[j][0] == transfers[i][1] for i in range(len(transfers)) for j in range(i + 1, len(transfers)))
+
+
+def rook_transfer(board: chess.Board, move: chess.Move) -> tuple:
+    """
+    :returns: The castling rook's pick and place squares for a castling move
+    """
+    rank = chess.square_rank(move.from_square)
+    kingside = chess.square_file(move.to_square) > chess.square_file(move.from_square)
+    return chess.square(7 if kingside else 0, rank), chess.square(5 if kingside else 3, rank)
+
+
+def captured_square(board: chess.Board, move: chess.Move) -> int:
+    """
+    :returns: The square of the piece a move captures, or None
+    """
+    if board.is_en_passant(move):
+        return chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square))
+    if board.is_capture(move):
+        return move.to_square
+    return None
+
+
+class Plan:
+    """
+    The transfers for one robot move, and the seconds they take.
+    """
+
+    def __init__(self, transfers: list, seconds: float):
+        """
+        :param transfers: Tuples of the pick and place location bytes, in order
+        :param seconds: The estimated time from the gantry's position before the move
+        """
+        self.transfers = transfers
+        self.seconds = seconds
+
+    def operand(self) -> list:
+        """
+        :returns: The ROBOT_PLAN operand: the pick and place location bytes of every transfer
+        """
+        return [location for transfer in self.transfers for location in transfer]
+
+    def describe(self) -> str:
+        return ", ".join(f"{location_name(pick)}-{location_name(place)}" for pick, place in self.transfers)
+
+
+def location_name(location: int) -> str:
+    """
+    :returns: A location byte as a square name, "gN" for graveyard slot N or "qN" for spare queen N
+    """
+    if location < GRAVEYARD_BASE:
+        return chess.square_name(location)
+    if location < SPARE_QUEEN_BASE:
+        return f"g{location - GRAVEYARD_BASE}"
+    return f"q{location - SPARE_QUEEN_BASE}"
+
+
+class GantryPlanner:
+    """
+    Plans robot moves, keeping track of where the gantry is and which graveyard slots and spare
+    queens are used up in the current game.
+    """
+
+    def __init__(self, optimise: bool = True):
+        """
+        :param optimise: Search for the fastest plan; otherwise plan the naive ordering
+        """
+        self.optimise = optimise
+        self.new_game()
+
+    def new_game(self) -> None:
+        """
+        Forgets the last game: the graveyard is cleared and the spare queens put back.
+        """
+        self.position = HOME_LOCATION
+        self.free_slots = [GRAVEYARD_BASE + i for i in range(len(GRAVEYARD))]
+        self.spare_queens = {color: spare_queen_locations(color) for color in chess.COLORS}
+
+    def replay(self, board: chess.Board, robot_color: chess.Color) -> None:
+        """
+        Starts a new game and plans every robot move in board's move stack, e.g. after resuming a
+        game, so the graveyard and the gantry's position match the physical board again.
+        """
+        self.new_game()
+        replayed = board.root()
+        for move in board.move_stack:
+            if replayed.turn == robot_color:
+                self.plan(replayed, move)
+            replayed.push(move)
+
+    def plan(self, board: chess.Board, move: chess.Move) -> Plan:
+        """
+        Plans a robot move and marks the graveyard slot and spare queen it uses as taken.
+
+        :param board: The position before the move
+        :param move: The robot's move (promotions are to a queen)
+
+        :returns: The plan, or None if the graveyard or the spare queens have run out, in which
+                  case the MSP works the move out itself
+        """
+        # Fixed transfers, and transfers to or from a location still to be chosen
+        fixed = []
+        to_graveyard = []
+        from_spare = []
+        captured = captured_square(board, move)
+        if captured is not None:
+            to_graveyard.append(captured)
+        if board.is_castling(move):
+            fixed += [(move.from_square, move.to_square), rook_transfer(board, move)]
+        elif move.promotion:
+            to_graveyard.append(move.from_square)
+            from_spare.append(move.to_square)
+        else:
+            fixed.append((move.from_square, move.to_square))
+
+        spares = self.spare_queens[board.turn]
+        if len(to_graveyard) > len(self.free_slots) or len(from_spare) > len(spares):
+            return None
+        if self.optimise:
+            plan = self._fastest(fixed, to_graveyard, from_spare, spares)
+        else:
+            plan = self._naive(move, fixed, to_graveyard, from_spare, spares)
+
+        for pick, place in plan.transfers:
+            if place in self.free_slots:
+                self.free_slots.remove(place)
+            if pick in spares:
+                spares.remove(pick)
+        self.position = plan.transfers[-1][1]
+        return plan
+
+    def _naive(self, move: chess.Move, fixed: list, to_graveyard: list, from_spare: list, spares: list) -> Plan:
+        free = list(self.free_slots)
+        transfers = []
+        for square in to_graveyard:
+            slot = min(free, key=lambda slot: TRAVEL[square, slot])
+            free.remove(slot)
+            transfers.append((square, slot))
+        transfers += fixed + list(zip(spares, from_spare))
+        return Plan(transfers, plan_time(self.position, transfers))
+
+    def _fastest(self, fixed: list, to_graveyard: list, from_spare: list, spares: list) -> Plan:
+        best, best_cost = None, None
+        for slots in itertools.permutations(self.free_slots, len(to_graveyard)):
+            for queens in itertools.permutations(spares, len(from_spare)):
+                transfers = fixed + list(zip(to_graveyard, slots)) + list(zip(queens, from_spare))
+                for order in itertools.permutations(transfers):
+                    if not in_order(order):
+                        continue
+                    seconds = plan_time(self.position, order)
+                    cost = seconds + NEXT_PICK[order[-1][1]]
+                    if best is None or cost < best_cost:
+                        best, best_cost = Plan(list(order), seconds), cost
+        return best
+
+
+def load_games(path: str, robot: chess.Color, count: int):
+    """
+    Yields the starting position, the moves and the robot's color of past games.
+
+    :param path: A game archive (see game_archive.py) or a PGN file
+    :param robot: The robot's color in PGN games
+    :param count: The most games to yield, or None for all
+    """
+    games = 0
+    if path.endswith(".pgn"):
+        with open(path) as f:
+            while count is None or games < count:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    return
+                games += 1
+                yield game.board(), list(game.mainline_moves()), robot
+        return
+
+    import game_archive
+    archive = game_archive.GameArchive(path)
+    try:
+        for _, record in archive.games():
+            if count is not None and games >= count:
+                return
+            games += 1
+            # The robot plays the color the human doesn't
+            color = chess.BLACK if record.get("player_color") == "W" else chess.WHITE
+            yield chess.Board(record["fen"]), [chess.Move.from_uci(move["uci"]) for move in record["moves"]], color
+    finally:
+        archive.close()
+
+
+def benchmark(games) -> dict:
+    """
+    Plans every robot move of games both ways.
+
+    :param games: Tuples of the starting position, the moves and the robot's color (see load_games)
+
+    :returns: The total seconds of each planner and the number of moves, overall and by fifth byte kind
+    """
+    totals = collections.defaultdict(lambda: [0.0, 0.0, 0])
+    for board, moves, robot in games:
+        naive, fastest = GantryPlanner(optimise=False), GantryPlanner()
+        for move in moves:
+            if board.turn == robot:
+                # Promotions are always to a queen on the board
+                move = chess.Move(move.from_square, move.to_square, chess.QUEEN if move.promotion else None)
+                naive_plan, fastest_plan = naive.plan(board, move), fastest.plan(board, move)
+                if naive_plan is not None and fastest_plan is not None:
+                    for kind in ("all", move_kind(board, move)):
+                        totals[kind][0] += naive_plan.seconds
+                        totals[kind][1] += fastest_plan.seconds
+                        totals[kind][2] += 1
+            board.push(move)
+    return totals
+
+
+def move_kind(board: chess.Board, move: chess.Move) -> str:
+    """
+    :returns: The kind of move, as described by the ROBOT_MOVE fifth byte
+    """
+    if board.is_castling(move):
+        return "castling"
+    if board.is_en_passant(move):
+        return "en passant"
+    if move.promotion:
+        return "promotion capture" if board.is_capture(move) else "promotion"
+    return "capture" if board.is_capture(move) else "quiet"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the gantry planner against the naive ordering")
+    parser.add_argument("games", help="A game archive (see game_archive.py) or a PGN file")
+    parser.add_argument("--games", type=int, default=None, dest="count", help="Only the first N games")
+    parser.add_argument("--robot", choices=("white", "black"), default="black", help="The robot's color in PGN games")
+    args = parser.parse_args()
+
+    totals = benchmark(load_games(args.games, args.robot == "white", args.count))
+    if not totals:
+        sys.exit("No robot moves to plan; exiting...")
+    print(f"{'moves':>20} {'count':>6} {'naive s':>8} {'planned s':>9} {'saved':>6}", flush=True)
+    for kind in ("all", "quiet", "capture", "castling", "en passant", "promotion", "promotion capture"):
+        if kind in totals:
+            naive, fastest, count = totals[kind]
+            print(f"{kind:>20} {count:>6} {naive / count:>8.2f} {fastest / count:>9.2f} {(1 - fastest / naive) * 100:>5.1f}%", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Sizes Stockfish's Threads and Hash options for the host the controller runs on. The CPU count,
+available memory and CPU temperature are read at start-up (and again between games), so the same
+controller uses a small hash and a single core on a Pi 3A+ and scales up on a Pi 4/5 or a desktop.
+
+- Threads: one per available CPU, halved above THERMAL_SOFT_LIMIT and cut to one above
+  THERMAL_HARD_LIMIT, where the Pi's firmware would throttle the clock anyway
+- Hash: the largest power of two (in MB) within HASH_MEMORY_FRACTION of the available memory,
+  between HASH_MIN_MB and HASH_MAX_MB. The available memory does not include the engine's current
+  Hash, so that is added back when re-checking a running engine; otherwise a host sitting just
+  above a power of two would halve (and clear) the hash at every check
+
+Usage:
+    python host_profile.py
+"""
+
+import os
+
+# HASH SIZING (MB)
+HASH_MEMORY_FRACTION = 0.25
+HASH_MIN_MB = 16
+HASH_MAX_MB = 1024
+# Used when the available memory cannot be read (non-Linux hosts)
+HASH_DEFAULT_MB = 64
+
+# THERMAL LIMITS (degrees Celsius)
+THERMAL_SOFT_LIMIT = 70.0
+THERMAL_HARD_LIMIT = 80.0
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+# Stockfish's upper bound for Threads (ucioption.cpp)
+MAX_THREADS = 512
+
+
+def cpu_count() -> int:
+    """
+    :returns: The number of CPUs this process may run on
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def available_memory_mb() -> int:
+    """
+    :returns: The memory available to new allocations in MB (MemAvailable in /proc/meminfo), or
+              None if it cannot be read
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def cpu_temperature() -> float:
+    """
+    :returns: The CPU temperature in degrees Celsius, or None if the host has no thermal zone
+    """
+    try:
+        with open(THERMAL_ZONE) as f:
+            return int(f.read().strip()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+def profile_host() -> dict:
+    """
+    :returns: A dictionary with the host's "cpus", "available_mb" and "temperature" (the latter
+              two may be None)
+    """
+    return {"cpus": cpu_count(), "available_mb": available_memory_mb(), "temperature": cpu_temperature()}
+
+
+def choose_options(profile: dict, current_hash_mb: int = 0) -> dict:
+    """
+    Picks Threads and Hash for a host profile.
+
+    :param profile: A profile returned by profile_host()
+    :param current_hash_mb: The Hash (MB) the engine has allocated now, which the profile's
+                            available memory excludes (0 for a new engine)
+
+    :returns: The UCI options, e.g. {"Threads": 4, "Hash": 256}
+    """
+    threads = min(profile["cpus"], MAX_THREADS)
+    temperature = profile["temperature"]
+    if temperature is not None and temperature >= THERMAL_HARD_LIMIT:
+        threads = 1
+    elif temperature is not None and temperature >= THERMAL_SOFT_LIMIT:
+        threads = max(1, threads // 2)
+
+    if profile["available_mb"] is None:
+        hash_mb = HASH_DEFAULT_MB
+    else:
+        available_mb = profile["available_mb"] + current_hash_mb
+        ceiling = max(HASH_MIN_MB, min(HASH_MAX_MB, int(available_mb * HASH_MEMORY_FRACTION)))
+        hash_mb = HASH_MIN_MB
+        while hash_mb * 2 <= ceiling:
+            hash_mb *= 2
+
+    return {"Threads": threads, "Hash": hash_mb}
+
+
+def configured_hash_mb(engine) -> int:
+    """
+    :param engine: A running chess.engine.SimpleEngine
+
+    :returns: The Hash (MB) last set on the engine, or 0 if it was never set
+    """
+    try:
+        return int(engine.protocol.config.get("Hash") or 0)
+    except (AttributeError, ValueError):
+        return 0
+
+
+def engine_options(current_hash_mb: int = 0) -> dict:
+    """
+    Profiles the host, picks Threads and Hash, and logs both.
+
+    :param current_hash_mb: The Hash (MB) the engine has allocated now (see choose_options)
+
+    :returns: The UCI options (see choose_options)
+    """
+    profile = profile_host()
+    options = choose_options(profile, current_hash_mb)
+    memory = f"{profile['available_mb']} MB available" if profile["available_mb"] is not None else "memory unknown"
+    temperature = f"{profile['temperature']:.1f} C" if profile["temperature"] is not None else "temperature unknown"
+    print(f"Host profile: {profile['cpus']} CPUs, {memory}, {temperature} -> "
+          f"Threads {options['Threads']}, Hash {options['Hash']} MB", flush=True)
+    return options
+
+
+if __name__ == "__main__":
+    engine_options()
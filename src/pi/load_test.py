@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Measures how many boards one host can serve. For each board count, a multi_board.py server with
+a fixed engine pool plays that many simulated MSPs (see msp_simulator.py) over ptys, and every
+HUMAN_MOVE -> ROBOT_MOVE round trip is timed end to end on the MSP's side. Reports the p50 and
+p99 move latency, the time spent searching and waiting for an engine per board count, and the
+most boards that kept the p99 latency within the limit.
+
+Under load the pool shortens searches to keep each board within its latency target, so the
+search time column shows what the extra boards cost in playing strength.
+
+Usage:
+    python load_test.py [--boards N [N ...]] [--engines N] [--engine PATH] [--moves N] [--think SECONDS]
+                        [--target MS] [--p99 MS]
+"""
+
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import threading
+import time
+
+import host_profile
+import msp_simulator
+import multi_board
+import chess_robot_v7 as robot
+
+# Default board counts to measure
+BOARD_COUNTS = [1, 2, 4, 8, 16]
+
+# Default human think time (seconds); real players take far longer, so this is a stress test
+THINK_TIME = 1.0
+
+
+def run_round(pool: multi_board.EnginePool, boards: int, moves: int, think: float, target: float) -> dict:
+    """
+    Serves simulated boards until each has played its moves.
+
+    :param pool: The engine pool to search on
+    :param boards: The number of boards
+    :param moves: The number of human moves per board
+    :param think: The human think time in seconds
+    :param target: Each board's latency target in seconds
+
+    :returns: A dictionary of the round's results in milliseconds
+    """
+    simulators = [msp_simulator.MspSimulator(seed, think) for seed in range(boards)]
+    server = multi_board.BoardServer(pool)
+    errors = []
+
+    def play(simulator):
+        try:
+            simulator.play(moves)
+        except Exception as e:
+            errors.append(f"{simulator.port}: {type(e).__name__}: {e}")
+
+    # The controllers' logs would drown the results
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for simulator in simulators:
+            server.add_board(robot.open_serial(port=simulator.port), target)
+        start = time.perf_counter()
+        players = [threading.Thread(target=play, args=(simulator,)) for simulator in simulators]
+        for player in players:
+            player.start()
+        for player in players:
+            player.join()
+        elapsed = time.perf_counter() - start
+        server.stop()
+    for board, _ in server.boards:
+        board.ser.close()
+    for simulator in simulators:
+        simulator.close()
+    for error in errors:
+        print(f"  {error}", flush=True)
+
+    latencies = [latency * 1000 for simulator in simulators for latency in simulator.latencies]
+    searched = [(latency - queued) * 1000 for board, _ in server.boards
+                for latency, queued in zip(board.watchdog.latencies, board.watchdog.queued)]
+    queued = [queued * 1000 for board, _ in server.boards for queued in board.watchdog.queued]
+    return {
+        "boards": boards,
+        "moves": len(latencies),
+        "p50": multi_board.percentile(latencies, 0.5) if latencies else None,
+        "p99": multi_board.percentile(latencies, 0.99) if latencies else None,
+        "search": statistics.mean(searched) if searched else None,
+        "queue": statistics.mean(queued) if queued else None,
+        "moves_per_minute": len(latencies) / elapsed * 60,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how many boards one host serves within a p99 move latency")
+    parser.add_argument("--boards", type=int, nargs="+", default=BOARD_COUNTS, help="Board counts to measure")
+    parser.add_argument("--engines", type=int, default=None, help="Engines in the pool (default: one per CPU)")
+    parser.add_argument("--engine", default=None, help="The Stockfish binary")
+    parser.add_argument("--moves", type=int, default=20, help="Human moves per board and round")
+    parser.add_argument("--think", type=float, default=THINK_TIME, help="Seconds each human thinks before moving")
+    parser.add_argument("--target", type=float, default=multi_board.LATENCY_TARGET_MS, help="Latency target per board in ms")
+    parser.add_argument("--p99", type=float, default=None, help="The p99 move latency to meet in ms (default: the target)")
+    args = parser.parse_args()
+
+    engines = args.engines if args.engines is not None else host_profile.cpu_count()
+    limit = args.p99 if args.p99 is not None else args.target
+    pool = multi_board.open_pool(engines, args.engine)
+    print(f"{args.moves} moves per board, {args.think:g} s think time, {args.target:g} ms target", flush=True)
+    print("boards | moves | p50 ms | p99 ms | search ms | queue ms | moves/min", flush=True)
+    best = 0
+    try:
+        for boards in args.boards:
+            result = run_round(pool, boards, args.moves, args.think, args.target / 1000)
+            if result["p99"] is None:
+                print(f"{boards:6} | no moves", flush=True)
+                continue
+            print(f"{boards:6} | {result['moves']:5} | {result['p50']:6.0f} | {result['p99']:6.0f} | "
+                  f"{result['search']:9.0f} | {result['queue']:8.0f} | {result['moves_per_minute']:9.1f}", flush=True)
+            if result["p99"] <= limit and not result["errors"]:
+                best = max(best, boards)
+    finally:
+        pool.close()
+    print(f"{best} boards served with a p99 move latency within {limit:g} ms on {engines} engines", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""
+A persistent cache of the robot's searched moves, and a warm-up job that fills it after boot.
+
+The cache maps a position (its Polyglot Zobrist key) and the search limit to the move the engine
+chose and its search statistics. A robot move in a cached position is answered at once instead
+of searched. Entries are appended to a JSON lines file as they are made and loaded at start-up,
+so the cache survives restarts and deploys; when the file has grown well past the number of
+distinct entries it is rewritten.
+
+The first games after a deploy would still miss the cache, so while the robot waits for the
+first START after boot, the warm-up job replays the most frequent positions of past games (from
+the game archive or a PGN collection) through the engine. Its searches run at the scheduler's
+SPECULATIVE priority (see engine_scheduler.py) with the same limit as the robot's own, and on
+the engine's current game, so they fill both this cache and the engine's hash. The job stops as
+soon as a game starts. Every hit is counted by where its entry came from, so the share of hits
+due to the warm-up can be reported.
+"""
+
+import collections
+import json
+import os
+import threading
+
+import chess
+import chess.engine
+import chess.pgn
+import chess.polyglot
+import engine_scheduler
+import game_archive
+import game_lifecycle
+
+# Entries kept in the cache file; the oldest are dropped when it is rewritten
+MAX_ENTRIES = 20000
+
+# Positions searched by the warm-up, most frequent first
+WARMUP_POSITIONS = 100
+
+# Only positions from the first this many plies of past games are warmed up
+WARMUP_MAX_PLY = 20
+
+# Where cache entries come from
+SOURCE_LIVE = "live"
+SOURCE_WARMUP = "warmup"
+
+
+def limit_signature(limit: chess.engine.Limit) -> str:
+    """
+    :param limit: A search limit
+
+    :returns: A string identifying the limit's time, depth and node budgets
+    """
+    return f"time={limit.time},depth={limit.depth},nodes={limit.nodes}"
+
+
+class MoveCache:
+    """
+    Searched moves by position and search limit, persisted to a JSON lines file.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The cache file (created if missing)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        lines = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._entries[(entry["key"], entry["limit"])] = entry
+        while len(self._entries) > MAX_ENTRIES:
+            self._entries.popitem(last=False)
+        if lines > 2 * len(self._entries):
+            self._rewrite()
+        self._file = open(path, "a")
+        # Hits by the source of their entry, and misses
+        self.hits = collections.Counter()
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _rewrite(self) -> None:
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        os.replace(temporary, self.path)
+
+    def get(self, board: chess.Board, limit: chess.engine.Limit) -> dict:
+        """
+        :param board: The position
+        :param limit: The search limit
+
+        :returns: The cached entry ("move" in UCI, "stats" and "source"), or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get((f"{chess.polyglot.zobrist_hash(board):016x}", limit_signature(limit)))
+            if entry is None or chess.Move.from_uci(entry["move"]) not in board.legal_moves:
+                self.misses += 1
+                return None
+            self.hits[entry["source"]] += 1
+            return entry
+
+    def contains(self, board: chess.Board, limit: chess.engine.Limit) -> bool:
+        return (f"{chess.polyglot.zobrist_hash(board):016x}", limit_signature(limit)) in self._entries
+
+    def put(self, board: chess.Board, limit: chess.engine.Limit, move: chess.Move, stats: dict, source: str) -> None:
+        """
+        Caches a searched move.
+
+        :param source: SOURCE_LIVE or SOURCE_WARMUP
+        """
+        entry = {"key": f"{chess.polyglot.zobrist_hash(board):016x}", "limit": limit_signature(limit),
+                 "move": move.uci(), "stats": stats, "source": source}
+        with self._lock:
+            self._entries[(entry["key"], entry["limit"])] = entry
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def report(self) -> str:
+        """
+        :returns: A one-line summary of the hits, the share of them from the warm-up, and the misses
+        """
+        hits = sum(self.hits.values())
+        warm = self.hits[SOURCE_WARMUP] / hits * 100 if hits else 0
+        return f"{hits} hits ({warm:.0f}% from warm-up), {self.misses} misses, {len(self)} entries"
+
+
+def archive_positions(path: str, count: int = WARMUP_POSITIONS, max_ply: int = WARMUP_MAX_PLY) -> list:
+    """
+    :param path: The game archive (see game_archive.py)
+    :param count: The number of positions
+    :param max_ply: Only positions from the first this many plies of each game
+
+    :returns: The positions the robot was to move in most often in past games, most frequent first
+    """
+    archive = game_archive.GameArchive(path)
+    try:
+        # The robot is to move at odd plies when the human plays white, and even plies otherwise
+        rows = archive.db.execute(
+            "SELECT positions.key, COUNT(*) AS seen, positions.game, positions.ply FROM positions "
+            "JOIN games ON games.id = positions.game "
+            "WHERE positions.ply < ? AND positions.move IS NOT NULL "
+            "AND (games.player_color = 'W') = (positions.ply % 2 = 1) "
+            "GROUP BY positions.key ORDER BY seen DESC LIMIT ?", (max_ply, count)).fetchall()
+        boards = []
+        for _, _, game, ply in rows:
+            record = archive.record(game)
+            board = chess.Board(record["fen"])
+            for move in record["moves"][:ply]:
+                board.push_uci(move["uci"])
+            boards.append(board)
+        return boards
+    finally:
+        archive.close()
+
+
+def pgn_positions(path: str, count: int = WARMUP_POSITIONS, max_ply: int = WARMUP_MAX_PLY) -> list:
+    """
+    :param path: A PGN file
+    :param count: The number of positions
+    :param max_ply: Only positions from the first this many plies of each game
+
+    :returns: The most frequent positions in the file's games (with either side to move), most frequent first
+    """
+    seen = collections.Counter()
+    boards = {}
+    with open(path) as f:
+        while True:
+            game = chess.pgn.read_game(f)
+            if game is None:
+                break
+            board = game.board()
+            for move in list(game.mainline_moves())[:max_ply]:
+                key = chess.polyglot.zobrist_hash(board)
+                seen[key] += 1
+                boards.setdefault(key, board.copy(stack=False))
+                board.push(move)
+    return [boards[key] for key, _ in seen.most_common(count)]
+
+
+class Warmup:
+    """
+    Searches past games' positions at low priority on a background thread until stopped.
+    """
+
+    def __init__(self, cache: MoveCache, scheduler: engine_scheduler.EngineScheduler, limit: chess.engine.Limit,
+                 lifecycle: game_lifecycle.GameLifecycle, load_positions):
+        """
+        :param cache: The cache to fill
+        :param scheduler: The engine scheduler the searches run through
+        :param limit: The robot's search limit
+        :param lifecycle: The engine's game lifecycle; the searches run on its current game, so
+                          the next game starts with the hash they filled
+        :param load_positions: A function taking no arguments that returns the positions to search
+        """
+        self.cache = cache
+        self.scheduler = scheduler
+        self.limit = limit
+        self.lifecycle = lifecycle
+        self.load_positions = load_positions
+        self.searched = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            positions = self.load_positions()
+        except Exception as e:
+            print(f"Warm-up: could not load positions: {e}", flush=True)
+            return
+        # Search after the boot's clear, on the game it set up
+        self.lifecycle.wait()
+        game = self.lifecycle.token
+        print(f"Warm-up: searching {len(positions)} positions", flush=True)
+        dropped = False
+        for board in positions:
+            if self._stop.is_set():
+                break
+            if self.cache.contains(board, self.limit):
+                continue
+            result = self.scheduler.submit(engine_scheduler.EngineTask(engine_scheduler.SPECULATIVE, board, self.limit,
+                                                                       game)).wait()
+            # Dropped when a game started
+            if result is None or self._stop.is_set():
+                dropped = True
+                break
+            move, stats = result
+            self.cache.put(board, self.limit, move, stats, SOURCE_WARMUP)
+            self.searched += 1
+        print(f"Warm-up: {'stopped' if dropped or self._stop.is_set() else 'finished'} after {self.searched} positions", flush=True)
+
+    def stop(self) -> None:
+        """
+        Stops the warm-up, preempting its running search. Returns once the engine is free.
+        """
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self.scheduler.cancel(engine_scheduler.SPECULATIVE)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+A simulated MSP on a pseudo-terminal, for running the controller (chess_robot_v7.py or
+multi_board.py) without the robot. The simulator plays the human's side of the UART protocol:
+it starts games with START_W, sends random legal HUMAN_MOVEs (promoting to queens only, like the
+real board), ACKs and validates the controller's frames (including the ROBOT_PLAN sent before
+each ROBOT_MOVE with --plan), plays the robot's moves on its own board, and times every HUMAN_MOVE -> ROBOT_MOVE round trip from the first byte sent to the last
+byte received.
+
+Usage:
+    python msp_simulator.py [--moves N] [--think SECONDS] [--seed N]
+
+The pty's path is printed; pass it to the controller with --port.
+"""
+
+import argparse
+import os
+import pty
+import random
+import select
+import sys
+import time
+import tty
+
+import chess
+import chess_robot_v7 as robot
+import uart_capture
+
+# Seconds to wait for the controller's ACK or its reply before giving up
+REPLY_TIMEOUT = 30.0
+
+# A game is restarted after this many human moves
+MAX_GAME_MOVES = 60
+
+
+class SimulatorTimeout(Exception):
+    """
+    Raised when the controller does not answer within REPLY_TIMEOUT.
+    """
+
+
+class MspSimulator:
+    """
+    One simulated MSP, connected to the controller through a pty.
+    """
+
+    def __init__(self, seed: int = None, think: float = 0.0):
+        """
+        :param seed: Seeds the choice of human moves, so a run can be repeated
+        :param think: Seconds the human thinks before each move
+        """
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.random = random.Random(seed)
+        self.think = think
+        self.board = chess.Board()
+        self.games = 0
+        # Seconds from sending each HUMAN_MOVE to receiving the ROBOT_MOVE
+        self.latencies = []
+        # The operand of every ROBOT_PLAN received (see gantry_planner.py)
+        self.plans = []
+        self._buffer = bytearray()
+
+    def _read(self, size: int) -> bytes:
+        deadline = time.monotonic() + REPLY_TIMEOUT
+        while len(self._buffer) < size:
+            left = deadline - time.monotonic()
+            if left <= 0 or not select.select([self.master], [], [], left)[0]:
+                raise SimulatorTimeout(f"no reply from the controller on {self.port}")
+            self._buffer += os.read(self.master, 1024)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def send(self, instr: int, operand: list = []) -> None:
+        """
+        Sends an instruction and waits for its ACK.
+        """
+        os.write(self.master, bytes(robot.encode_frame(instr, operand)))
+        ack = self._read(1)[0]
+        if ack != robot.ACK_BYTE:
+            raise RuntimeError(f"expected an ACK, got {ack:#x}")
+
+    def receive(self) -> tuple:
+        """
+        Reads one instruction from the controller, validates it and ACKs it.
+
+        :returns: A tuple of the instruction ID and the operand bytes
+        """
+        while self._read(1)[0] != robot.START_BYTE:
+            pass
+        instr_and_op_len = self._read(1)[0]
+        header = [robot.START_BYTE, instr_and_op_len]
+        if instr_and_op_len & 0x0F == uart_capture.EXTENDED_OP_LEN:
+            header.append(self._read(1)[0])
+        operand = self._read(uart_capture.frame_length(header) - len(header) - 2)
+        message = header + list(operand) + list(self._read(2))
+        if not robot.validate_transmission(message):
+            raise RuntimeError(f"invalid frame from the controller: {message}")
+        os.write(self.master, bytes([robot.ACK_BYTE]))
+        return instr_and_op_len >> 4, operand
+
+    def start_game(self) -> None:
+        self.send(robot.START_W_INSTR)
+        self.board = chess.Board()
+        self.games += 1
+
+    def human_move(self) -> bool:
+        """
+        Plays a random legal move for the human and the robot's answer.
+
+        :returns: False if the game is over
+        """
+        moves = [move for move in self.board.legal_moves if move.promotion in (None, chess.QUEEN)]
+        move = self.random.choice(moves)
+        uci = move.uci()
+        start = time.perf_counter()
+        self.send(robot.HUMAN_MOVE_INSTR, [ord(c) for c in uci.ljust(5, "_")])
+        self.board.push(move)
+        instr, operand = self.receive()
+        # With --plan, the gantry's plan comes right before the move
+        if instr == robot.ROBOT_PLAN_INSTR:
+            self.plans.append(operand)
+            instr, operand = self.receive()
+        self.latencies.append(time.perf_counter() - start)
+        if instr != robot.ROBOT_MOVE_INSTR:
+            raise RuntimeError(f"expected ROBOT_MOVE after {uci}, got instruction {instr}")
+
+        status = operand[5]
+        if status >> 4 != robot.GAME_ONGOING:
+            return False
+        robot_uci = operand[0:4].decode("ascii") + ("q" if chr(operand[4]) in "qQ" else "")
+        self.board.push_uci(robot_uci)
+        return status & 0x0F == robot.GAME_ONGOING
+
+    def play(self, moves: int) -> None:
+        """
+        Plays human moves, starting new games as games end.
+
+        :param moves: The number of human moves to play
+        """
+        self.start_game()
+        for _ in range(moves):
+            time.sleep(self.think)
+            if not self.human_move() or len(self.board.move_stack) >= 2 * MAX_GAME_MOVES:
+                self.start_game()
+
+    def close(self) -> None:
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play the MSP's side of the UART protocol on a pty")
+    parser.add_argument("--moves", type=int, default=20, help="Human moves to play")
+    parser.add_argument("--think", type=float, default=0.0, help="Seconds the human thinks before each move")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the human's moves")
+    args = parser.parse_args()
+
+    simulator = MspSimulator(args.seed, args.think)
+    print(f"Simulated MSP on {simulator.port}; start the controller with --port {simulator.port} and press Enter", flush=True)
+    input()
+    try:
+        simulator.play(args.moves)
+    finally:
+        simulator.close()
+    latencies = sorted(latency * 1000 for latency in simulator.latencies)
+    print(f"{len(latencies)} moves in {simulator.games} games | median {latencies[len(latencies) // 2]:.0f} ms | "
+          f"max {latencies[-1]:.0f} ms", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""
+Drives several robots from one host. Every serial port gets its own ChessRobot (the same game
+state machine chess_robot_v7.py runs for a single board) on its own thread, and all of them
+search on a shared, bounded pool of Stockfish processes:
+- a board waiting for an engine is queued with a deadline, its move's arrival plus the board's
+  latency target, and a free engine always takes the earliest deadline. Each board has at most
+  one search outstanding, so no board can crowd out the others
+- a search that starts late is shortened to what is left of its board's latency target (but
+  never below MIN_SEARCH_TIME), so under load boards lose search time before they lose latency
+- engines are shared between games, so python-chess is never told about new games (which would
+  clear the hash between every two boards); each board's difficulty options are set on the
+  engine before each of its searches
+- each engine has its own watchdog, which restarts it if it hangs or crashes
+
+Usage:
+    python multi_board.py PORT[:TARGET_MS] [PORT[:TARGET_MS] ...] [--engines N] [--engine PATH] [--records DIR]
+"""
+
+import argparse
+import dataclasses
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+
+import build_matrix
+import chess
+import chess.engine
+import chess_robot_v7 as robot
+import engine_watchdog
+import host_profile
+
+# Default latency target per board: from the human's move arriving to the robot's move being sent (ms)
+LATENCY_TARGET_MS = robot.MOVE_TIME * 1000
+
+# Time kept back from each board's latency target for the UART and the controller (seconds)
+RESPONSE_MARGIN = 0.1
+
+# Searches are never shortened below this (seconds)
+MIN_SEARCH_TIME = 0.1
+
+
+def pool_options(engines: int, profile: dict = None) -> dict:
+    """
+    :param engines: The number of engines in the pool
+    :param profile: A profile returned by host_profile.profile_host() (measured if None)
+
+    :returns: The UCI options of each engine: the host's threads and hash (see host_profile.py)
+              split between the engines
+    """
+    options = host_profile.choose_options(profile if profile is not None else host_profile.profile_host())
+    hash_mb = options["Hash"] // engines
+    return {"Threads": max(1, options["Threads"] // engines), "Hash": max(host_profile.HASH_MIN_MB, hash_mb)}
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    :param values: The samples
+    :param fraction: The percentile as a fraction, e.g. 0.99
+
+    :returns: The nearest-rank percentile of the samples
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class EnginePool:
+    """
+    A fixed number of engines shared by all boards, handed out earliest deadline first.
+    """
+
+    def __init__(self, size: int, start_engine):
+        """
+        :param size: The number of engines
+        :param start_engine: A function taking no arguments that starts and configures one engine;
+                             also used to restart engines that hang or crash
+        """
+        self.watchdogs = [engine_watchdog.EngineWatchdog(start_engine(), start_engine) for _ in range(size)]
+        # One game for the lifetime of each engine; see the module docstring
+        self._games = [object() for _ in range(size)]
+        self._free = list(range(size))
+        # Heap of (deadline, sequence number) of the searches waiting for an engine
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def search(self, board: chess.Board, limit: chess.engine.Limit, deadline: float, options: dict = {},
+               early_stop=None, on_start=None, on_engine=None) -> tuple:
+        """
+        Waits for an engine and searches the position on it.
+
+        :param board: The position to search
+        :param limit: The board's search limit; a timed limit is shortened to fit the deadline
+        :param deadline: When the board's move is due (time.perf_counter())
+        :param options: UCI options to set before searching (e.g. the board's difficulty)
+        :param early_stop: Passed to the engine's watchdog
+        :param on_start: Passed to the engine's watchdog
+        :param on_engine: A function called with the engine's watchdog once the search has an
+                          engine, and with None once it is done
+
+        :returns: A tuple of the best move (chess.Move) and its statistics (see
+                  EngineWatchdog.search), with the time spent waiting for an engine ("queue_ms")
+                  and the engine's index ("engine")
+        """
+        queue_start = time.perf_counter()
+        with self._condition:
+            ticket = (deadline, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            while not self._free or self._waiting[0] != ticket:
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            index = self._free.pop()
+            # Another engine may be free for the next waiter
+            self._condition.notify_all()
+        queue_ms = (time.perf_counter() - queue_start) * 1000
+
+        try:
+            watchdog = self.watchdogs[index]
+            if on_engine is not None:
+                on_engine(watchdog)
+            try:
+                watchdog.engine.configure(options)
+            except engine_watchdog.ENGINE_ERRORS as e:
+                # The watchdog replaces a dead engine during the search
+                print(f"Engine {index}: could not set options ({e})", flush=True)
+            if limit.time is not None:
+                left = deadline - time.perf_counter() - RESPONSE_MARGIN
+                limit = dataclasses.replace(limit, time=max(MIN_SEARCH_TIME, min(limit.time, left)))
+            move, stats = watchdog.search(board, limit, self._games[index], early_stop, on_start)
+        finally:
+            if on_engine is not None:
+                on_engine(None)
+            with self._condition:
+                self._free.append(index)
+                self._condition.notify_all()
+        stats["queue_ms"] = int(queue_ms)
+        stats["engine"] = index
+        return move, stats
+
+    @property
+    def metrics(self) -> dict:
+        """
+        :returns: The watchdog counters summed over all engines
+        """
+        totals = {}
+        for watchdog in self.watchdogs:
+            for key, value in watchdog.metrics.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def close(self) -> None:
+        for watchdog in self.watchdogs:
+            try:
+                watchdog.engine.quit()
+            except Exception:
+                pass
+
+
+class PoolSearcher:
+    """
+    One board's view of the pool; stands in for the ChessRobot's engine watchdog.
+    """
+
+    def __init__(self, pool: EnginePool, latency_target: float, options=lambda: {}):
+        """
+        :param pool: The shared engine pool
+        :param latency_target: The board's latency target in seconds
+        :param options: A function taking no arguments that returns the board's UCI options
+                        (e.g. its difficulty's)
+        """
+        self.pool = pool
+        self.latency_target = latency_target
+        self.options = options
+        # Seconds from asking for a move to getting it, and of that waiting for an engine, one per search
+        self.latencies = []
+        self.queued = []
+        # The watchdog of the engine the board's search is running on, or None
+        self._watchdog = None
+
+    @property
+    def metrics(self) -> dict:
+        return self.pool.metrics
+
+    def search(self, board: chess.Board, limit: chess.engine.Limit, game: object = None, early_stop=None,
+               on_start=None) -> tuple:
+        """
+        Same interface as EngineWatchdog.search(); game is ignored, since the engines are shared.
+        """
+        start = time.perf_counter()
+        move, stats = self.pool.search(board, limit, start + self.latency_target, self.options(), early_stop, on_start,
+                                       on_engine=self._set_watchdog)
+        self.latencies.append(time.perf_counter() - start)
+        self.queued.append(stats["queue_ms"] / 1000)
+        return move, stats
+
+    def _set_watchdog(self, watchdog) -> None:
+        self._watchdog = watchdog
+
+    def cut_deadline(self, seconds: float) -> None:
+        """
+        Same as EngineWatchdog.cut_deadline(), for the engine the board's search is running on (if any).
+        """
+        watchdog = self._watchdog
+        if watchdog is not None:
+            watchdog.cut_deadline(seconds)
+
+    def format_latency(self) -> str:
+        """
+        :returns: A one-line summary of the board's search latencies
+        """
+        if not self.latencies:
+            return "no moves"
+        ms = [latency * 1000 for latency in self.latencies]
+        return (f"{len(ms)} moves | p50 {percentile(ms, 0.5):.0f} ms | p99 {percentile(ms, 0.99):.0f} ms | "
+                f"target {self.latency_target * 1000:.0f} ms")
+
+
+class BoardServer:
+    """
+    The boards, each a ChessRobot on its own thread, searching on one engine pool.
+    """
+
+    def __init__(self, pool: EnginePool):
+        """
+        :param pool: The shared engine pool
+        """
+        self.pool = pool
+        self.boards = []
+        self._stop = threading.Event()
+
+    def add_board(self, ser, latency_target: float, records_dir: str = None) -> robot.ChessRobot:
+        """
+        Adds a board and starts serving it.
+
+        :param ser: The open serial port connected to the board's MSP
+        :param latency_target: The board's latency target in seconds
+        :param records_dir: The directory the board's game records are saved to, or None
+
+        :returns: The board's ChessRobot
+        """
+        searcher = PoolSearcher(self.pool, latency_target)
+        board = robot.ChessRobot(ser, None, records_dir=records_dir, watchdog=searcher)
+        searcher.options = lambda: board.difficulty.options
+        # Unloaded boards search for their whole latency target
+        board.limit = chess.engine.Limit(time=max(MIN_SEARCH_TIME, latency_target - RESPONSE_MARGIN))
+        thread = threading.Thread(target=self._serve, args=(board,), name=f"board-{len(self.boards)}", daemon=True)
+        self.boards.append((board, thread))
+        thread.start()
+        return board
+
+    def _serve(self, board: robot.ChessRobot) -> None:
+        while not self._stop.is_set():
+            board.step()
+
+    def stop(self) -> None:
+        """
+        Stops serving the boards once their current instructions are handled.
+        """
+        self._stop.set()
+        for _, thread in self.boards:
+            thread.join()
+
+
+def parse_board(text: str) -> tuple:
+    """
+    :param text: "PORT" or "PORT:TARGET_MS"
+
+    :returns: A tuple of the port and its latency target in seconds
+    """
+    port, _, target = text.rpartition(":") if ":" in text else (text, "", "")
+    return port, float(target or LATENCY_TARGET_MS) / 1000
+
+
+def open_pool(engines: int, engine_path: str = None) -> EnginePool:
+    """
+    :param engines: The number of engines
+    :param engine_path: The Stockfish binary (defaults to the installed build, see build_matrix.py)
+
+    :returns: A started engine pool, with the host's threads and hash split between its engines
+    """
+    if engine_path is None:
+        engine_path = build_matrix.installed_engine(robot.STOCKFISH_MANIFEST, robot.STOCKFISH_PATH)
+    options = pool_options(engines)
+    print(f"Engine pool: {engines} engines with {options}", flush=True)
+
+    def start_engine():
+        engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+        engine.configure(options)
+        engine.ping()
+        return engine
+
+    return EnginePool(engines, start_engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive several chess robots from one host with a shared engine pool")
+    parser.add_argument("boards", nargs="+", metavar="PORT[:TARGET_MS]",
+                        help=f"The serial port of each board, with its latency target (default {LATENCY_TARGET_MS} ms)")
+    parser.add_argument("--engines", type=int, default=None, help="Engines in the pool (default: one per CPU, at most one per board)")
+    parser.add_argument("--engine", default=None, help="The Stockfish binary")
+    parser.add_argument("--records", metavar="DIR", default=None, help="Save game records to DIR/board-N")
+    args = parser.parse_args()
+
+    boards = [parse_board(text) for text in args.boards]
+    engines = args.engines if args.engines is not None else min(len(boards), host_profile.cpu_count())
+    pool = open_pool(engines, args.engine)
+    server = BoardServer(pool)
+    for index, (port, target) in enumerate(boards):
+        records_dir = os.path.join(args.records, f"board-{index}") if args.records is not None else None
+        server.add_board(robot.open_serial(port=port), target, records_dir)
+        print(f"Board {index}: {port}, latency target {target * 1000:.0f} ms", flush=True)
+
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    print("Stopping...", flush=True)
+    server.stop()
+    for index, (board, _) in enumerate(server.boards):
+        board.save_record()
+        print(f"Board {index}: {board.watchdog.format_latency()}", flush=True)
+    pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
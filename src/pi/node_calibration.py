@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Calibrates the node budget of the controller's deterministic mode. A search limited to N nodes
+(with one thread and a fixed hash, cleared before every game) always returns the same move for
+the same game, however loaded, hot or throttled the host is, so strength and results are
+reproducible across runs and machines; only the time the search takes varies.
+
+N is picked per host so that it fits inside the latency target: the engine's speed is measured on
+a few representative positions, and the slowest of them sets the budget. Calibrations are cached
+in a JSON file keyed by host, engine, engine binary and target, so only the first boot pays for
+them, and installing another build (e.g. with build_matrix.py) measures it again.
+
+Usage:
+    python node_calibration.py [--engine PATH] [--target MS] [--cache FILE]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import time
+
+import chess
+import chess.engine
+
+# Representative positions: an opening, a middlegame and an endgame
+CALIBRATION_FENS = [
+    chess.STARTING_FEN,
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 9",
+    "8/5pk1/6p1/3R4/7P/6P1/r4PK1/8 w - - 0 40",
+]
+
+# Nodes searched per position while measuring the engine's speed
+PROBE_NODES = 50000
+
+# Fraction of the latency target the search may use; the rest covers UART and controller overhead
+NODES_SAFETY = 0.8
+
+# The engine options of the deterministic mode: one thread (multi-threaded searches are not
+# reproducible) and the same hash size on every host
+DETERMINISTIC_OPTIONS = {"Threads": 1, "Hash": 64}
+
+
+def measure_nps(engine: chess.engine.SimpleEngine, fens: list = CALIBRATION_FENS, nodes: int = PROBE_NODES) -> float:
+    """
+    Measures the engine's speed, including python-chess' overhead, on each position.
+
+    :param engine: The running engine (configured as it will be used)
+    :param fens: The positions to measure on
+    :param nodes: The number of nodes to search per position
+
+    :returns: The lowest nodes per second over the positions
+    """
+    # Warm up (the first search also sends ucinewgame and allocates the hash)
+    engine.analyse(chess.Board(), chess.engine.Limit(nodes=nodes // 10))
+    speeds = []
+    for fen in fens:
+        start = time.perf_counter()
+        info = engine.analyse(chess.Board(fen), chess.engine.Limit(nodes=nodes))
+        speeds.append(info.get("nodes", nodes) / (time.perf_counter() - start))
+    return min(speeds)
+
+
+def nodes_for_target(nps: float, target_ms: float) -> int:
+    """
+    :param nps: The engine's (worst case) nodes per second
+    :param target_ms: The latency target per move, in milliseconds
+
+    :returns: The node budget, rounded down to two significant digits so small changes in the
+              measured speed give the same budget
+    """
+    nodes = max(1, int(nps * target_ms / 1000 * NODES_SAFETY))
+    scale = 10 ** max(0, int(math.log10(nodes)) - 1)
+    return nodes // scale * scale
+
+
+def binary_signature(binary: str) -> str:
+    """
+    :param binary: The engine binary's path (or its name on PATH)
+
+    :returns: The binary's absolute path and modification time, which change with every build installed
+    """
+    path = shutil.which(binary) or binary
+    try:
+        return f"{os.path.abspath(path)}@{os.stat(path).st_mtime_ns}"
+    except OSError:
+        return path
+
+
+def calibrate(engine: chess.engine.SimpleEngine, target_ms: float, cache_path: str = None, binary: str = None) -> dict:
+    """
+    Returns the node budget for this host, engine and latency target, measuring it if it is not
+    in the cache yet.
+
+    :param engine: The running engine, configured with DETERMINISTIC_OPTIONS
+    :param target_ms: The latency target per move, in milliseconds
+    :param cache_path: A JSON file calibrations are cached in, or None to always measure
+    :param binary: The engine binary the engine runs, or None if unknown
+
+    :returns: A dictionary with the budget ("nodes"), the measured "nps", and what it was measured
+              for ("host", "engine", "binary", "target_ms")
+    """
+    signature = binary_signature(binary) if binary is not None else None
+    key = f"{platform.node()}|{platform.machine()}|{engine.id.get('name')}|{signature}|{target_ms:g}"
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        if key in cache:
+            return cache[key]
+
+    nps = measure_nps(engine)
+    calibration = {
+        "nodes": nodes_for_target(nps, target_ms),
+        "nps": int(nps),
+        "host": platform.node(),
+        "engine": engine.id.get("name"),
+        "binary": signature,
+        "target_ms": target_ms,
+    }
+    if cache_path is not None:
+        cache[key] = calibration
+        try:
+            with open(cache_path, "w") as f:
+                json.dump(cache, f, indent=2)
+        except OSError as e:
+            print(f"Could not cache the node calibration in {cache_path}: {e}", flush=True)
+    return calibration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the node budget that fits a latency target on this host")
+    parser.add_argument("--engine", default="stockfish", help="The Stockfish binary")
+    parser.add_argument("--target", type=float, default=2000, help="Latency target per move in milliseconds")
+    parser.add_argument("--cache", default=None, help="A JSON file to cache the calibration in")
+    args = parser.parse_args()
+
+    engine = chess.engine.SimpleEngine.popen_uci(args.engine)
+    try:
+        engine.configure(DETERMINISTIC_OPTIONS)
+        calibration = calibrate(engine, args.target, args.cache, args.engine)
+    finally:
+        engine.quit()
+    print(f"{calibration['nodes']} nodes per move ({calibration['nps']} nps, {args.target:g} ms target)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Infers the human's move from the reed-switch array's occupancy bitboard (BOARD_STATE).
+
+Occupancy alone is enough to tell almost every move apart: for each legal move, the occupancy
+after it is the current occupancy with the moved piece's square cleared and its target set
+(captures only clear the square they came from, en passant also clears the captured pawn, and
+castling moves the rook too). These deltas are precomputed for every legal move in a position,
+so the move is a single dictionary lookup once the board is read.
+
+The one thing occupancy cannot tell is which piece a capturing piece took when it could have
+taken several: every such capture only clears the capturing piece's square. Those moves are
+reported as ambiguous, with the squares involved, so the MSP can resolve them (by sending
+HUMAN_MOVE). Promotions are always to a queen, like everywhere else on the board.
+
+Bitboards use python-chess' square numbering: bit 0 is a1, bit 7 is h1 and bit 63 is h8.
+"""
+
+import chess
+
+# Results of inferring a move
+MOVE_FOUND = 0
+MOVE_ILLEGAL = 1
+MOVE_AMBIGUOUS = 2
+
+
+def occupancy_after(board: chess.Board, move: chess.Move) -> int:
+    """
+    :param board: The position before the move
+    :param move: A legal move
+
+    :returns: The occupancy bitboard after the move, without playing it
+    """
+    occupied = board.occupied & ~chess.BB_SQUARES[move.from_square]
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        kingside = chess.square_file(move.to_square) > chess.square_file(move.from_square)
+        rook_from = chess.square(7 if kingside else 0, rank)
+        rook_to = chess.square(5 if kingside else 3, rank)
+        return (occupied & ~chess.BB_SQUARES[rook_from]) | chess.BB_SQUARES[move.to_square] | chess.BB_SQUARES[rook_to]
+    if board.is_en_passant(move):
+        captured = chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square))
+        occupied &= ~chess.BB_SQUARES[captured]
+    return occupied | chess.BB_SQUARES[move.to_square]
+
+
+def move_table(board: chess.Board) -> dict:
+    """
+    :param board: A position
+
+    :returns: The legal moves (queen promotions only) by the occupancy bitboard after them
+    """
+    table = {}
+    for move in board.legal_moves:
+        if move.promotion not in (None, chess.QUEEN):
+            continue
+        table.setdefault(occupancy_after(board, move), []).append(move)
+    return table
+
+
+def infer_move(table: dict, occupancy: int) -> tuple:
+    """
+    :param table: The position's move table (see move_table)
+    :param occupancy: The occupancy bitboard read from the board
+
+    :returns: A tuple of MOVE_FOUND and the move, MOVE_ILLEGAL and None, or MOVE_AMBIGUOUS and
+              the candidate moves
+    """
+    moves = table.get(occupancy)
+    if not moves:
+        return MOVE_ILLEGAL, None
+    if len(moves) > 1:
+        return MOVE_AMBIGUOUS, moves
+    return MOVE_FOUND, moves[0]
+
+
+def squares_mask(moves: list) -> int:
+    """
+    :param moves: Candidate moves
+
+    :returns: A bitboard of every square the moves come from or go to
+    """
+    mask = 0
+    for move in moves:
+        mask |= chess.BB_SQUARES[move.from_square] | chess.BB_SQUARES[move.to_square]
+    return mask
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+Builds a Polyglot opening book from the robot's own games in the game archive (game_archive.py),
+so the openings visitors keep playing are answered from the book instead of searched (--book).
+
+Every move of the first MAX_BOOK_PLY plies of each finished game is counted for the position it
+was played from: the points the mover scored in the game (2 for a win, 1 for a draw, 0 for a
+loss) and, where the archive has one, the evaluation after the move from the mover's point of
+view (the post-game analysis if the game was analysed, otherwise the robot's own search). A
+move's book weight is its points scaled by the winning chances of its average evaluation, so a
+move that won a few games through a blunder later still ranks below a move that keeps the
+advantage. Moves that lost every game they were played in get no weight and are left out.
+
+The counts are kept in the archive file itself, and each run only reads the games added (or
+analysed) since the last one, a batch at a time, so the builder can run every night on the Pi
+with bounded memory however large the archive grows. The counts are only valid for the
+--max-ply they were made with, so changing it recounts every game. The book is then written out sorted by key
+straight from an index, and renamed over the old one.
+
+Usage:
+    python opening_book.py ARCHIVE BOOK [--max-ply N] [--rebuild]
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import zlib
+
+import chess
+import game_analysis
+import game_archive
+import search_stats
+
+# Only moves from the first this many plies of a game go into the book
+MAX_BOOK_PLY = 20
+
+# Games read from the archive per transaction
+BATCH_GAMES = 200
+
+# SQLite page cache per run (KiB), which bounds the builder's memory together with BATCH_GAMES
+CACHE_KIB = 8192
+
+# Points for the mover per game result
+WIN_POINTS = 2
+DRAW_POINTS = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS book_moves (
+    key INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    evals INTEGER NOT NULL,
+    eval_sum INTEGER NOT NULL,
+    PRIMARY KEY (key, move)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS book_games (
+    game INTEGER PRIMARY KEY,
+    analysed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS book_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# A Polyglot entry: key, move, weight and learn, big-endian
+ENTRY = struct.Struct(">QHHI")
+
+
+def encode_move(board: chess.Board, move: chess.Move) -> int:
+    """
+    :param board: The position the move is played from
+    :param move: The move
+
+    :returns: The move in Polyglot's encoding (castling as the king capturing its own rook)
+    """
+    to_square = move.to_square
+    if board.is_castling(move):
+        rook_file = 7 if chess.square_file(move.to_square) > chess.square_file(move.from_square) else 0
+        to_square = chess.square(rook_file, chess.square_rank(move.from_square))
+    promotion = move.promotion - 1 if move.promotion else 0
+    return to_square | (move.from_square << 6) | (promotion << 12)
+
+
+def contributions(record: dict, max_ply: int, use_analysis: bool) -> list:
+    """
+    :param record: A finished game's record
+    :param max_ply: The last ply counted
+    :param use_analysis: Take evaluations from the record's analysis (if any) instead of the robot's searches
+
+    :returns: Tuples of the position's key, the encoded move, the mover's points and the
+              evaluation after the move from the mover's point of view (or None)
+    """
+    points = {"1-0": (WIN_POINTS, 0), "0-1": (0, WIN_POINTS), "1/2-1/2": (DRAW_POINTS, DRAW_POINTS)}.get(record["result"])
+    if points is None:
+        return []
+    analysis = {entry["ply"]: entry for entry in record.get("analysis") or [] if "cp_after" in entry} if use_analysis else {}
+    board = chess.Board(record["fen"])
+    counted = []
+    for ply, entry in enumerate(record["moves"][:max_ply]):
+        move = chess.Move.from_uci(entry["uci"])
+        evaluation = None
+        if ply in analysis:
+            evaluation = analysis[ply]["cp_after"]
+        elif entry["by"] == search_stats.ROBOT and "stats" in entry:
+            stats = entry["stats"]
+            if "mate" in stats:
+                evaluation = game_analysis.EVAL_CAP if stats["mate"] > 0 else -game_analysis.EVAL_CAP
+            elif stats.get("cp") is not None:
+                evaluation = max(-game_analysis.EVAL_CAP, min(game_analysis.EVAL_CAP, stats["cp"]))
+        counted.append((game_archive.position_key(board), encode_move(board, move),
+                        points[0] if board.turn == chess.WHITE else points[1], evaluation))
+        board.push(move)
+    return counted
+
+
+def weight(games: int, points: int, evals: int, eval_sum: int) -> int:
+    """
+    :returns: A move's Polyglot weight from its counts
+    """
+    factor = game_analysis.win_percent(eval_sum / evals) / 50 if evals else 1.0
+    return min(0xFFFF, round(points * factor))
+
+
+class BookBuilder:
+    """
+    Counts the archive's opening moves incrementally and writes them out as a Polyglot book.
+    """
+
+    def __init__(self, archive: game_archive.GameArchive, max_ply: int = MAX_BOOK_PLY):
+        """
+        :param archive: The game archive; the counts are kept in the same file
+        :param max_ply: The last ply counted
+        """
+        self.db = archive.db
+        self.archive = archive
+        self.max_ply = max_ply
+        self.db.execute(f"PRAGMA cache_size = -{CACHE_KIB}")
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM book_meta WHERE name = 'max_ply'").fetchone()
+        counted_ply = row[0] if row is not None else None
+        if counted_ply != max_ply:
+            # Counts made with another max_ply (or before it was stored) would mix with the new ones
+            if self.db.execute("SELECT 1 FROM book_games LIMIT 1").fetchone() is not None:
+                counted_with = f"max ply {counted_ply}" if counted_ply is not None else "an unknown max ply"
+                print(f"The book was counted with {counted_with}, not {max_ply}; counting every game again", flush=True)
+            self.rebuild()
+
+    def rebuild(self) -> None:
+        """
+        Forgets every count, so the next update() reads the whole archive again.
+        """
+        with self.db:
+            self.db.execute("DELETE FROM book_moves")
+            self.db.execute("DELETE FROM book_games")
+            self.db.execute("INSERT OR REPLACE INTO book_meta (name, value) VALUES ('max_ply', ?)", (self.max_ply,))
+
+    def _count(self, record: dict, use_analysis: bool, sign: int) -> None:
+        self.db.executemany(
+            "INSERT INTO book_moves (key, move, games, points, evals, eval_sum) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (key, move) DO UPDATE SET games = games + excluded.games, points = points + excluded.points, "
+            "evals = evals + excluded.evals, eval_sum = eval_sum + excluded.eval_sum",
+            [(key, move, sign, sign * points, sign * (evaluation is not None), sign * (evaluation or 0))
+             for key, move, points, evaluation in contributions(record, self.max_ply, use_analysis)])
+
+    def update(self) -> tuple:
+        """
+        Counts the games added to the archive since the last update, and recounts the games
+        analysed since then with the analysis' evaluations.
+
+        :returns: A tuple of the number of games counted and recounted
+        """
+        counted = recounted = 0
+        while True:
+            rows = self.db.execute(
+                "SELECT games.id, games.analysed, games.record, book_games.analysed FROM games "
+                "LEFT JOIN book_games ON book_games.game = games.id "
+                "WHERE book_games.game IS NULL OR (games.analysed AND NOT book_games.analysed) "
+                "ORDER BY games.id LIMIT ?", (BATCH_GAMES,)).fetchall()
+            if not rows:
+                return counted, recounted
+            with self.db:
+                for game, analysed, blob, counted_analysed in rows:
+                    record = json.loads(zlib.decompress(blob))
+                    if counted_analysed is not None:
+                        # Take back the counts made with the robot's own evaluations
+                        self._count(record, False, -1)
+                        recounted += 1
+                    else:
+                        counted += 1
+                    self._count(record, True, 1)
+                    self.db.execute("INSERT OR REPLACE INTO book_games (game, analysed) VALUES (?, ?)", (game, analysed))
+
+    def write(self, path: str) -> int:
+        """
+        Writes the book to path (through a temporary file, so readers never see half a book).
+
+        :returns: The number of entries written
+        """
+        entries = 0
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            # Polyglot books are sorted by the unsigned key; SQLite stores it signed
+            for key, move, games, points, evals, eval_sum in self.db.execute(
+                    "SELECT key, move, games, points, evals, eval_sum FROM book_moves WHERE games > 0 "
+                    "ORDER BY key < 0, key"):
+                move_weight = weight(games, points, evals, eval_sum)
+                if move_weight > 0:
+                    f.write(ENTRY.pack(key & 0xFFFFFFFFFFFFFFFF, move, move_weight, 0))
+                    entries += 1
+        os.replace(temporary, path)
+        return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a Polyglot opening book from the game archive")
+    parser.add_argument("archive", help="The game archive (see game_archive.py)")
+    parser.add_argument("book", help="The Polyglot book to write")
+    parser.add_argument("--max-ply", type=int, default=MAX_BOOK_PLY, help="Only count moves from the first N plies")
+    parser.add_argument("--rebuild", action="store_true", help="Count every game again instead of only the new ones")
+    args = parser.parse_args()
+
+    archive = game_archive.GameArchive(args.archive)
+    try:
+        builder = BookBuilder(archive, args.max_ply)
+        if args.rebuild:
+            builder.rebuild()
+        counted, recounted = builder.update()
+        entries = builder.write(args.book)
+    finally:
+        archive.close()
+    print(f"Counted {counted} new games and recounted {recounted} analysed games; wrote {entries} entries to {args.book}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Optional timeline tracing for the Raspberry Pi controller. Emits the Chrome Trace Event
+JSON format (https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU),
+which can be loaded into chrome://tracing or https://ui.perfetto.dev to view a whole game
+as spans on separate tracks (UART, engine, board).
+"""
+
+import json
+import os
+import threading
+import time
+
+# TRACK (THREAD ID) DEFINES
+TRACK_UART   = 1
+TRACK_ENGINE = 2
+TRACK_BOARD  = 3
+
+TRACK_NAMES = {
+    TRACK_UART:   "UART",
+    TRACK_ENGINE: "Engine",
+    TRACK_BOARD:  "Board",
+}
+
+
+class NullTracer:
+    """
+    Tracer used when tracing is disabled. Every method is a no-op so the controller can
+    call into the tracer unconditionally.
+    """
+    enabled = False
+
+    def now(self) -> int:
+        return 0
+
+    def complete(self, name: str, track: int, start: int, **args) -> None:
+        pass
+
+    def instant(self, name: str, track: int, **args) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class ChromeTracer(NullTracer):
+    """
+    Writes trace events to a file in the JSON Array Format. Events are flushed as they
+    are recorded, and the closing bracket is optional in this format, so a trace from a
+    crashed or killed controller can still be loaded.
+    """
+    enabled = True
+
+    def __init__(self, path: str):
+        """
+        :param path: The file the trace events will be written to
+        """
+        self.path = path
+        self.pid = os.getpid()
+        self._origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._file = open(path, "w")
+        self._file.write("[\n")
+        self._first = True
+
+        # Name the process and each track so the viewer shows readable labels
+        self._write({"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                     "args": {"name": "chess_robot"}})
+        for tid, track_name in TRACK_NAMES.items():
+            self._write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                         "args": {"name": track_name}})
+
+    def now(self) -> int:
+        """
+        :returns: The current timestamp in nanoseconds, to be passed back to complete()
+        """
+        return time.perf_counter_ns()
+
+    def complete(self, name: str, track: int, start: int, **args) -> None:
+        """
+        Records a span which started at timestamp start and ends now.
+
+        :param name: The span label shown in the viewer
+        :param track: One of the TRACK_* defines
+        :param start: A timestamp previously returned by now()
+        :param args: Extra key/value pairs attached to the span
+        """
+        end = time.perf_counter_ns()
+        self._write({"name": name, "ph": "X", "pid": self.pid, "tid": track,
+                     "ts": (start - self._origin) / 1000, "dur": (end - start) / 1000,
+                     "args": args})
+
+    def instant(self, name: str, track: int, **args) -> None:
+        """
+        Records a zero-length event at the current time.
+
+        :param name: The event label shown in the viewer
+        :param track: One of the TRACK_* defines
+        :param args: Extra key/value pairs attached to the event
+        """
+        self._write({"name": name, "ph": "i", "s": "t", "pid": self.pid, "tid": track,
+                     "ts": (time.perf_counter_ns() - self._origin) / 1000, "args": args})
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write("\n]\n")
+            self._file.close()
+
+    def _write(self, event: dict) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            if not self._first:
+                self._file.write(",\n")
+            self._first = False
+            self._file.write(json.dumps(event, separators=(",", ":")))
+            self._file.flush()
+
+
+def open_tracer(path: str = None) -> NullTracer:
+    """
+    :param path: The trace output file, or None to disable tracing
+
+    :returns: A ChromeTracer writing to path, or a NullTracer if path is None
+    """
+    if path is None:
+        return NullTracer()
+    return ChromeTracer(path)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Collects Stockfish's search statistics (the UCI "info" lines) for every robot move and keeps
+them alongside the moves in a compact per-game record. The records give real data for sizing
+Hash, Threads and MOVE_TIME on the Raspberry Pi.
+"""
+
+import chess
+import chess.engine
+import datetime
+import json
+import os
+import time
+
+# Statistics copied verbatim from the final info line of each search
+STAT_KEYS = ("depth", "seldepth", "nodes", "nps", "hashfull", "tbhits")
+
+# Side labels used in GameRecord moves
+HUMAN = "H"
+ROBOT = "R"
+
+
+def compact_info(info: dict, turn: chess.Color) -> dict:
+    """
+    Converts a python-chess info dictionary into a compact, JSON-serializable dictionary.
+
+    :param info: An info dictionary as produced by python-chess for one UCI "info" line
+    :param turn: The side the engine was searching for; scores are reported from its point of view
+
+    :returns: A dictionary holding the STAT_KEYS present in info, the search time in milliseconds
+              ("ms"), and either a centipawn score ("cp") or a mate distance ("mate")
+    """
+    stats = {key: info[key] for key in STAT_KEYS if key in info}
+    if "time" in info:
+        stats["ms"] = int(info["time"] * 1000)
+    if "score" in info:
+        score = info["score"].pov(turn)
+        if score.is_mate():
+            stats["mate"] = score.mate()
+        else:
+            stats["cp"] = score.score()
+    return stats
+
+
+def search(engine: chess.engine.SimpleEngine, board: chess.Board, limit: chess.engine.Limit,
+           game: object = None, early_stop=None, on_start=None) -> tuple:
+    """
+    Runs a search through engine.analysis() so that every info line Stockfish emits is seen,
+    instead of only the best move returned by engine.play().
+
+    :param engine: The running engine
+    :param board: The position to search
+    :param limit: The search limit
+    :param game: The game the search belongs to; python-chess sends "ucinewgame" whenever this
+                 differs from the previous search's game (see game_lifecycle.py)
+    :param early_stop: An early_stop.EarlyStop consulted after every iteration, or None to always
+                       search until the limit
+    :param on_start: A function called with the running analysis once the search has started, so
+                     another thread can stop it (see engine_scheduler.py), or None
+
+    :returns: A tuple of the best move (chess.Move) and its statistics. The statistics hold the
+              compact_info() of the last complete iteration plus "iters", a list of
+              [depth, ms, nodes] triples, one per completed iteration, "ponder" with the reply the
+              engine expects (if its principal variation has one), and "stopped" with the reason
+              if early_stop ended the search
+    """
+    turn = board.turn
+    last = {}
+    iters = []
+    if early_stop is not None:
+        early_stop.reset()
+    search_start = time.perf_counter()
+    with engine.analysis(board, limit, game=game, info=chess.engine.INFO_ALL) as analysis:
+        if on_start is not None:
+            on_start(analysis)
+        for info in analysis:
+            # Lines without a score are currmove/hashfull updates, not completed iterations
+            if "score" not in info or "depth" not in info:
+                continue
+            last = info
+            iters.append([info["depth"], int(info.get("time", 0) * 1000), info.get("nodes", 0)])
+            if early_stop is not None and early_stop.should_stop(info, time.perf_counter() - search_start, turn):
+                analysis.stop()
+                break
+        best = analysis.wait()
+
+    stats = compact_info(last, turn)
+    stats["iters"] = iters
+    if len(last.get("pv", [])) > 1:
+        stats["ponder"] = last["pv"][1].uci()
+    if early_stop is not None and early_stop.reason is not None:
+        stats["stopped"] = early_stop.reason
+    return best.move, stats
+
+
+def format_stats(stats: dict) -> str:
+    """
+    :param stats: Statistics returned by search()
+
+    :returns: A one-line human-readable summary for the controller log
+    """
+    score = f"mate {stats['mate']}" if "mate" in stats else f"cp {stats.get('cp')}"
+    summary = (f"depth {stats.get('depth')}/{stats.get('seldepth')} | {score} | nodes {stats.get('nodes')} | "
+               f"nps {stats.get('nps')} | hashfull {stats.get('hashfull')} | tbhits {stats.get('tbhits')} | {stats.get('ms')} ms")
+    if "clock_ms" in stats:
+        summary += f" | clock {stats['clock_ms'] / 1000:.1f} s"
+    if "fallback" in stats:
+        summary += f" | fallback {stats['fallback']}"
+    return summary
+
+
+class GameRecord:
+    """
+    A compact record of one game: the starting position, every move made by either side with
+    its time offset, the engine's statistics for robot moves, and the result.
+    """
+
+    def __init__(self, fen: str = chess.STARTING_FEN, player_color: str = None):
+        """
+        :param fen: The FEN the game starts from
+        :param player_color: "W" or "B" for the human's color, or None if unknown
+        """
+        self.fen = fen
+        self.player_color = player_color
+        self.started = datetime.datetime.now()
+        self.result = "*"
+        self.moves = []
+        # Time from the instruction that made the robot move first to sending that move
+        self.first_move_ms = None
+        # The target Elo the robot played at (0 for full strength)
+        self.elo = 0
+        # The engine watchdog's counters when the game was saved
+        self.watchdog = None
+        # The engine scheduler's preemption metrics when the game was saved
+        self.scheduler = None
+        self.saved = False
+        self._origin = time.monotonic()
+
+    def add_move(self, side: str, move_uci: str, stats: dict = None) -> None:
+        """
+        :param side: HUMAN or ROBOT
+        :param move_uci: The move in UCI notation
+        :param stats: Statistics returned by search() for robot moves
+        """
+        entry = {"by": side, "uci": move_uci, "t": int((time.monotonic() - self._origin) * 1000)}
+        if stats is not None:
+            entry["stats"] = stats
+        self.moves.append(entry)
+
+    def finish(self, board: chess.Board) -> None:
+        """
+        Records the result of the game from the final board.
+
+        :param board: The board at the end of the game
+        """
+        self.result = board.result(claim_draw=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "fen": self.fen,
+            "player_color": self.player_color,
+            "elo": self.elo,
+            "result": self.result,
+            "first_move_ms": self.first_move_ms,
+            "watchdog": self.watchdog,
+            "scheduler": self.scheduler,
+            "moves": self.moves,
+        }
+
+    def save(self, directory: str) -> str:
+        """
+        Writes the record as a single-line JSON file named after the game's start time (to the
+        millisecond). An existing record is never overwritten, e.g. another board's in a simul
+        that started in the same millisecond; the name gets a suffix instead.
+
+        :param directory: The directory the record is written to (created if missing)
+
+        :returns: The path of the written file
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = f"game_{self.started.strftime('%Y%m%d_%H%M%S')}_{self.started.microsecond // 1000:03d}"
+        suffix = 0
+        while True:
+            path = os.path.join(directory, f"{name}.json" if suffix == 0 else f"{name}-{suffix}.json")
+            try:
+                f = open(path, "x")
+            except FileExistsError:
+                suffix += 1
+                continue
+            with f:
+                json.dump(self.to_dict(), f, separators=(",", ":"))
+            break
+        self.saved = True
+        return path
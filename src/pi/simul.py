@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""
+Simultaneous exhibition mode: one gantry and one engine play several boards at once.
+
+The MSP prefixes every board-specific instruction with BOARD (the board's index), in both
+directions: START_W, START_B, RESET and HUMAN_MOVE from the MSP, and ROBOT_MOVE and ILLEGAL_MOVE
+from the Pi. The UART stays half-duplex as in a single game: the Pi only ever answers the MSP.
+Whenever the gantry is idle the MSP sends GANTRY_READY, and the Pi answers with the next board
+and its robot move, or with BUSY if no reply is ready yet (the MSP asks again shortly).
+
+The controller keeps one game per board and:
+- searches the boards whose human has moved on a background thread, so the next board's reply
+  is computed while the gantry is still executing the previous move
+- searches them in the order the gantry will visit them, so the move needed next is ready first
+- sends the gantry to the next board with a reply ready, visiting boards in sweeps along the row
+  (like an elevator) so it travels as little as possible without leaving any board waiting for
+  more than a sweep
+and logs the simul's throughput in moves per minute after every robot move.
+
+Usage:
+    python simul.py BOARDS [--port PORT] [--records DIR] [--move-time SECONDS]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import chess
+import chess.engine
+import chess_robot_v7 as robot
+import engine_scheduler
+import search_stats
+
+# Game states of a board
+IDLE = "idle"             # No game running
+HUMAN = "human"           # Waiting for the human's move
+PENDING = "pending"       # The human has moved; the robot's reply has to be searched
+SEARCHING = "searching"   # The reply is being searched
+READY = "ready"           # The reply is ready for the gantry
+
+
+class SimulGame:
+    """
+    The game on one board of the simul.
+    """
+
+    def __init__(self, index: int):
+        """
+        :param index: The board's index; boards are numbered along the gantry's row
+        """
+        self.index = index
+        self.board = chess.Board()
+        self.state = IDLE
+        self.player_color = None
+        # Bumped by every new game, so a search of a game that was since reset is discarded
+        self.generation = 0
+        self.status_after_player = robot.GAME_ONGOING
+        # The searched reply (UCI) and its statistics once READY
+        self.reply = None
+        self.reply_info = None
+        self.record = search_stats.GameRecord()
+
+    def new_game(self, player_color: str) -> None:
+        """
+        :param player_color: "W" or "B" for the human's color, or None after a RESET
+        """
+        self.board = chess.Board()
+        self.player_color = player_color
+        self.generation += 1
+        self.status_after_player = robot.GAME_ONGOING
+        self.reply = None
+        self.reply_info = None
+        self.record = search_stats.GameRecord(player_color=player_color)
+        if player_color == "W":
+            self.state = HUMAN
+        elif player_color == "B":
+            self.state = PENDING
+        else:
+            self.state = IDLE
+
+
+def visit_order(games: list, position: int, direction: int) -> list:
+    """
+    Orders boards for the gantry: the boards ahead in its current direction nearest first, then the
+    boards behind it nearest first (the gantry turns around at the last board ahead).
+
+    :param games: The boards to order
+    :param position: The index of the board the gantry is at
+    :param direction: 1 if the gantry is moving towards higher indices, -1 otherwise
+
+    :returns: The boards in visiting order
+    """
+    ahead = [game for game in games if (game.index - position) * direction >= 0]
+    behind = [game for game in games if (game.index - position) * direction < 0]
+    distance = lambda game: abs(game.index - position)
+    return sorted(ahead, key=distance) + sorted(behind, key=distance)
+
+
+class SimulRobot(robot.ChessRobot):
+    """
+    The controller's state machine for a simul: one game per board, one engine and one gantry.
+    """
+
+    def __init__(self, ser, engine: chess.engine.SimpleEngine, boards: int, tracer=None, records_dir: str = None,
+                 restart_engine=None):
+        """
+        :param ser: The serial port connected to the MSP
+        :param engine: The running chess engine
+        :param boards: The number of boards in the simul
+        :param tracer: The tracer to record spans to (defaults to no tracing)
+        :param records_dir: Game records are saved to board-N subdirectories of this, or None
+        :param restart_engine: Passed to the engine watchdog
+        """
+        super().__init__(ser, engine, tracer=tracer, records_dir=records_dir, restart_engine=restart_engine)
+        self.games = [SimulGame(index) for index in range(boards)]
+        self.selected = self.games[0]
+        self.gantry_position = 0
+        self.direction = 1
+        # Guards the games' states; the search thread waits on it for work
+        self._condition = threading.Condition()
+        # Held while the engine searches or is configured (re-entrant for the watchdog's restarts)
+        self._engine_lock = threading.RLock()
+        # The games share one engine, so python-chess is never told about new games (which would
+        # clear the hash between every two boards)
+        self._game_token = object()
+        self._searcher = threading.Thread(target=self._search_loop, name="simul-search", daemon=True)
+
+        # Throughput
+        self.started = None
+        self.moves = 0
+        self.engine_busy = 0.0
+        self.travel = 0
+
+    def run(self) -> None:
+        """
+        The main program loop; starts the search thread and handles instructions from the MSP forever.
+        """
+        self._searcher.start()
+        super().run()
+
+    def handle_instruction(self, instr: int, operand: bytes) -> None:
+        """
+        Takes action based on the instruction ID; board-specific instructions apply to the board
+        selected by the last BOARD instruction.
+
+        :param instr: The instruction ID of a validated instruction
+        :param operand: The instruction's operand bytes (empty if it has none)
+        """
+        game = self.selected
+        if instr == robot.BOARD_INSTR and len(operand) == 1:
+            if operand[0] < len(self.games):
+                self.selected = self.games[operand[0]]
+            else:
+                print(f"No board {operand[0]} in this simul", flush=True)
+        elif instr == robot.GANTRY_READY_INSTR:
+            if not self.dispatch():
+                busy_instr_bytes = robot.encode_frame(robot.BUSY_INSTR)
+                self.ser.write(bytearray(busy_instr_bytes)) # BUSY
+                self.await_ack(busy_instr_bytes, "BUSY")
+        elif instr in (robot.RESET_INSTR, robot.START_W_INSTR, robot.START_B_INSTR):
+            player_color = {robot.RESET_INSTR: None, robot.START_W_INSTR: "W", robot.START_B_INSTR: "B"}[instr]
+            with self._condition:
+                self.save_game(game)
+                game.new_game(player_color)
+                game.record.elo = self.difficulty.elo
+                self._condition.notify_all()
+            if self.started is None and player_color is not None:
+                self.started = time.perf_counter()
+            print(f"Board {game.index}: {'reset' if player_color is None else f'new game, human plays {player_color}'}", flush=True)
+        elif instr == robot.HUMAN_MOVE_INSTR:
+            self.simul_human_move(game, operand)
+        elif instr == robot.DIFFICULTY_INSTR and len(operand) == 2:
+            self.set_difficulty(int.from_bytes(operand, "big"))
+        else:
+            print("Did not get a valid instruction", flush=True)
+
+    def simul_human_move(self, game: SimulGame, operand: bytes) -> None:
+        """
+        Validates a human move on one board and, if it is legal, queues the board for a search.
+
+        :param game: The board the move was made on
+        :param operand: The HUMAN_MOVE operand (see ChessRobot.human_move)
+        """
+        try:
+            move = chess.Move.from_uci(robot.parse_move(operand.decode("ascii")))
+        except (ValueError, TypeError):
+            move = None
+        if game.state != HUMAN or move not in game.board.legal_moves:
+            self.select_board(game)
+            self.illegal_move()
+            return
+
+        with self._condition:
+            game.board.push(move)
+            game.record.add_move(search_stats.HUMAN, move.uci())
+            status = robot.check_game_state(game.board)
+            game.status_after_player = status
+            game.state = PENDING if status == robot.GAME_ONGOING else IDLE
+            self._condition.notify_all()
+        print(f"Board {game.index}: human makes move {move.uci()}", flush=True)
+
+        if status != robot.GAME_ONGOING:
+            # The game is over; the MSP only needs the status, not the gantry
+            self.select_board(game)
+            robot_move_instr_bytes = robot.encode_frame(robot.ROBOT_MOVE_INSTR, [ord('_')]*5 + [(status << 4) + robot.GAME_ONGOING])
+            self.ser.write(bytearray(robot_move_instr_bytes)) # ROBOT_MOVE
+            print(f"Board {game.index}: game over!", flush=True)
+            self.await_ack(robot_move_instr_bytes, "ROBOT_MOVE")
+            with self._condition:
+                self.save_game(game)
+
+    def _search_loop(self) -> None:
+        """
+        Searches the boards waiting for a reply forever, the one the gantry will visit first first.
+        """
+        while True:
+            with self._condition:
+                while not any(game.state == PENDING for game in self.games):
+                    self._condition.wait()
+                order = visit_order([game for game in self.games if game.state in (PENDING, READY)],
+                                    self.gantry_position, self.direction)
+                game = next(candidate for candidate in order if candidate.state == PENDING)
+                game.state = SEARCHING
+                board, generation = game.board.copy(), game.generation
+
+            with self._engine_lock:
+                search_start = time.perf_counter()
+                # Through the scheduler, so it counts as live (e.g. pausing post-game analysis)
+                move, search_info = self.scheduler.search(engine_scheduler.CRITICAL, board, self.difficulty.limit(self.limit),
+                                                          self._game_token)
+                self.engine_busy += time.perf_counter() - search_start
+            print(f"Board {game.index}: searched {move.uci()}; {search_stats.format_stats(search_info)}", flush=True)
+
+            with self._condition:
+                if game.generation == generation and game.state == SEARCHING:
+                    game.reply, game.reply_info = move.uci(), search_info
+                    game.state = READY
+
+    def dispatch(self) -> bool:
+        """
+        Sends the idle gantry to the next board with a reply ready.
+
+        :returns: False if no reply is ready
+        """
+        with self._condition:
+            ready = [game for game in self.games if game.state == READY]
+            if not ready:
+                return False
+            game = visit_order(ready, self.gantry_position, self.direction)[0]
+            if game.index != self.gantry_position:
+                self.direction = 1 if game.index > self.gantry_position else -1
+            self.travel += abs(game.index - self.gantry_position)
+            self.gantry_position = game.index
+            move_uci = game.reply
+            # If it's a promotion, it will be overriden to a queen automatically
+            if len(move_uci) == 5:
+                move_uci = move_uci[0:4] + 'q'
+            fifth_byte = robot.get_fifth_byte(game.board, move_uci)
+            game.board.push(chess.Move.from_uci(move_uci))
+            game.record.add_move(search_stats.ROBOT, move_uci, game.reply_info)
+            status_after_robot = robot.check_game_state(game.board)
+            game.state = HUMAN if status_after_robot == robot.GAME_ONGOING else IDLE
+            game_status_byte = (game.status_after_player << 4) + status_after_robot
+
+        self.select_board(game)
+        robot_move_instr_bytes = robot.encode_frame(robot.ROBOT_MOVE_INSTR, [ord(c) for c in move_uci[0:4]] + [ord(fifth_byte), game_status_byte])
+        self.ser.write(bytearray(robot_move_instr_bytes)) # ROBOT_MOVE
+        print(f"Board {game.index}: sent move {move_uci}", flush=True)
+        self.await_ack(robot_move_instr_bytes, "ROBOT_MOVE")
+        if status_after_robot != robot.GAME_ONGOING:
+            print(f"Board {game.index}: game over!", flush=True)
+            with self._condition:
+                self.save_game(game)
+        self.moves += 1
+        print(f"Simul: {self.format_throughput()}", flush=True)
+        return True
+
+    def select_board(self, game: SimulGame) -> None:
+        """
+        Tells the MSP which board the next instruction is for.
+        """
+        board_instr_bytes = robot.encode_frame(robot.BOARD_INSTR, [game.index])
+        self.ser.write(bytearray(board_instr_bytes)) # BOARD
+        self.await_ack(board_instr_bytes, "BOARD")
+
+    def format_throughput(self) -> str:
+        """
+        :returns: A one-line summary of the simul's throughput for the controller log
+        """
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        rate = self.moves / elapsed * 60 if elapsed > 0 else 0.0
+        busy = self.engine_busy / elapsed * 100 if elapsed > 0 else 0.0
+        return (f"{self.moves} moves in {elapsed / 60:.1f} min ({rate:.1f} moves/min) | engine busy {busy:.0f}% | "
+                f"gantry travelled {self.travel} boards")
+
+    def save_game(self, game: SimulGame) -> None:
+        """
+        Saves a board's game record (see ChessRobot.save_record).
+        """
+        if self.records_dir is None or not game.record.moves or game.record.saved:
+            return
+        game.record.finish(game.board)
+        game.record.watchdog = dict(self.watchdog.metrics)
+        print(f"Saved game record to {game.record.save(os.path.join(self.records_dir, f'board-{game.index}'))}", flush=True)
+
+    def apply_difficulty(self) -> None:
+        # Options cannot be set while the engine is searching
+        with self._engine_lock:
+            super().apply_difficulty()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a simultaneous exhibition on several boards with one gantry")
+    parser.add_argument("boards", type=int, help="The number of boards")
+    parser.add_argument("--port", default=robot.SERIAL_PORT, help=f"The serial port connected to the MSP (default {robot.SERIAL_PORT})")
+    parser.add_argument("--records", metavar="DIR", default=None, help="Save game records to DIR/board-N")
+    parser.add_argument("--move-time", type=float, default=robot.MOVE_TIME, help="Search time per move in seconds")
+    args = parser.parse_args()
+    if not 1 <= args.boards <= 256:
+        sys.exit("A simul has 1 to 256 boards; exiting...")
+
+    engine = robot.start_engine(None)
+    ser = robot.open_serial(port=args.port)
+    simul = SimulRobot(ser, engine, args.boards, records_dir=args.records, restart_engine=lambda: robot.start_engine(None))
+    simul.limit = chess.engine.Limit(time=args.move_time)
+    print(f"Simul on {args.boards} boards, {args.move_time:g} s per move", flush=True)
+    try:
+        simul.run()
+    except KeyboardInterrupt:
+        print(f"Simul: {simul.format_throughput()}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
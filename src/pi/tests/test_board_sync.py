@@ -0,0 +1,91 @@
+"""
+The compact positions and hashes of BOARD_SYNC.
+"""
+
+import random
+import zlib
+
+import chess
+import pytest
+
+import board_sync
+
+
+def round_trip(board: chess.Board) -> chess.Board:
+    return board_sync.decode_position(board_sync.encode_position(board))
+
+
+def pieces(data: bytes) -> list:
+    return [nibble for byte in data[8:-3] for nibble in (byte >> 4, byte & 0x0F)]
+
+
+def test_random_games_round_trip():
+    rng = random.Random(0)
+    for _ in range(20):
+        board = chess.Board()
+        while not board.is_game_over() and board.ply() < 200:
+            board.push(rng.choice(list(board.legal_moves)))
+            assert round_trip(board).fen() == board.fen()
+
+
+@pytest.mark.parametrize("fen", [
+    chess.STARTING_FEN,
+    # Black to move, with only some castling rights left
+    "r3k2r/8/8/8/8/8/8/R3K2R b Kq - 12 40",
+    # White to move, and can take en passant
+    "4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 2",
+    # Black to move, and can take en passant
+    "4k3/8/8/8/3Pp3/8/8/4K3 b - d3 0 1",
+])
+def test_special_positions_round_trip(fen):
+    board = chess.Board(fen)
+    assert round_trip(board).fen() == fen
+
+
+def test_special_codes():
+    data = board_sync.encode_position(chess.Board("r3k2r/8/8/8/8/8/8/R3K2R b Kq - 0 1"))
+    # a1, e1, h1, a8, e8, h8
+    assert pieces(data) == [chess.ROOK - 1, chess.KING - 1, board_sync.WHITE_CASTLING_ROOK,
+                            board_sync.BLACK_CASTLING_ROOK, board_sync.BLACK_KING_TO_MOVE, 6 + chess.ROOK - 1]
+
+    data = board_sync.encode_position(chess.Board("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 2"))
+    # e1, d5 (the pawn that just moved two squares), e5, e8
+    assert pieces(data) == [chess.KING - 1, board_sync.EN_PASSANT_PAWN, chess.PAWN - 1, 6 + chess.KING - 1]
+
+    data = board_sync.encode_position(chess.Board("4k3/8/8/8/8/8/8/4K2R w K - 0 1"))
+    # e1, h1, e8, then the padding nibble
+    assert pieces(data) == [chess.KING - 1, board_sync.WHITE_CASTLING_ROOK, 6 + chess.KING - 1, 0]
+
+
+def test_en_passant_without_a_legal_capture_is_not_encoded():
+    board = chess.Board()
+    board.push_uci("e2e4")
+    assert board_sync.EN_PASSANT_PAWN not in pieces(board_sync.encode_position(board))
+
+
+def test_full_board_is_27_bytes():
+    assert len(board_sync.encode_position(chess.Board())) == 27
+    assert len(board_sync.sync_operand(chess.Board())) == 27 + board_sync.HASH_LEN
+
+
+def test_counters_are_capped():
+    board = chess.Board("4k3/8/8/8/8/8/8/4K3 w - - 300 70000")
+    decoded = round_trip(board)
+    assert decoded.halfmove_clock == 255
+    assert decoded.fullmove_number == 0xFFFF
+
+
+def test_malformed_encoding_is_rejected():
+    data = board_sync.encode_position(chess.Board())
+    with pytest.raises(ValueError):
+        board_sync.decode_position(data[:-1])
+
+
+def test_position_hash():
+    data = board_sync.encode_position(chess.Board())
+    assert board_sync.position_hash(data) == zlib.crc32(data).to_bytes(board_sync.HASH_LEN, "big")
+    assert board_sync.check_operand(chess.Board()) == board_sync.position_hash(data)
+    assert board_sync.sync_operand(chess.Board()) == data + board_sync.position_hash(data)
+    board = chess.Board()
+    board.push_uci("g1f3")
+    assert board_sync.check_operand(board) != board_sync.check_operand(chess.Board())
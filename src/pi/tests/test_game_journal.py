@@ -0,0 +1,187 @@
+"""
+Crash recovery from the game journal: replaying events, torn writes, and resuming the game.
+"""
+
+import chess
+
+import board_sync
+import chess_robot_v7 as robot
+import game_journal
+import search_stats
+
+
+class FakeSerial:
+    """
+    A serial port whose MSP ACKs every frame.
+    """
+
+    def __init__(self):
+        self.written = bytearray()
+
+    def write(self, data) -> None:
+        self.written += bytes(data)
+
+    def read(self, size: int = 1) -> bytes:
+        return bytes([robot.ACK_BYTE]) * size
+
+
+class FakeSearcher:
+    """
+    Stands in for the engine watchdog; plays the first legal move and records every search.
+    """
+
+    def __init__(self):
+        self.searched = []
+
+    def search(self, board: chess.Board, limit, game=None, early_stop=None, on_start=None) -> tuple:
+        self.searched.append((board.fen(), limit))
+        return next(iter(board.legal_moves)), {}
+
+
+def make_robot(journal: game_journal.NullJournal) -> robot.ChessRobot:
+    controller = robot.ChessRobot(FakeSerial(), None, watchdog=FakeSearcher())
+    controller.journal = journal
+    return controller
+
+
+def robot_move_frame(move_uci: str, board: chess.Board, status: int = robot.GAME_ONGOING) -> bytes:
+    fifth_byte = robot.get_fifth_byte(board, move_uci)
+    operand = [ord(c) for c in move_uci[0:4]] + [ord(fifth_byte), (robot.GAME_ONGOING << 4) + status]
+    return bytes(robot.encode_frame(robot.ROBOT_MOVE_INSTR, operand))
+
+
+def write_journal(path, moves, acked: bool = True, fen: str = chess.STARTING_FEN, elo: int = 0) -> None:
+    journal = game_journal.GameJournal(str(path))
+    journal.start_game("W", fen, elo)
+    for side, move_uci in moves:
+        journal.move(side, move_uci)
+    if acked:
+        journal.acked()
+    journal.close()
+
+
+def test_replay_follows_the_game():
+    state = game_journal.replay([
+        {"e": "start", "color": "W", "fen": chess.STARTING_FEN, "elo": 0},
+        {"e": "move", "by": search_stats.HUMAN, "uci": "e2e4"},
+        {"e": "move", "by": search_stats.ROBOT, "uci": "e7e5"},
+        {"e": "ack"},
+    ])
+    assert state.player_color == "W"
+    assert state.moves == [(search_stats.HUMAN, "e2e4"), (search_stats.ROBOT, "e7e5")]
+    assert state.acked
+
+
+def test_reset_is_not_resumable():
+    events = [{"e": "start", "color": None, "fen": chess.STARTING_FEN, "elo": 0}]
+    assert game_journal.replay(events) is None
+
+
+def test_end_makes_the_game_not_resumable(tmp_path):
+    path = tmp_path / "journal"
+    journal = game_journal.GameJournal(str(path))
+    journal.start_game("W", chess.STARTING_FEN, 0)
+    journal.move(search_stats.HUMAN, "e2e4")
+    journal.end()
+    journal.close()
+    assert game_journal.GameJournal(str(path)).resumable is None
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    path = tmp_path / "journal"
+    write_journal(path, [(search_stats.HUMAN, "e2e4"), (search_stats.ROBOT, "e7e5")])
+    with open(path, "ab") as f:
+        # Power failed in the middle of the next move
+        f.write(b'{"e":"move","by":"H","uci":"g1')
+
+    events, length = game_journal.read_journal(str(path))
+    assert events[-1] == {"e": "ack"}
+    assert length < path.stat().st_size
+
+    journal = game_journal.GameJournal(str(path))
+    assert journal.resumable.moves == [(search_stats.HUMAN, "e2e4"), (search_stats.ROBOT, "e7e5")]
+    # The torn event is cut off, so the next one starts on a fresh line
+    journal.move(search_stats.HUMAN, "g1f3")
+    journal.close()
+    events, length = game_journal.read_journal(str(path))
+    assert events[-1] == {"e": "move", "by": search_stats.HUMAN, "uci": "g1f3"}
+    assert length == path.stat().st_size
+
+
+def test_unacked_robot_move_is_resent(tmp_path):
+    path = tmp_path / "journal"
+    write_journal(path, [(search_stats.HUMAN, "e2e4"), (search_stats.ROBOT, "e7e5")], acked=False)
+    journal = game_journal.GameJournal(str(path))
+    assert not journal.resumable.acked
+
+    controller = make_robot(journal)
+    controller.resume(journal.resumable)
+    journal.close()
+
+    board = chess.Board()
+    board.push_uci("e2e4")
+    # The same move is sent again rather than searched for
+    assert controller.watchdog.searched == []
+    assert controller.ser.written.endswith(robot_move_frame("e7e5", board))
+    assert [move.uci() for move in controller.board.move_stack] == ["e2e4", "e7e5"]
+    state = game_journal.GameJournal(str(path)).resumable
+    assert state.moves == [(search_stats.HUMAN, "e2e4"), (search_stats.ROBOT, "e7e5")]
+    assert state.acked
+
+
+def test_acked_game_waits_for_the_human(tmp_path):
+    path = tmp_path / "journal"
+    write_journal(path, [(search_stats.HUMAN, "e2e4"), (search_stats.ROBOT, "e7e5")])
+    journal = game_journal.GameJournal(str(path))
+    controller = make_robot(journal)
+    controller.resume(journal.resumable)
+    journal.close()
+
+    resumed = bytes(robot.encode_frame(robot.RESUMED_INSTR, [robot.START_W_INSTR, 2]))
+    assert bytes(controller.ser.written) == resumed
+
+
+def test_difficulty_is_replayed(tmp_path):
+    path = tmp_path / "journal"
+    journal = game_journal.GameJournal(str(path))
+    controller = make_robot(journal)
+    controller.new_game("W")
+    controller.set_difficulty(1500)
+    journal.move(search_stats.HUMAN, "d2d4")
+    journal.close()
+
+    journal = game_journal.GameJournal(str(path))
+    assert journal.resumable.elo == 1500
+    controller = make_robot(journal)
+    controller.resume(journal.resumable)
+    journal.close()
+    assert controller.difficulty.elo == 1500
+    assert controller.record.elo == 1500
+    # The robot's reply is searched at the resumed strength
+    board = chess.Board()
+    board.push_uci("d2d4")
+    assert controller.watchdog.searched == [(board.fen(), controller.difficulty.limit(controller.limit))]
+    # The resumed journal keeps the difficulty for the next restart
+    assert game_journal.GameJournal(str(path)).resumable.elo == 1500
+
+
+def test_board_sync_restart_is_replayed(tmp_path):
+    path = tmp_path / "journal"
+    journal = game_journal.GameJournal(str(path))
+    controller = make_robot(journal)
+    controller.new_game("W")
+    # The MSP restores a position with the human to move
+    synced = chess.Board("r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3")
+    controller.board_sync(board_sync.sync_operand(synced))
+    journal.move(search_stats.HUMAN, "f1c4")
+    journal.close()
+
+    journal = game_journal.GameJournal(str(path))
+    assert journal.resumable.fen == synced.fen()
+    controller = make_robot(journal)
+    controller.resume(journal.resumable)
+    journal.close()
+    assert controller.board.root().fen() == synced.fen()
+    synced.push_uci("f1c4")
+    # The robot answers the human's move from the synced position
+    assert [fen for fen, _ in controller.watchdog.searched] == [synced.fen()]
@@ -0,0 +1,83 @@
+"""
+Move inference from the board's occupancy (BOARD_STATE).
+"""
+
+import chess
+
+import occupancy
+
+
+def occupancy_of(board: chess.Board, move_uci: str) -> int:
+    after = board.copy()
+    after.push_uci(move_uci)
+    return after.occupied
+
+
+def infer(board: chess.Board, occupied: int) -> tuple:
+    return occupancy.infer_move(occupancy.move_table(board), occupied)
+
+
+def test_every_legal_move_matches_the_board_after_it():
+    board = chess.Board("r3k2r/pPppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+    for move in board.legal_moves:
+        assert occupancy.occupancy_after(board, move) == occupancy_of(board, move.uci())
+
+
+def test_castling_kingside():
+    board = chess.Board("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    occupied = occupancy_of(board, "e1g1")
+    assert occupied & chess.BB_SQUARES[chess.F1]
+    assert not occupied & chess.BB_SQUARES[chess.H1]
+    assert infer(board, occupied) == (occupancy.MOVE_FOUND, chess.Move.from_uci("e1g1"))
+
+
+def test_castling_queenside():
+    board = chess.Board("r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1")
+    occupied = occupancy_of(board, "e8c8")
+    assert occupied & chess.BB_SQUARES[chess.D8]
+    assert not occupied & chess.BB_SQUARES[chess.A8]
+    assert infer(board, occupied) == (occupancy.MOVE_FOUND, chess.Move.from_uci("e8c8"))
+
+
+def test_en_passant_clears_the_captured_pawn():
+    board = chess.Board("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 2")
+    occupied = occupancy_of(board, "e5d6")
+    assert not occupied & chess.BB_SQUARES[chess.D5]
+    assert infer(board, occupied) == (occupancy.MOVE_FOUND, chess.Move.from_uci("e5d6"))
+
+
+def test_queen_promotion():
+    board = chess.Board("4k3/P7/8/8/8/8/8/4K3 w - - 0 1")
+    assert infer(board, occupancy_of(board, "a7a8q")) == (occupancy.MOVE_FOUND, chess.Move.from_uci("a7a8q"))
+
+
+def test_queen_promotion_with_capture():
+    board = chess.Board("1n2k3/P7/8/8/8/8/8/4K3 w - - 0 1")
+    # Promoting straight ahead or capturing on b8 leave different occupancies
+    assert infer(board, occupancy_of(board, "a7b8q")) == (occupancy.MOVE_FOUND, chess.Move.from_uci("a7b8q"))
+    assert infer(board, occupancy_of(board, "a7a8q")) == (occupancy.MOVE_FOUND, chess.Move.from_uci("a7a8q"))
+
+
+def test_underpromotions_are_left_out():
+    board = chess.Board("4k3/P7/8/8/8/8/8/4K3 w - - 0 1")
+    promotions = [move for moves in occupancy.move_table(board).values() for move in moves if move.promotion]
+    assert promotions == [chess.Move.from_uci("a7a8q")]
+
+
+def test_capture_of_either_piece_is_ambiguous():
+    # The knight on d4 can take the pawn on c6 or the one on e6
+    board = chess.Board("4k3/8/2p1p3/8/3N4/8/8/4K3 w - - 0 1")
+    result, moves = infer(board, occupancy_of(board, "d4c6"))
+    assert result == occupancy.MOVE_AMBIGUOUS
+    assert sorted(move.uci() for move in moves) == ["d4c6", "d4e6"]
+    expected = chess.BB_SQUARES[chess.D4] | chess.BB_SQUARES[chess.C6] | chess.BB_SQUARES[chess.E6]
+    assert occupancy.squares_mask(moves) == expected
+
+
+def test_illegal_occupancy():
+    board = chess.Board()
+    # A pawn lifted off e2 without being put down anywhere
+    occupied = board.occupied & ~chess.BB_SQUARES[chess.E2]
+    assert infer(board, occupied) == (occupancy.MOVE_ILLEGAL, None)
+    # Nothing moved
+    assert infer(board, board.occupied) == (occupancy.MOVE_ILLEGAL, None)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+"""
+Binary capture of all UART traffic between the Raspberry Pi and the MSP, in both directions,
+with nanosecond timestamps. Alongside each capture, a sidecar index (<capture>.idx) locates
+every instruction frame by frame number and game number, so a single game can be pulled out of
+a long capture without scanning it.
+
+Capture file layout (all integers little-endian):
+- Header: magic "GGUC", version (u16), reserved (u16), baud rate (u32), start time (u64, ns since epoch)
+- Records: timestamp (u64, ns since the start time), flags (u8), length (u16), then length data bytes
+
+Every serial read and write becomes one record. Reads that returned fewer bytes than requested
+(UART timeouts) carry FLAG_SHORT so a replay can reproduce them exactly.
+
+Index file layout: one entry per instruction frame of frame number (u32), game number (u32), offset
+of the record holding the frame's start byte (u64), timestamp (u64), flags (u8), instruction ID (u8).
+
+Usage:
+    python uart_capture.py dump CAPTURE [--game N]
+    python uart_capture.py index CAPTURE
+"""
+
+import argparse
+import struct
+import sys
+import time
+
+# FILE FORMAT DEFINES
+MAGIC          = b"GGUC"
+VERSION        = 1
+HEADER         = struct.Struct("<4sHHIQ")
+RECORD         = struct.Struct("<QBH")
+INDEX_ENTRY    = struct.Struct("<IIQQBB")
+
+# RECORD FLAGS
+FLAG_TX        = 0x01             # Set for Pi -> MSP traffic, clear for MSP -> Pi traffic
+FLAG_SHORT     = 0x02             # The read returned fewer bytes than requested (timeout)
+
+# PROTOCOL DEFINES (mirrors chess_robot_v7.py)
+START_BYTE     = 0x0A
+ACK_BYTE       = 0x0F
+RESET_INSTR    = 0x00
+START_W_INSTR  = 0x01
+START_B_INSTR  = 0x02
+EXTENDED_OP_LEN = 0x0F            # The operand length byte follows the instruction byte
+
+# Instructions from the MSP that begin a new game in the index
+GAME_BOUNDARY_INSTRS = (RESET_INSTR, START_W_INSTR, START_B_INSTR)
+
+
+def index_path(capture_path: str) -> str:
+    return capture_path + ".idx"
+
+
+def frame_length(frame: list) -> int:
+    """
+    :param frame: The bytes of a frame received so far (at least the start byte and the instruction byte)
+
+    :returns: The frame's full length, or None until an extended length byte has arrived
+    """
+    op_len = frame[1] & 0x0F
+    if op_len != EXTENDED_OP_LEN:
+        return 2 + op_len + 2
+    return 3 + frame[2] + 2 if len(frame) >= 3 else None
+
+
+class FrameScanner:
+    """
+    Reassembles instruction frames from the raw byte stream of one direction. Bytes outside of a
+    frame (ACKs, noise) are skipped, and a short read discards any partial frame, mirroring the
+    controller flushing its input buffer after a timeout.
+    """
+
+    def __init__(self):
+        self.frame = []
+        self.start_offset = 0
+        self.start_ts = 0
+
+    def feed(self, data: bytes, offset: int, ts: int, short: bool) -> list:
+        """
+        :param data: The bytes of one record
+        :param offset: The file offset of the record
+        :param ts: The timestamp of the record
+        :param short: True if the record is a short read
+
+        :returns: A list of (start offset, start timestamp, frame bytes) for every frame completed
+                  by this record
+        """
+        frames = []
+        for byte in data:
+            if not self.frame:
+                if byte != START_BYTE:
+                    continue
+                self.start_offset = offset
+                self.start_ts = ts
+            self.frame.append(byte)
+            if len(self.frame) >= 2 and len(self.frame) == frame_length(self.frame):
+                frames.append((self.start_offset, self.start_ts, bytes(self.frame)))
+                self.frame = []
+        if short:
+            self.frame = []
+        return frames
+
+
+class IndexBuilder:
+    """
+    Assigns frame and game numbers to the frames found in a capture and produces index entries.
+    """
+
+    def __init__(self):
+        self.scanners = {0: FrameScanner(), FLAG_TX: FrameScanner()}
+        self.frame_no = 0
+        self.game_no = 0
+
+    def feed(self, offset: int, ts: int, flags: int, data: bytes) -> list:
+        """
+        :returns: A list of packed index entries for the frames completed by this record
+        """
+        direction = flags & FLAG_TX
+        entries = []
+        for start_offset, start_ts, frame in self.scanners[direction].feed(data, offset, ts, flags & FLAG_SHORT):
+            instr = frame[1] >> 4
+            if direction != FLAG_TX and instr in GAME_BOUNDARY_INSTRS:
+                self.game_no += 1
+            entries.append(INDEX_ENTRY.pack(self.frame_no, self.game_no, start_offset, start_ts, direction, instr))
+            self.frame_no += 1
+        return entries
+
+
+class CaptureWriter:
+    """
+    Appends UART records to a capture file and keeps its sidecar index up to date. Both files are
+    flushed after every record so a capture survives the controller being killed.
+    """
+
+    def __init__(self, path: str, baudrate: int = 9600):
+        """
+        :param path: The capture file to create; the index is written to path + ".idx"
+        :param baudrate: The baud rate of the captured link, stored in the header
+        """
+        self.path = path
+        self._file = open(path, "wb")
+        self._index = open(index_path(path), "wb")
+        self._builder = IndexBuilder()
+        self._origin = time.perf_counter_ns()
+        self._file.write(HEADER.pack(MAGIC, VERSION, 0, baudrate, time.time_ns()))
+        self._file.flush()
+
+    def record(self, flags: int, data: bytes) -> None:
+        """
+        :param flags: FLAG_TX and/or FLAG_SHORT
+        :param data: The bytes read or written
+        """
+        ts = time.perf_counter_ns() - self._origin
+        offset = self._file.tell()
+        self._file.write(RECORD.pack(ts, flags, len(data)))
+        self._file.write(data)
+        self._file.flush()
+
+        entries = self._builder.feed(offset, ts, flags, data)
+        if entries:
+            self._index.write(b"".join(entries))
+            self._index.flush()
+
+    def close(self) -> None:
+        self._file.close()
+        self._index.close()
+
+
+class CaptureSerial:
+    """
+    Wraps a serial port so every read and write is recorded by a CaptureWriter. All other
+    attributes are passed through to the wrapped port.
+    """
+
+    def __init__(self, ser, writer: CaptureWriter):
+        self._ser = ser
+        self._writer = writer
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._ser.read(size)
+        self._writer.record(FLAG_SHORT if len(data) < size else 0, bytes(data))
+        return data
+
+    def write(self, data) -> int:
+        written = self._ser.write(data)
+        self._writer.record(FLAG_TX, bytes(data))
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+
+class CaptureReader:
+    """
+    Reads a capture file written by CaptureWriter.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The capture file to read
+
+        :raises ValueError: If the file is not a capture or has an unsupported version
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._data = f.read()
+        magic, version, _, self.baudrate, self.start_ns = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a UART capture")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported capture version {version}")
+
+    def records(self, start: int = HEADER.size, end: int = None) -> list:
+        """
+        :param start: The file offset of the first record to read
+        :param end: The file offset to stop at (defaults to the end of the file)
+
+        :returns: A list of (offset, timestamp, flags, data) tuples. A record truncated by a crash
+                  at the end of the file is dropped.
+        """
+        end = len(self._data) if end is None else end
+        records = []
+        offset = start
+        while offset + RECORD.size <= end:
+            ts, flags, length = RECORD.unpack_from(self._data, offset)
+            data_start = offset + RECORD.size
+            if data_start + length > len(self._data):
+                break
+            records.append((offset, ts, flags, self._data[data_start:data_start + length]))
+            offset = data_start + length
+        return records
+
+    def index(self) -> list:
+        """
+        Loads the sidecar index, rebuilding it in memory if it is missing.
+
+        :returns: A list of (frame number, game number, offset, timestamp, flags, instruction ID) tuples
+        """
+        try:
+            with open(index_path(self.path), "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            raw = build_index(self.records())
+        usable = len(raw) - len(raw) % INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(raw, i) for i in range(0, usable, INDEX_ENTRY.size)]
+
+    def game_range(self, game_no: int) -> tuple:
+        """
+        :param game_no: The game number from the index
+
+        :returns: The (start, end) file offsets of the records belonging to the game; end is None
+                  for the last game in the capture
+
+        :raises KeyError: If the game is not in the capture
+        """
+        starts = {}
+        for _, game, offset, _, _, _ in self.index():
+            starts.setdefault(game, offset)
+        if game_no not in starts:
+            raise KeyError(f"Game {game_no} not found; capture has games {sorted(starts)}")
+        later = [offset for game, offset in starts.items() if game > game_no]
+        return starts[game_no], (min(later) if later else None)
+
+
+def build_index(records: list) -> bytes:
+    """
+    :param records: Records as returned by CaptureReader.records()
+
+    :returns: The packed index for the records
+    """
+    builder = IndexBuilder()
+    return b"".join(b"".join(builder.feed(offset, ts, flags, data)) for offset, ts, flags, data in records)
+
+
+def dump(reader: CaptureReader, game_no: int = None) -> None:
+    """
+    Prints every record in a capture (or in one game of it) with its timestamp and direction.
+    """
+    start, end = reader.game_range(game_no) if game_no is not None else (HEADER.size, None)
+    for offset, ts, flags, data in reader.records(start, end):
+        direction = "Pi -> MSP" if flags & FLAG_TX else "MSP -> Pi"
+        short = " (short read)" if flags & FLAG_SHORT else ""
+        print(f"{ts / 1e9:12.6f} s | {direction} | Hex: {[hex(c) for c in data]}{short}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect UART captures written by chess_robot_v7.py --capture")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    dump_parser = subparsers.add_parser("dump", help="Print the records of a capture")
+    dump_parser.add_argument("capture")
+    dump_parser.add_argument("--game", type=int, default=None, help="Only print the given game number")
+    index_parser = subparsers.add_parser("index", help="Rebuild the sidecar index of a capture")
+    index_parser.add_argument("capture")
+    args = parser.parse_args()
+
+    reader = CaptureReader(args.capture)
+    if args.command == "dump":
+        dump(reader, args.game)
+    else:
+        raw = build_index(reader.records())
+        with open(index_path(args.capture), "wb") as f:
+            f.write(raw)
+        print(f"Indexed {len(raw) // INDEX_ENTRY.size} frames in {index_path(args.capture)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Replays a UART capture (see uart_capture.py) through the controller's frame decoder and game
+logic as fast as possible. The MSP's side of the capture is fed to the controller as its serial
+input, and the robot's moves are taken from the ROBOT_MOVE instructions in the capture instead of
+from Stockfish, so a replay is deterministic and needs no engine. Every byte the controller sends
+is compared against what it sent when the capture was made.
+
+Exits with status 0 if the replayed output matches the capture, 1 otherwise, so field captures
+can be used directly as regression tests.
+
+Usage:
+    python uart_replay.py CAPTURE [--game N] [--fen FEN] [--verbose]
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+
+import chess
+import chess_robot_v7 as robot
+import uart_capture
+
+
+class ReplayFinished(Exception):
+    """
+    Raised by ReplaySerial when the controller reads past the end of the capture.
+    """
+
+
+class ReplaySerial:
+    """
+    A stand-in for the serial port which returns the MSP -> Pi records of a capture and collects
+    everything the controller writes.
+    """
+
+    def __init__(self, records: list):
+        """
+        :param records: Records as returned by CaptureReader.records()
+        """
+        self._rx = [(flags, data) for _, _, flags, data in records if not flags & uart_capture.FLAG_TX]
+        self._record = 0
+        self._pos = 0
+        self.written = bytearray()
+        self.is_open = True
+        self.baudrate = 9600
+
+    def read(self, size: int = 1) -> bytes:
+        """
+        Returns up to size bytes. Short reads in the capture end a read early, just as the UART
+        timeout did on the robot.
+
+        :raises ReplayFinished: When the capture has no more MSP -> Pi records
+        """
+        data = bytearray()
+        while len(data) < size:
+            if self._record >= len(self._rx):
+                if data:
+                    return bytes(data)
+                raise ReplayFinished()
+            flags, chunk = self._rx[self._record]
+            take = chunk[self._pos:self._pos + size - len(data)]
+            data += take
+            self._pos += len(take)
+            if self._pos >= len(chunk):
+                self._record += 1
+                self._pos = 0
+                if flags & uart_capture.FLAG_SHORT:
+                    break
+        return bytes(data)
+
+    def write(self, data) -> int:
+        self.written += bytes(data)
+        return len(data)
+
+    def reset_input_buffer(self) -> None:
+        # Bytes discarded by a flush on the robot were never read, so they are not in the capture
+        pass
+
+    def reset_output_buffer(self) -> None:
+        pass
+
+
+class ReplayRobot(robot.ChessRobot):
+    """
+    A ChessRobot whose moves come from the ROBOT_MOVE instructions in a capture.
+    """
+
+    def __init__(self, ser: ReplaySerial, expected: bytes, board: chess.Board = None):
+        """
+        :param ser: The replay serial port
+        :param expected: Everything the controller sent in the capture
+        :param board: The board to start from
+        """
+        super().__init__(ser, None, board)
+        self.expected = expected
+
+    def think(self) -> tuple:
+        """
+        Returns the move from the next ROBOT_MOVE instruction the controller sent in the capture,
+        looking forward from the point the replay has reached.
+        """
+        move = next_robot_move(self.expected, len(self.ser.written))
+        if move is None:
+            raise ReplayFinished("The controller asked for more robot moves than the capture contains")
+        return move, {}
+
+
+def next_robot_move(sent: bytes, pos: int) -> str:
+    """
+    :param sent: Everything the controller sent in the capture
+    :param pos: The offset to start looking from; must be at a frame boundary or an ACK byte
+
+    :returns: The robot's move, in UCI notation, from the first ROBOT_MOVE instruction after pos
+              that carries a move (game over fillers are skipped), or None if there is none
+    """
+    while pos < len(sent):
+        if sent[pos] != robot.START_BYTE:
+            pos += 1
+            continue
+        if pos + 1 >= len(sent):
+            return None
+        length = uart_capture.frame_length(sent[pos:pos + 3])
+        if length is None:
+            return None
+        frame = sent[pos:pos + length]
+        pos += len(frame)
+        if frame[1] >> 4 == robot.ROBOT_MOVE_INSTR and len(frame) >= 7 and frame[2] != ord('_'):
+            move = frame[2:6].decode("ascii")
+            if chr(frame[6]) in "qQ":
+                move += "q"
+            return move
+    return None
+
+
+def first_difference(expected: bytes, actual: bytes) -> int:
+    """
+    :returns: The offset of the first differing byte, or -1 if the byte strings are equal
+    """
+    for i, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return i
+    return -1 if len(expected) == len(actual) else min(len(expected), len(actual))
+
+
+def replay(reader: uart_capture.CaptureReader, game_no: int = None, fen: str = None, verbose: bool = False) -> bool:
+    """
+    Replays a capture, or one game of it, through the controller.
+
+    :param reader: The capture to replay
+    :param game_no: The game number to replay, or None for the whole capture
+    :param fen: The FEN the controller was started with (only used when replaying from the start)
+    :param verbose: If True, the controller's log is printed instead of being discarded
+
+    :returns: True if the controller's output matched the capture
+    """
+    start, end = reader.game_range(game_no) if game_no is not None else (uart_capture.HEADER.size, None)
+    records = reader.records(start, end)
+    expected = b"".join(data for _, _, flags, data in records if flags & uart_capture.FLAG_TX)
+
+    ser = ReplaySerial(records)
+    board = chess.Board(fen) if fen is not None and game_no is None else None
+    controller = ReplayRobot(ser, expected, board)
+
+    frames = 0
+    log = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    replay_start = time.perf_counter()
+    with log:
+        try:
+            while True:
+                if controller.step():
+                    frames += 1
+        except ReplayFinished:
+            pass
+    elapsed = time.perf_counter() - replay_start
+
+    print(f"Replayed {frames} instructions in {elapsed * 1000:.1f} ms ({frames / max(elapsed, 1e-9):.0f} instructions/s)")
+    diff = first_difference(expected, bytes(ser.written))
+    if diff == -1:
+        print(f"Output matches the capture ({len(expected)} bytes)")
+        return True
+    print(f"Output differs from the capture at byte {diff}:")
+    print(f"  Captured: {[hex(c) for c in expected[diff:diff + 10]]}")
+    print(f"  Replayed: {[hex(c) for c in ser.written[diff:diff + 10]]}")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a UART capture through the controller logic")
+    parser.add_argument("capture")
+    parser.add_argument("--game", type=int, default=None, help="Only replay the given game number")
+    parser.add_argument("--fen", default=None, help="The FEN the controller was started with, if any")
+    parser.add_argument("--verbose", action="store_true", help="Print the controller's log")
+    args = parser.parse_args()
+
+    reader = uart_capture.CaptureReader(args.capture)
+    return 0 if replay(reader, args.game, args.fen, args.verbose) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())